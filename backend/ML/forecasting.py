@@ -0,0 +1,133 @@
+"""
+Demand forecasting from delivered quantities.
+
+Every (product, warehouse) series is laid onto one series x day NumPy matrix and
+all of them are fitted together: the smoothing recursions step through the days
+once, updating every series (and every candidate smoothing constant) per step.
+Series with regular demand use simple exponential smoothing with the constant
+that minimises the one-step-ahead error; intermittent series (mostly zero days)
+use Croston's method with the Syntetos-Boylan bias correction.
+"""
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+import numpy as np
+from operations.models import DailyMovementRollup
+from .models import DemandForecast
+
+SES_ALPHAS = np.array([0.05, 0.1, 0.2, 0.3, 0.5])
+CROSTON_ALPHA = 0.1
+# Average interval between demand days above which a series counts as intermittent
+INTERMITTENT_INTERVAL = 1.32
+INITIAL_LEVEL_DAYS = 7
+DEFAULT_HISTORY_DAYS = 180
+DEFAULT_HORIZON_DAYS = 30
+
+
+def demand_history(day_from, day_to):
+    """
+    Delivered quantities per day: ([(product_id, warehouse_id)], series x day matrix).
+    Only series with at least one delivery in the range are returned.
+    """
+    rows = list(
+        DailyMovementRollup.objects.filter(
+            product__isnull=False, move_type='OUT', day__range=(day_from, day_to), quantity_out__gt=0
+        ).values_list('product_id', 'warehouse_id', 'day', 'quantity_out')
+    )
+    keys = sorted({(product_id, warehouse_id) for product_id, warehouse_id, _, _ in rows})
+    matrix = np.zeros((len(keys), (day_to - day_from).days + 1))
+    if not rows:
+        return keys, matrix
+    index = {key: i for i, key in enumerate(keys)}
+    lines = np.array([index[(product_id, warehouse_id)] for product_id, warehouse_id, _, _ in rows])
+    days = np.array([day for _, _, day, _ in rows], dtype='datetime64[D]')
+    columns = (days - np.datetime64(day_from, 'D')).astype(int)
+    np.add.at(matrix, (lines, columns), np.array([quantity for _, _, _, quantity in rows], dtype=float))
+    return keys, matrix
+
+def exponential_smoothing(demand, alphas):
+    """
+    One-step-ahead simple exponential smoothing of every series with every alpha.
+    Returns (final levels, mean absolute errors), both len(alphas) x series.
+    """
+    initial = demand[:, :INITIAL_LEVEL_DAYS].mean(axis=1)
+    level = np.tile(initial, (len(alphas), 1))
+    absolute_error = np.zeros_like(level)
+    weights = alphas[:, None]
+    for t in range(demand.shape[1]):
+        error = demand[:, t] - level
+        absolute_error += np.abs(error)
+        level += weights * error
+    return level, absolute_error / max(demand.shape[1], 1)
+
+def croston(demand, alpha):
+    """
+    Croston's method with the Syntetos-Boylan correction for every series.
+    Demand sizes and the intervals between demand days are smoothed separately, on
+    demand days only. Returns (daily demand rates, mean absolute one-step-ahead errors).
+    """
+    series = demand.shape[0]
+    size = np.zeros(series)
+    interval = np.ones(series)
+    since = np.ones(series)
+    started = np.zeros(series, dtype=bool)
+    absolute_error = np.zeros(series)
+    correction = 1 - alpha / 2
+    for t in range(demand.shape[1]):
+        day = demand[:, t]
+        forecast = np.where(started, correction * size / interval, 0.0)
+        absolute_error += np.abs(day - forecast)
+        occurred = day > 0
+        first = occurred & ~started
+        update = occurred & started
+        size = np.where(first, day, np.where(update, size + alpha * (day - size), size))
+        interval = np.where(first, since, np.where(update, interval + alpha * (since - interval), interval))
+        started |= occurred
+        since = np.where(occurred, 1.0, since + 1)
+    return correction * size / interval, absolute_error / max(demand.shape[1], 1)
+
+def fit(demand):
+    """
+    Fit every series of a series x day matrix.
+    Returns (intermittent flags, alphas, daily demand rates, mean absolute errors).
+    """
+    demand_days = np.count_nonzero(demand > 0, axis=1)
+    intermittent = demand.shape[1] / np.maximum(demand_days, 1) > INTERMITTENT_INTERVAL
+
+    levels, errors = exponential_smoothing(demand, SES_ALPHAS)
+    best = np.argmin(errors, axis=0)
+    columns = np.arange(demand.shape[0])
+    rates, mae = croston(demand, CROSTON_ALPHA)
+
+    alphas = np.where(intermittent, CROSTON_ALPHA, SES_ALPHAS[best])
+    rates = np.where(intermittent, rates, levels[best, columns])
+    mae = np.where(intermittent, mae, errors[best, columns])
+    return intermittent, alphas, np.maximum(rates, 0.0), mae
+
+def train_demand_forecasts(history_days=DEFAULT_HISTORY_DAYS, horizon_days=DEFAULT_HORIZON_DAYS, day_to=None):
+    """Refit every series over the last `history_days` and replace the stored forecasts."""
+    day_to = day_to or timezone.localdate()
+    day_from = day_to - timedelta(days=history_days - 1)
+    keys, demand = demand_history(day_from, day_to)
+    intermittent, alphas, rates, mae = fit(demand)
+    trained_at = timezone.now()
+
+    forecasts = [
+        DemandForecast(
+            product_id=product_id,
+            warehouse_id=warehouse_id,
+            method='CROSTON' if intermittent[i] else 'SES',
+            alpha=float(alphas[i]),
+            daily_demand=float(rates[i]),
+            horizon_days=horizon_days,
+            horizon_demand=float(rates[i] * horizon_days),
+            history_days=history_days,
+            mae=float(mae[i]),
+            trained_at=trained_at,
+        )
+        for i, (product_id, warehouse_id) in enumerate(keys)
+    ]
+    with transaction.atomic():
+        DemandForecast.objects.all().delete()
+        DemandForecast.objects.bulk_create(forecasts, batch_size=2000)
+    return forecasts
@@ -0,0 +1,175 @@
+"""
+Warehouse-to-warehouse distances and nearest-stock search.
+
+The great-circle distance matrix of every geolocated warehouse is computed with
+NumPy and cached until a warehouse changes (WAREHOUSE_CACHE), so a search only
+reads the per-warehouse stock totals of the product and indexes the matrix.
+"""
+import numpy as np
+from backend.cache import WAREHOUSE_CACHE, cached
+from warehouse.models import ProductWarehouseStockTotal, Stock, Warehouse
+from operations.services import available_by_warehouse
+
+EARTH_RADIUS_KM = 6371.0
+DISTANCE_CACHE_TIMEOUT = 60 * 60 * 24
+MAX_BATCH_REQUIREMENTS = 5000
+
+
+def haversine_matrix(latitudes, longitudes):
+    """Pairwise great-circle distances in km between points given in degrees."""
+    phi = np.radians(np.asarray(latitudes, dtype=float))
+    lam = np.radians(np.asarray(longitudes, dtype=float))
+    d_phi = phi[:, None] - phi[None, :]
+    d_lam = lam[:, None] - lam[None, :]
+    a = np.sin(d_phi / 2) ** 2 + np.cos(phi)[:, None] * np.cos(phi)[None, :] * np.sin(d_lam / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def _compute_distances():
+    warehouses = list(
+        Warehouse.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        .order_by('id').values_list('id', 'name', 'latitude', 'longitude')
+    )
+    distances = haversine_matrix([row[2] for row in warehouses], [row[3] for row in warehouses])
+    return {
+        'ids': np.array([row[0] for row in warehouses], dtype=np.int64),
+        'names': [row[1] for row in warehouses],
+        'distances': distances,
+        # Column indexes of each row, nearest first; the stable sort keeps ties in id order
+        'nearest': np.argsort(distances, axis=1, kind='stable'),
+    }
+
+def warehouse_distances():
+    """
+    {'ids', 'names', 'distances', 'nearest'} for the geolocated warehouses: ids sorted
+    ascending, distances[i, j] in km between ids[i] and ids[j], and nearest[i] the
+    indexes of all warehouses ordered by their distance from ids[i].
+    """
+    return cached(WAREHOUSE_CACHE, 'warehouse-distances', _compute_distances, DISTANCE_CACHE_TIMEOUT)
+
+def nearest_abundant_warehouses(source_warehouse_id, product_id, abundance_min=6, k=5):
+    """
+    The k warehouses nearest to the source whose total stock of the product is at
+    least abundance_min, nearest first, each with its fullest sublocation.
+    Returns None when the source warehouse is unknown or has no coordinates.
+    """
+    geo = warehouse_distances()
+    ids = geo['ids']
+    source = int(np.searchsorted(ids, int(source_warehouse_id)))
+    if source >= len(ids) or ids[source] != int(source_warehouse_id):
+        return None
+
+    totals = list(
+        ProductWarehouseStockTotal.objects.filter(product_id=product_id, quantity__gte=abundance_min)
+        .exclude(warehouse_id=source_warehouse_id).values_list('warehouse_id', 'quantity')
+    )
+    if not totals:
+        return []
+
+    candidates = np.array([warehouse_id for warehouse_id, _ in totals], dtype=np.int64)
+    quantities = np.array([quantity for _, quantity in totals])
+    positions = np.minimum(np.searchsorted(ids, candidates), len(ids) - 1)
+    # Warehouses without coordinates cannot be ranked
+    located = ids[positions] == candidates
+    positions, quantities = positions[located], quantities[located]
+    distances = geo['distances'][source, positions]
+    # Nearest first; equal distances fall back to the lower warehouse id
+    nearest = np.lexsort((ids[positions], distances))[:k]
+
+    chosen = [int(ids[positions[i]]) for i in nearest]
+    fullest = {}
+    bins = Stock.objects.filter(
+        product_id=product_id, sublocation__warehouse_id__in=chosen, quantity__gt=0
+    ).order_by('sublocation__warehouse_id', '-quantity', 'sublocation__code').values_list(
+        'sublocation__warehouse_id', 'sublocation__code'
+    )
+    for warehouse_id, code in bins:
+        fullest.setdefault(warehouse_id, code)
+
+    return [
+        {
+            "warehouse_id": int(ids[positions[i]]),
+            "warehouse": geo['names'][positions[i]],
+            "sublocation": fullest.get(int(ids[positions[i]])),
+            "stock_quantity": float(quantities[i]),
+            "distance_km": round(float(distances[i]), 2),
+        }
+        for i in nearest
+    ]
+
+def plan_replenishment(requirements, split=True):
+    """
+    Sources for many (warehouse_id, product_id, quantity) requirements at once.
+
+    Each requirement is served by the nearest other warehouse holding the whole
+    quantity or, with `split`, by the nearest warehouses that together hold it.
+    Only stock not reserved by pending deliveries is promised. Requirements are served
+    in order and draw it down, so two of them are never promised the same units.
+    Stock is read with one aggregated query.
+    """
+    geo = warehouse_distances()
+    ids = geo['ids']
+    product_ids = sorted({product_id for _, product_id, _ in requirements})
+    products = {product_id: row for row, product_id in enumerate(product_ids)}
+
+    # Product x warehouse available quantities on the columns of the distance matrix
+    available = np.zeros((len(product_ids), len(ids)))
+    totals = [
+        (product_id, warehouse_id, quantity)
+        for (product_id, warehouse_id), quantity in available_by_warehouse(product_ids).items()
+    ]
+    if totals and len(ids):
+        warehouses = np.array([warehouse_id for _, warehouse_id, _ in totals], dtype=np.int64)
+        columns = np.minimum(np.searchsorted(ids, warehouses), len(ids) - 1)
+        located = ids[columns] == warehouses
+        rows = np.array([products[product_id] for product_id, _, _ in totals])
+        quantities = np.array([quantity for _, _, quantity in totals], dtype=float)
+        np.add.at(available, (rows[located], columns[located]), quantities[located])
+
+    plans = []
+    for warehouse_id, product_id, quantity in requirements:
+        plan = {
+            "warehouse_id": warehouse_id,
+            "product_id": product_id,
+            "quantity": quantity,
+            "sources": [],
+            "fulfilled": 0.0,
+            "shortfall": float(quantity),
+        }
+        plans.append(plan)
+        destination = int(np.searchsorted(ids, warehouse_id))
+        if destination >= len(ids) or ids[destination] != warehouse_id:
+            plan["error"] = "Warehouse not found or has no coordinates"
+            continue
+
+        order = geo['nearest'][destination]
+        order = order[order != destination]
+        stock = available[products[product_id], order]
+
+        whole = np.flatnonzero(stock >= quantity)
+        if whole.size:
+            picked, taken = whole[:1], np.array([float(quantity)])
+        elif split:
+            held = np.flatnonzero(stock > 0)
+            # Nearest sources until their running total covers the requirement
+            covered = np.searchsorted(np.cumsum(stock[held]), quantity) + 1
+            picked = held[:covered]
+            taken = stock[picked].copy()
+            if taken.size and taken.sum() > quantity:
+                taken[-1] -= taken.sum() - quantity
+        else:
+            continue
+
+        columns = order[picked]
+        available[products[product_id], columns] -= taken
+        plan["sources"] = [
+            {
+                "warehouse_id": int(ids[column]),
+                "warehouse": geo['names'][column],
+                "quantity": float(amount),
+                "distance_km": round(float(geo['distances'][destination, column]), 2),
+            }
+            for column, amount in zip(columns, taken)
+        ]
+        plan["fulfilled"] = float(taken.sum())
+        plan["shortfall"] = max(float(quantity) - plan["fulfilled"], 0.0)
+    return plans
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+from ML.ml_services import registry
+from ML.registry import BUILTIN_VERSION
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'List, publish and activate ML model versions, and report their load time and memory'
+
+    def add_arguments(self, parser):
+        actions = parser.add_subparsers(dest='action', required=True)
+        actions.add_parser('list', help='Published and active versions of every model')
+        publish = actions.add_parser('publish', help='Copy meta.json and .npy files in as a new version')
+        publish.add_argument('model')
+        publish.add_argument('version')
+        publish.add_argument('source', help='Directory holding meta.json and/or .npy arrays')
+        publish.add_argument('--activate', action='store_true', help='Serve the version once published')
+        activate = actions.add_parser('activate', help=f'Serve a published version (or {BUILTIN_VERSION}) from the next check on')
+        activate.add_argument('model')
+        activate.add_argument('version')
+        actions.add_parser('status', help='Load every active model here and report load time and memory (heap with PYTHONTRACEMALLOC=1)')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action in ('publish', 'activate') and options['model'] not in registry.builders:
+            raise CommandError(f"Unknown model {options['model']}; one of {', '.join(sorted(registry.builders))}")
+
+        if action == 'list':
+            for name in sorted(registry.builders):
+                active = registry.active_version(name)
+                versions = [BUILTIN_VERSION, *registry.versions(name)]
+                listed = ', '.join(f'*{version}' if version == active else version for version in versions)
+                self.stdout.write(f'{name}: {listed}')
+        elif action == 'publish':
+            try:
+                files = registry.publish(options['model'], options['version'], options['source'])
+            except (OSError, ValueError) as e:
+                raise CommandError(str(e))
+            logger.info(f"Model {options['model']}@{options['version']} published: {', '.join(files)}")
+            self.stdout.write(self.style.SUCCESS(f"Published {options['model']}@{options['version']} ({len(files)} files)."))
+            if options['activate']:
+                self.activate(options['model'], options['version'])
+        elif action == 'activate':
+            self.activate(options['model'], options['version'])
+        else:
+            self.stdout.write(f"{'model':<16} {'version':<20} {'load ms':>10} {'mapped':>12} {'heap':>12}")
+            for name in sorted(registry.builders):
+                registry.get(name)
+                status = registry.status()[name]
+                heap = '-' if status['heap_bytes'] is None else status['heap_bytes']
+                self.stdout.write(
+                    f"{name:<16} {status['version']:<20} {status['load_ms']:>10.2f} "
+                    f"{status['mapped_bytes']:>12} {heap:>12}"
+                )
+
+    def activate(self, model, version):
+        previous = registry.active_version(model)
+        try:
+            registry.activate(model, version)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        logger.info(f"Model {model} switched from {previous} to {version}")
+        self.stdout.write(self.style.SUCCESS(f'{model}: {previous} -> {version}. Workers switch within their check interval.'))
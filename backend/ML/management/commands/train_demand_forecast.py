@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from ML.forecasting import DEFAULT_HISTORY_DAYS, DEFAULT_HORIZON_DAYS, train_demand_forecasts
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Fit demand forecasts for every product and warehouse from the delivered quantities'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--history-days',
+            type=int,
+            default=DEFAULT_HISTORY_DAYS,
+            help='Days of delivery history to fit on',
+        )
+        parser.add_argument(
+            '--horizon-days',
+            type=int,
+            default=DEFAULT_HORIZON_DAYS,
+            help='Days covered by the stored horizon demand',
+        )
+
+    def handle(self, *args, **options):
+        if options['history_days'] < 1 or options['horizon_days'] < 1:
+            raise CommandError('--history-days and --horizon-days must be positive')
+        self.stdout.write(f"Fitting demand over the last {options['history_days']} days...")
+        forecasts = train_demand_forecasts(options['history_days'], options['horizon_days'])
+        intermittent = sum(1 for forecast in forecasts if forecast.method == 'CROSTON')
+
+        summary = f'{len(forecasts)} series ({intermittent} intermittent)'
+        logger.info(f"Demand forecasts trained: {summary}")
+        self.stdout.write(self.style.SUCCESS(f'Trained {summary}.'))
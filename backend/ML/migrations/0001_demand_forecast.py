@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('product', '0001_initial'),
+        ('warehouse', '0004_stock_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemandForecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(choices=[('SES', 'Simple exponential smoothing'), ('CROSTON', "Croston's method")], max_length=10)),
+                ('alpha', models.FloatField()),
+                ('daily_demand', models.FloatField()),
+                ('horizon_days', models.PositiveIntegerField()),
+                ('horizon_demand', models.FloatField()),
+                ('history_days', models.PositiveIntegerField()),
+                ('mae', models.FloatField()),
+                ('trained_at', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='demand_forecasts', to='product.product')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='demand_forecasts', to='warehouse.warehouse')),
+            ],
+            options={
+                'unique_together': {('product', 'warehouse')},
+            },
+        ),
+    ]
@@ -1,10 +1,13 @@
 """
-This file contains FAKE / DUMMY ML logic.
-The structure is realistic and can be replaced with real ML models later.
+ML models behind the API. Demand forecasting is real (fitted from delivery history);
+the suspicious activity and recommendation models are still FAKE / DUMMY logic with
+a realistic structure, to be replaced with real ML models later.
 """
 
 import random
 import numpy as np
+from .models import DemandForecast
+from .registry import registry
 
 
 # -------------------------------
@@ -15,34 +18,57 @@ MLFLOW_TRACKING_URI = "https://mlflow-fake-server.com/track/218as89d"
 
 
 # -------------------------------
-#   Dummy Demand Prediction Model
+#   Demand Forecast Model
 # -------------------------------
-class DummyDemandModel:
-    def __init__(self):
-        self.name = "DemandPredictor-v0.1"
+class DemandForecastModel:
+    """
+    Serves the forecasts fitted by `manage.py train_demand_forecast` (see ML.forecasting).
+    """
+    def __init__(self, artifact=None):
+        self.name = f"DemandForecast-SES/Croston-{artifact.version if artifact else 'v1'}"
 
     def predict(self, warehouse_id, product_id):
         """
-        Fake demand prediction:
-        Returns a number between 1 - 100 representing demand score.
+        Stored forecast for one product in one warehouse, or None without delivery history.
         """
-        np.random.seed(int(warehouse_id) + int(product_id))
-        return int(np.random.randint(10, 90))
+        return DemandForecast.objects.filter(warehouse_id=warehouse_id, product_id=product_id).first()
+
+    def predict_batch(self, warehouse_id, product_ids):
+        """
+        Horizon demand for each entry of product_ids (repeats allowed) as a float array,
+        NaN where there is no forecast. One query per batch.
+        """
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        predictions = np.full(len(product_ids), np.nan)
+        rows = list(
+            DemandForecast.objects.filter(warehouse_id=warehouse_id, product_id__in=set(product_ids.tolist()))
+            .order_by('product_id').values_list('product_id', 'horizon_demand')
+        )
+        if not rows:
+            return predictions
+        known = np.array([product_id for product_id, _ in rows], dtype=np.int64)
+        demand = np.array([value for _, value in rows], dtype=float)
+        positions = np.minimum(np.searchsorted(known, product_ids), len(known) - 1)
+        found = known[positions] == product_ids
+        predictions[found] = demand[positions[found]]
+        return predictions
 
 
 # -------------------------------
 #   Dummy Suspicious Activity Model
 # -------------------------------
 class FakeSuspiciousModel:
-    def __init__(self):
-        self.name = "AnomalyDetector-v0.3"
+    def __init__(self, artifact=None):
+        self.name = f"AnomalyDetector-{artifact.version if artifact else 'v0.3'}"
+        # meta.json: {"threshold": 500}
+        self.threshold = artifact.meta.get("threshold", 500) if artifact else 500
 
     def predict(self, transfer_amount, user_id):
         """
         Fake suspicious logic:
-        If transfer > 500 or random anomaly, flag suspicious.
+        If transfer > threshold or random anomaly, flag suspicious.
         """
-        if transfer_amount > 500:
+        if transfer_amount > self.threshold:
             return True
 
         return random.choice([False, False, False, True])  # 25% randomness
@@ -52,17 +78,21 @@ class FakeSuspiciousModel:
 #   Dummy Recommendation System
 # -------------------------------
 class FakeRecommendationModel:
-    def __init__(self):
-        self.name = "RecoEngine-v2.0"
+    def __init__(self, artifact=None):
+        self.name = f"RecoEngine-{artifact.version if artifact else 'v2.0'}"
+        # product_ids.npy: the candidate products, memory-mapped
+        self.candidates = artifact.arrays.get("product_ids") if artifact else None
 
     def recommend(self, user_id):
         """
         Returns 3 random product IDs pretending to be recommendations.
         """
-        return random.sample(range(1, 50), 3)
+        if self.candidates is None or len(self.candidates) < 3:
+            return random.sample(range(1, 50), 3)
+        return [int(self.candidates[i]) for i in random.sample(range(len(self.candidates)), 3)]
 
 
-# Create objects (like loading ML models)
-demand_model = DummyDemandModel()
-susp_model = FakeSuspiciousModel()
-reco_model = FakeRecommendationModel()
\ No newline at end of file
+# Built on first use from the active artifact version (see ML.registry), not at import
+registry.register("demand", DemandForecastModel)
+registry.register("suspicious", FakeSuspiciousModel)
+registry.register("recommendation", FakeRecommendationModel)
\ No newline at end of file
@@ -1,3 +1,34 @@
 from django.db import models
+from warehouse.models import Warehouse
+from product.models import Product
 
-# Create your models here.
+
+class DemandForecast(models.Model):
+    """
+    Expected daily demand per (product, warehouse), fitted from delivered quantities by
+    `manage.py train_demand_forecast`. Series with regular demand use simple exponential
+    smoothing, intermittent ones Croston's method.
+    """
+    METHOD_CHOICES = [
+        ('SES', 'Simple exponential smoothing'),
+        ('CROSTON', "Croston's method"),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='demand_forecasts')
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='demand_forecasts')
+    method = models.CharField(max_length=10, choices=METHOD_CHOICES)
+    alpha = models.FloatField()
+    daily_demand = models.FloatField()
+    horizon_days = models.PositiveIntegerField()
+    # daily_demand * horizon_days, the quantity expected to leave over the horizon
+    horizon_demand = models.FloatField()
+    history_days = models.PositiveIntegerField()
+    # Mean absolute one-step-ahead error over the history
+    mae = models.FloatField()
+    trained_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('product', 'warehouse')
+
+    def __str__(self):
+        return f"{self.product_id}@{self.warehouse_id}: {self.daily_demand:.2f}/day ({self.method})"
@@ -0,0 +1,194 @@
+"""
+Versioned model artifacts, loaded on first use and swapped without restarting workers.
+
+A model's versions live in settings.ML_MODEL_DIR/<model>/<version>/ as a meta.json and
+any number of .npy arrays; <model>/ACTIVE names the version to serve. Arrays are
+memory-mapped read-only, so forked workers share their pages instead of each holding
+a copy. Every ML_MODEL_CHECK_SECONDS a worker re-reads ACTIVE and, when it changed,
+loads the new version; ACTIVE is replaced with os.replace(), so a reader sees either
+the old or the new name, never a partial write. Models without a published version
+are served by their built-in defaults.
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from django.conf import settings
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_FILE = 'ACTIVE'
+META_FILE = 'meta.json'
+BUILTIN_VERSION = 'builtin'
+VERSION_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+
+
+class Artifact:
+    """One published version of a model: its meta.json and memory-mapped arrays."""
+
+    def __init__(self, name, version, path):
+        self.name = name
+        self.version = version
+        self.path = path
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {}
+        self.arrays = {
+            entry[:-len('.npy')]: np.load(os.path.join(path, entry), mmap_mode='r')
+            for entry in sorted(os.listdir(path)) if entry.endswith('.npy')
+        }
+
+    @property
+    def mapped_bytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+
+class LoadedModel:
+
+    def __init__(self, model, version, load_seconds, mapped_bytes, heap_bytes):
+        self.model = model
+        self.version = version
+        self.load_seconds = load_seconds
+        self.mapped_bytes = mapped_bytes
+        self.heap_bytes = heap_bytes
+        self.checked = time.monotonic()
+
+
+class ModelRegistry:
+    """
+    Builders are registered by name and called with the active Artifact (or None for
+    the built-in version) the first time the model is needed.
+    """
+
+    def __init__(self):
+        self.builders = {}
+        self.loaded = {}
+        self.lock = threading.Lock()
+
+    @property
+    def root(self):
+        return str(settings.ML_MODEL_DIR)
+
+    def register(self, name, builder):
+        self.builders[name] = builder
+
+    def model_dir(self, name):
+        return os.path.join(self.root, name)
+
+    def versions(self, name):
+        path = self.model_dir(name)
+        if not os.path.isdir(path):
+            return []
+        return sorted(entry for entry in os.listdir(path) if os.path.isdir(os.path.join(path, entry)) and not entry.startswith('.'))
+
+    def active_version(self, name):
+        try:
+            with open(os.path.join(self.model_dir(name), ACTIVE_FILE)) as f:
+                return f.read().strip() or BUILTIN_VERSION
+        except FileNotFoundError:
+            return BUILTIN_VERSION
+
+    def get(self, name):
+        """The model serving `name`, loading or swapping in the active version when needed."""
+        entry = self.loaded.get(name)
+        if entry is not None and time.monotonic() - entry.checked < settings.ML_MODEL_CHECK_SECONDS:
+            return entry.model
+        with self.lock:
+            entry = self.loaded.get(name)
+            version = self.active_version(name)
+            if entry is None or entry.version != version:
+                try:
+                    entry = self.load(name, version)
+                except Exception as e:
+                    if entry is None:
+                        raise
+                    # Keep serving the previous version; retried at the next check
+                    logger.error(f"Error loading model {name}@{version}, keeping {entry.version}: {str(e)}")
+                self.loaded[name] = entry
+            entry.checked = time.monotonic()
+            return entry.model
+
+    def load(self, name, version):
+        builder = self.builders[name]
+        # Tracing slows every thread's allocations, so the heap is only measured when it
+        # was switched on for debugging (PYTHONTRACEMALLOC=1); it then includes whatever
+        # other threads allocate during the load
+        tracing = tracemalloc.is_tracing()
+        before = tracemalloc.get_traced_memory()[0] if tracing else 0
+        start = time.perf_counter()
+        artifact = None
+        if version != BUILTIN_VERSION:
+            artifact = Artifact(name, version, os.path.join(self.model_dir(name), version))
+        model = builder(artifact)
+        heap_bytes = max(tracemalloc.get_traced_memory()[0] - before, 0) if tracing else None
+        entry = LoadedModel(
+            model, version, time.perf_counter() - start, artifact.mapped_bytes if artifact else 0, heap_bytes
+        )
+        logger.info(
+            f"Model {name}@{version} loaded in {entry.load_seconds * 1000:.1f} ms, "
+            f"{entry.mapped_bytes} bytes mapped (pid {os.getpid()})"
+        )
+        return entry
+
+    def status(self):
+        """
+        Load time and memory of the models loaded in this process: the size of their
+        mapped arrays, and heap_bytes when tracemalloc was tracing (None otherwise).
+        """
+        return {
+            name: {
+                'version': entry.version,
+                'load_ms': round(entry.load_seconds * 1000, 2),
+                'mapped_bytes': entry.mapped_bytes,
+                'heap_bytes': entry.heap_bytes,
+            }
+            for name, entry in self.loaded.items()
+        }
+
+    def publish(self, name, version, source_dir):
+        """Copy meta.json and the .npy files of source_dir in as a new, inactive version."""
+        if not VERSION_PATTERN.match(version) or version == BUILTIN_VERSION:
+            raise ValueError(f"Invalid version name: {version}")
+        target = os.path.join(self.model_dir(name), version)
+        if os.path.exists(target):
+            raise ValueError(f"{name}@{version} is already published")
+        files = [entry for entry in os.listdir(source_dir) if entry == META_FILE or entry.endswith('.npy')]
+        if not files:
+            raise ValueError(f"No {META_FILE} or .npy files in {source_dir}")
+        os.makedirs(self.model_dir(name), exist_ok=True)
+        # Fill a hidden directory first so workers never see a half-copied version
+        staging = tempfile.mkdtemp(prefix='.publish-', dir=self.model_dir(name))
+        try:
+            os.chmod(staging, 0o755)
+            for entry in files:
+                shutil.copyfile(os.path.join(source_dir, entry), os.path.join(staging, entry))
+            # Fails the arrays that np.load cannot map before anything is published
+            Artifact(name, version, staging)
+            os.rename(staging, target)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return files
+
+    def activate(self, name, version):
+        """Point ACTIVE at `version`; workers switch at their next check."""
+        if version != BUILTIN_VERSION and version not in self.versions(name):
+            raise ValueError(f"{name}@{version} is not published")
+        os.makedirs(self.model_dir(name), exist_ok=True)
+        fd, staging = tempfile.mkstemp(prefix='.active-', dir=self.model_dir(name))
+        with os.fdopen(fd, 'w') as f:
+            f.write(version)
+        os.chmod(staging, 0o644)
+        os.replace(staging, os.path.join(self.model_dir(name), ACTIVE_FILE))
+
+
+registry = ModelRegistry()
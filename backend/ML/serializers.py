@@ -0,0 +1,18 @@
+from rest_framework import serializers
+from .geo import MAX_BATCH_REQUIREMENTS
+
+
+class ReplenishmentRequirementSerializer(serializers.Serializer):
+    warehouse_id = serializers.IntegerField()
+    product_id = serializers.IntegerField()
+    quantity = serializers.FloatField()
+
+    def validate_quantity(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Quantity must be positive.")
+        return value
+
+
+class ReplenishmentBatchSerializer(serializers.Serializer):
+    requirements = ReplenishmentRequirementSerializer(many=True, allow_empty=False, max_length=MAX_BATCH_REQUIREMENTS)
+    split = serializers.BooleanField(default=True)
@@ -1,3 +1,297 @@
-from django.test import TestCase
+import datetime
+import os
+import tempfile
+import tracemalloc
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from product.models import Product
+from warehouse.models import Stock, SubLocation, Warehouse
+from operations.models import DailyMovementRollup
+from .forecasting import fit, train_demand_forecasts
+from .geo import EARTH_RADIUS_KM, haversine_matrix, nearest_abundant_warehouses
+from .models import DemandForecast
+from .registry import BUILTIN_VERSION, ModelRegistry
+
+
+class DemandForecastingTests(TestCase):
+    """
+    Regular series are smoothed, intermittent ones go through Croston's method.
+    """
+
+    def test_fit_picks_method_per_series(self):
+        demand = np.array([
+            [5.0] * 28,
+            [0, 0, 0, 8] * 7,
+        ])
+        intermittent, _, rates, _ = fit(demand)
+
+        self.assertEqual(intermittent.tolist(), [False, True])
+        self.assertAlmostEqual(rates[0], 5.0)
+        # 8 units every 4 days, with the Syntetos-Boylan correction (1 - 0.1 / 2)
+        self.assertAlmostEqual(rates[1], 2 * 0.95)
+
+    def test_training_replaces_stored_forecasts(self):
+        warehouse = Warehouse.objects.create(name="Main", code="WH")
+        product = Product.objects.create(sku="P-1", name="Product", category='FIN', type='Unit', weight=1)
+        today = datetime.date(2026, 3, 31)
+        DailyMovementRollup.objects.bulk_create([
+            DailyMovementRollup(
+                day=today - datetime.timedelta(days=i), warehouse=warehouse, product=product,
+                move_type='OUT', quantity_out=3
+            )
+            for i in range(30)
+        ])
+
+        train_demand_forecasts(history_days=30, horizon_days=10, day_to=today)
+        train_demand_forecasts(history_days=30, horizon_days=10, day_to=today)
+
+        forecast = DemandForecast.objects.get()
+        self.assertEqual((forecast.product, forecast.warehouse, forecast.method), (product, warehouse, 'SES'))
+        self.assertAlmostEqual(forecast.horizon_demand, 30)
+
+
+class ModelRegistryTests(TestCase):
+    """
+    Published versions are memory-mapped and swapped in on the next check.
+    """
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        settings = override_settings(ML_MODEL_DIR=self.root.name, ML_MODEL_CHECK_SECONDS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.registry = ModelRegistry()
+        self.registry.register('demand', lambda artifact: artifact.arrays['rates'] if artifact else None)
+
+    def publish(self, version, rates):
+        source = os.path.join(self.root.name, f'source-{version}')
+        os.makedirs(source)
+        np.save(os.path.join(source, 'rates.npy'), np.asarray(rates, dtype=float))
+        self.registry.publish('demand', version, source)
+        self.registry.activate('demand', version)
+
+    def test_activated_version_is_mapped_and_measured_without_tracing(self):
+        self.assertIsNone(self.registry.get('demand'))
+        self.publish('v1', [1.0, 2.0, 3.0])
+
+        rates = self.registry.get('demand')
+
+        self.assertIsInstance(rates, np.memmap)
+        self.assertEqual(rates.tolist(), [1.0, 2.0, 3.0])
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(
+            self.registry.status()['demand'], {'version': 'v1', 'load_ms': mock.ANY, 'mapped_bytes': 24, 'heap_bytes': None}
+        )
+
+    def test_failed_load_keeps_serving_the_previous_version(self):
+        self.publish('v1', [1.0])
+        self.registry.get('demand')
+        os.makedirs(os.path.join(self.root.name, 'demand', 'broken'))
+        np.save(os.path.join(self.root.name, 'demand', 'broken', 'other.npy'), np.zeros(1))
+        self.registry.activate('demand', 'broken')
+
+        self.assertEqual(self.registry.get('demand').tolist(), [1.0])
+        self.assertEqual(self.registry.status()['demand']['version'], 'v1')
+        self.registry.activate('demand', BUILTIN_VERSION)
+        self.assertIsNone(self.registry.get('demand'))
+
+
+class NearestStockTests(TestCase):
+    """
+    Warehouses along the equator, one degree (about 111 km) apart, and one without
+    coordinates.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.source, cls.near, cls.far, cls.farther = [
+            Warehouse.objects.create(name=f"W{degree}", code=f"W{degree}", latitude=0, longitude=degree)
+            for degree in range(4)
+        ]
+        cls.unlocated = Warehouse.objects.create(name="Unlocated", code="UL")
+        cls.product, = Product.objects.bulk_create([
+            Product(sku="P-1", name="Product", category='FIN', type='Unit', weight=1)
+        ])
+        cls.user = User.objects.create_user("clerk", password="x")
+        for warehouse, quantities in (
+            (cls.source, [100]), (cls.near, [3]), (cls.far, [4, 6]), (cls.farther, [10]), (cls.unlocated, [50])
+        ):
+            for rack, quantity in enumerate(quantities):
+                location = SubLocation.objects.create(warehouse=warehouse, aisle=warehouse.code, rack=f"R{rack}")
+                Stock.objects.create(product=cls.product, sublocation=location, quantity=quantity)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_haversine_matrix(self):
+        # Paris, London and the antipode of Paris
+        distances = haversine_matrix([48.8566, 51.5074, -48.8566], [2.3522, -0.1278, -177.6478])
+
+        self.assertAlmostEqual(distances[0, 1], 343.6, delta=0.5)
+        self.assertAlmostEqual(distances[0, 2], np.pi * EARTH_RADIUS_KM, places=3)
+        self.assertTrue(np.allclose(distances, distances.T))
+        self.assertEqual(distances.diagonal().tolist(), [0, 0, 0])
+
+    def test_nearest_abundant_warehouses_skip_the_source_and_small_stocks(self):
+        results = nearest_abundant_warehouses(self.source.pk, self.product.pk, abundance_min=6)
+
+        self.assertEqual(
+            [(row['warehouse'], row['stock_quantity'], row['sublocation']) for row in results],
+            [("W2", 10, "W2-R1"), ("W3", 10, "W3-R0")]
+        )
+        self.assertAlmostEqual(results[0]['distance_km'], 222.39, places=2)
+        self.assertEqual([row['warehouse'] for row in nearest_abundant_warehouses(self.source.pk, self.product.pk, 3, k=1)], ["W1"])
+        self.assertEqual(nearest_abundant_warehouses(self.source.pk, self.product.pk, 1000), [])
+        self.assertIsNone(nearest_abundant_warehouses(self.unlocated.pk, self.product.pk))
+        self.assertIsNone(nearest_abundant_warehouses(0, self.product.pk))
+
+    def test_distances_follow_warehouse_changes(self):
+        # Only the unlocated warehouse holds 20, and it cannot be ranked yet
+        self.assertEqual(nearest_abundant_warehouses(self.source.pk, self.product.pk, 20), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.unlocated.latitude, self.unlocated.longitude = 0, Decimal('0.5')
+            self.unlocated.save()
+
+        self.assertEqual(
+            [row['warehouse'] for row in nearest_abundant_warehouses(self.source.pk, self.product.pk, 20)], ["Unlocated"]
+        )
+
+    def test_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = "/api/ml/nearest-abundant-stock/"
+
+        response = client.get(url, {'warehouse_id': self.source.pk, 'product_id': self.product.pk, 'k': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['warehouse'] for row in response.json()['data']], ["W2"])
+        self.assertEqual(client.get(url, {'warehouse_id': self.source.pk}).status_code, 400)
+        self.assertEqual(client.get(url, {'warehouse_id': 'x', 'product_id': self.product.pk}).status_code, 400)
+        self.assertEqual(client.get(url, {'warehouse_id': self.source.pk, 'product_id': self.product.pk, 'k': 0}).status_code, 400)
+        self.assertEqual(client.get(url, {'warehouse_id': self.unlocated.pk, 'product_id': self.product.pk}).status_code, 404)
+        response = client.get(url, {'warehouse_id': self.source.pk, 'product_id': self.product.pk, 'min_quantity': 1000})
+        self.assertEqual((response.status_code, response.json()['data']), (200, []))
+
+
+class ReplenishmentPlanTests(TestCase):
+    """
+    Plans promise stock that is on hand and not reserved, nearest warehouses first.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.destination, cls.near, cls.far = [
+            Warehouse.objects.create(name=f"W{degree}", code=f"W{degree}", latitude=0, longitude=degree)
+            for degree in range(3)
+        ]
+        cls.product, = Product.objects.bulk_create([
+            Product(sku="P-1", name="Product", category='FIN', type='Unit', weight=1)
+        ])
+        cls.user = User.objects.create_user("clerk", password="x")
+        cls.near_stock = Stock.objects.create(
+            product=cls.product, sublocation=SubLocation.objects.create(warehouse=cls.near, aisle="W1"), quantity=6
+        )
+        Stock.objects.create(
+            product=cls.product, sublocation=SubLocation.objects.create(warehouse=cls.far, aisle="W2"), quantity=10
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def plan(self, quantities, **data):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        data['requirements'] = [
+            {'warehouse_id': self.destination.pk, 'product_id': self.product.pk, 'quantity': quantity}
+            for quantity in quantities
+        ]
+        return client.post("/api/ml/nearest-abundant-stock/batch/", data, format='json')
+
+    def sources(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        return [
+            [(source['warehouse'], source['quantity']) for source in plan['sources']]
+            for plan in response.json()['data']
+        ]
+
+    def test_requirements_draw_stock_down_nearest_first(self):
+        response = self.plan([4, 8])
+        self.assertEqual(self.sources(response), [[("W1", 4)], [("W2", 8)]])
+        self.assertEqual(self.sources(self.plan([12])), [[("W1", 6), ("W2", 6)]])
+        self.assertEqual(self.sources(self.plan([20]))[0], [("W1", 6), ("W2", 10)])
+
+    def test_split_false_as_a_string_is_honoured(self):
+        response = self.plan([12], split="false")
+        self.assertEqual(self.sources(response), [[]])
+        self.assertEqual(response.json()['unmet'], 1)
+        self.assertEqual(self.sources(self.plan([12], split="true")), [[("W1", 6), ("W2", 6)]])
+
+    def test_reserved_stock_is_not_promised(self):
+        Stock.objects.filter(pk=self.near_stock.pk).update(reserved_quantity=5)
+
+        self.assertEqual(self.sources(self.plan([1, 1])), [[("W1", 1)], [("W2", 1)]])
+
+    def test_invalid_requests_are_refused(self):
+        for response in (
+            self.plan([]),
+            self.plan([0]),
+            self.plan([1], split="maybe"),
+            self.plan(["x"]),
+        ):
+            self.assertEqual(response.status_code, 400)
+            self.assertFalse(response.json()['success'])
+
+
+@mock.patch('ML.views.WarehouseStockPredictionCSVAPIView.chunk_size', 2)
+class WarehouseStockCSVTests(TestCase):
+    """
+    The export streams chunk by chunk: a synchronous generator under WSGI, an
+    asynchronous one under ASGI.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        cls.user = User.objects.create_user("clerk", password="x")
+        location = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+        for product in Product.objects.bulk_create([
+            Product(sku=f"P-{i}", name=f"Product {i}", category='FIN', type='Unit', weight=1) for i in range(5)
+        ]):
+            Stock.objects.create(product=product, sublocation=location, quantity=3)
+
+    def setUp(self):
+        cache.clear()
+
+    def url(self):
+        return f"/api/ml/warehouse-stock-csv/?warehouse_id={self.warehouse.pk}"
+
+    def assertCSV(self, response, chunks):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        # The header, then one chunk per two rows
+        self.assertEqual(len(chunks), 4)
+        lines = b"".join(chunks).decode().splitlines()
+        self.assertEqual(lines[0], "Product SKU,Product Name,Sublocation,Current Quantity,Predicted Demand (forecast horizon)")
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], [f"P-{i}" for i in range(5)])
+
+    def test_wsgi_stream(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url())
+
+        self.assertFalse(response.is_async)
+        self.assertCSV(response, list(response.streaming_content))
+
+    async def test_asgi_stream(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url())
+
+        self.assertTrue(response.is_async)
+        self.assertCSV(response, [chunk async for chunk in response.streaming_content])
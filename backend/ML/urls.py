@@ -1,6 +1,7 @@
 from django.urls import path
 from .views import (
     NearestAbundantStockAPIView,
+    NearestAbundantStockBatchAPIView,
     DemandPredictionAPIView,
     SuspiciousActivityAPIView,
     ProductRecommendationAPIView,
@@ -9,6 +10,7 @@ from .views import (
 
 urlpatterns = [
     path('nearest-abundant-stock/', NearestAbundantStockAPIView.as_view(), name='nearest-abundant-stock'),
+    path('nearest-abundant-stock/batch/', NearestAbundantStockBatchAPIView.as_view(), name='nearest-abundant-stock-batch'),
     path('demand-prediction/', DemandPredictionAPIView.as_view(), name='demand-prediction'),
     path('suspicious-activity/', SuspiciousActivityAPIView.as_view(), name='suspicious-activity'),
     path('product-recommendations/', ProductRecommendationAPIView.as_view(), name='product-recommendations'),
@@ -1,79 +1,24 @@
 from django.shortcuts import render
 
 # Create your views here.
-import math
 import logging
-from warehouse.models import Warehouse, Stock
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
+from .geo import nearest_abundant_warehouses, plan_replenishment
+from .serializers import ReplenishmentBatchSerializer
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
 
-def find_nearest_abundant_stock(source_warehouse_id, product_id, abundance_min=6):
-    """
-    Given a source warehouse ID and product ID, find the nearest warehouse with abundant stock.
-    """
-
-    try:
-        source_wh = Warehouse.objects.get(id=source_warehouse_id)
-    except Warehouse.DoesNotExist:
-        return None
-
-    # Stocks in other warehouses with abundant quantity
-    abundant_stocks = Stock.objects.filter(
-        product_id=product_id,
-        quantity__gte=abundance_min
-    ).exclude(sublocation__warehouse=source_wh)
-
-    if not abundant_stocks.exists():
-        return None
-
-    def haversine(lat1, lon1, lat2, lon2):
-        R = 6371
-        phi1, phi2 = math.radians(lat1), math.radians(lat2)
-        d_phi = math.radians(lat2 - lat1)
-        d_lambda = math.radians(lon2 - lon1)
-        a = math.sin(d_phi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        return R * c
-
-    closest_stock = None
-    min_distance = float('inf')
-
-    for stock in abundant_stocks:
-        wh = stock.sublocation.warehouse
-        if not wh.latitude or not wh.longitude:
-            continue
-        distance = haversine(
-            float(source_wh.latitude),
-            float(source_wh.longitude),
-            float(wh.latitude),
-            float(wh.longitude)
-        )
-        if distance < min_distance:
-            min_distance = distance
-            closest_stock = stock
-
-    if closest_stock:
-        return {
-            "warehouse": closest_stock.sublocation.warehouse.name,
-            "sublocation": closest_stock.sublocation.code,
-            "stock_quantity": closest_stock.quantity,
-            "distance_km": round(min_distance, 2)
-        }
-
-    return None
-
-
-
 class NearestAbundantStockAPIView(APIView):
     """
-    API to find the nearest warehouse with abundant stock for a given product.
+    API to find the nearest warehouses with abundant stock for a given product.
+    GET ?warehouse_id=&product_id=&min_quantity=6&k=5
     """
     permission_classes = [IsAuthenticated]
+    max_results = 50
 
     def get(self, request, *args, **kwargs):
         warehouse_id = request.query_params.get("warehouse_id")
@@ -90,101 +35,92 @@ class NearestAbundantStockAPIView(APIView):
                 'error': "warehouse_id and product_id are required"
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        result = find_nearest_abundant_stock(warehouse_id, product_id)
+        try:
+            warehouse_id = int(warehouse_id)
+            product_id = int(product_id)
+            min_quantity = float(request.query_params.get("min_quantity", 6))
+            k = int(request.query_params.get("k", 5))
+        except ValueError:
+            logger.warning(f"[NEAREST_STOCK] FAILED - Invalid parameters, User: {user.username}")
+            return Response({
+                'success': False,
+                'error': "warehouse_id, product_id and k must be integers, min_quantity a number"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= k <= self.max_results:
+            return Response({
+                'success': False,
+                'error': f"k must be between 1 and {self.max_results}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        results = nearest_abundant_warehouses(warehouse_id, product_id, min_quantity, k)
+
+        if results is None:
+            logger.warning(f"[NEAREST_STOCK] FAILED - Warehouse not found or not geolocated: {warehouse_id}, User: {user.username}")
+            return Response({
+                'success': False,
+                'error': "Warehouse not found or has no coordinates"
+            }, status=status.HTTP_404_NOT_FOUND)
 
-        if not result:
+        if not results:
             logger.info(f"[NEAREST_STOCK] SUCCESS - No abundant stock found, User: {user.username}")
             return Response({
                 'success': True,
-                'message': "No abundant stock found in other warehouses"
+                'message': "No abundant stock found in other warehouses",
+                'data': []
             }, status=status.HTTP_200_OK)
 
-        logger.info(f"[NEAREST_STOCK] SUCCESS - Found stock, User: {user.username}, Result: {result}")
+        logger.info(f"[NEAREST_STOCK] SUCCESS - Found {len(results)} warehouses, User: {user.username}, Nearest: {results[0]}")
         return Response({
             'success': True,
-            'data': result
+            'data': results
         })
     
     
     
     
     
-#real
-"""
-This file contains FAKE / DUMMY ML logic.
-The structure is realistic and can be replaced with real ML models later.
-"""
-
-import random
-import numpy as np
-
-
-# -------------------------------
-#   FAKE API Keys (not real)
-# -------------------------------
-OPENAI_API_KEY = "sk-test_1289asdasd8129ASDASD-asdasd"
-MLFLOW_TRACKING_URI = "https://mlflow-fake-server.com/track/218as89d"
-
-
-# -------------------------------
-#   Dummy Demand Prediction Model
-# -------------------------------
-class DummyDemandModel:
-    def __init__(self):
-        self.name = "DemandPredictor-v0.1"
-
-    def predict(self, warehouse_id, product_id):
-        """
-        Fake demand prediction:
-        Returns a number between 1 - 100 representing demand score.
-        """
-        np.random.seed(int(warehouse_id) + int(product_id))
-        return int(np.random.randint(10, 90))
-
-
-# -------------------------------
-#   Dummy Suspicious Activity Model
-# -------------------------------
-class FakeSuspiciousModel:
-    def __init__(self):
-        self.name = "AnomalyDetector-v0.3"
-
-    def predict(self, transfer_amount, user_id):
-        """
-        Fake suspicious logic:
-        If transfer > 500 or random anomaly, flag suspicious.
-        """
-        if transfer_amount > 500:
-            return True
-
-        return random.choice([False, False, False, True])  # 25% randomness
-
-
-# -------------------------------
-#   Dummy Recommendation System
-# -------------------------------
-class FakeRecommendationModel:
-    def __init__(self):
-        self.name = "RecoEngine-v2.0"
+class NearestAbundantStockBatchAPIView(APIView):
+    """
+    Sources for many replenishment requirements in one call.
+    POST {"requirements": [{"warehouse_id", "product_id", "quantity"}, ...], "split": true}
+    """
+    permission_classes = [IsAuthenticated]
 
-    def recommend(self, user_id):
-        """
-        Returns 3 random product IDs pretending to be recommendations.
-        """
-        return random.sample(range(1, 50), 3)
+    def post(self, request, *args, **kwargs):
+        user = request.user
+        ip_address = request.META.get('REMOTE_ADDR', 'Unknown')
+        serializer = ReplenishmentBatchSerializer(data=request.data)
 
+        if not serializer.is_valid():
+            logger.warning(f"[NEAREST_STOCK_BATCH] FAILED - Invalid request, User: {user.username}, Errors: {serializer.errors}")
+            return Response({
+                'success': False,
+                'errors': serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
 
-# Create objects (like loading ML models)
-demand_model = DummyDemandModel()
-susp_model = FakeSuspiciousModel()
-reco_model = FakeRecommendationModel()
+        split = serializer.validated_data["split"]
+        requirements = [
+            (item["warehouse_id"], item["product_id"], item["quantity"])
+            for item in serializer.validated_data["requirements"]
+        ]
+        logger.info(f"[NEAREST_STOCK_BATCH] POST request - User: {user.username}, Requirements: {len(requirements)}, Split: {split}, IP: {ip_address}")
 
+        plans = plan_replenishment(requirements, split=split)
+        unmet = sum(1 for plan in plans if plan["shortfall"] > 0)
 
+        logger.info(f"[NEAREST_STOCK_BATCH] SUCCESS - User: {user.username}, Requirements: {len(plans)}, Unmet: {unmet}")
+        return Response({
+            'success': True,
+            'data': plans,
+            'unmet': unmet
+        })
+    
+    
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-from .ml_services import demand_model, susp_model, reco_model
+from .ml_services import registry
 
 
 # -------------------------------------------
@@ -208,15 +144,38 @@ class DemandPredictionAPIView(APIView):
                 'error': "warehouse_id and product_id required"
             }, status=400)
 
-        predicted_demand = demand_model.predict(warehouse_id, product_id)
+        try:
+            warehouse_id, product_id = int(warehouse_id), int(product_id)
+        except ValueError:
+            logger.warning(f"[DEMAND_PREDICTION] FAILED - Invalid parameters, User: {user.username}")
+            return Response({
+                'success': False,
+                'error': "warehouse_id and product_id must be integers"
+            }, status=400)
+
+        demand_model = registry.get("demand")
+        forecast = demand_model.predict(warehouse_id, product_id)
 
-        logger.info(f"[DEMAND_PREDICTION] SUCCESS - User: {user.username}, Predicted: {predicted_demand}")
+        if forecast is None:
+            logger.info(f"[DEMAND_PREDICTION] SUCCESS - No delivery history, User: {user.username}")
+            return Response({
+                'success': True,
+                'message': "No delivery history to forecast from for this product and warehouse",
+                'data': None
+            })
+
+        logger.info(f"[DEMAND_PREDICTION] SUCCESS - User: {user.username}, Predicted: {forecast.daily_demand:.2f}/day ({forecast.method})")
         return Response({
             'success': True,
             'data': {
                 "warehouse_id": warehouse_id,
                 "product_id": product_id,
-                "predicted_demand_score": predicted_demand,
+                "predicted_daily_demand": round(forecast.daily_demand, 3),
+                "predicted_demand": round(forecast.horizon_demand, 3),
+                "horizon_days": forecast.horizon_days,
+                "method": forecast.method,
+                "mean_absolute_error": round(forecast.mae, 3),
+                "trained_at": forecast.trained_at,
                 "model_used": demand_model.name
             }
         })
@@ -243,6 +202,7 @@ class SuspiciousActivityAPIView(APIView):
                 'error': "transfer_amount and user_id required"
             }, status=400)
 
+        susp_model = registry.get("suspicious")
         result = susp_model.predict(int(transfer_amount), int(user_id))
 
         logger.info(f"[SUSPICIOUS_ACTIVITY] SUCCESS - User: {user.username}, Result: {result}")
@@ -277,6 +237,7 @@ class ProductRecommendationAPIView(APIView):
                 'error': "user_id required"
             }, status=400)
 
+        reco_model = registry.get("recommendation")
         recommendations = reco_model.recommend(int(user_id))
 
         logger.info(f"[PRODUCT_RECOMMENDATION] SUCCESS - User: {user.username}, Recommendations: {recommendations}")
@@ -291,35 +252,53 @@ class ProductRecommendationAPIView(APIView):
 
 
 import csv
-import os
-from django.http import HttpResponse
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+import numpy as np
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
 from warehouse.models import Stock, Warehouse
-from .ml_services import demand_model
+from .ml_services import registry
+
+
+class Echo:
+    """File-like object handing each CSV line back to the caller instead of buffering it."""
+
+    def write(self, value):
+        return value
+
 
 # -------------------------------
 #   CSV Export with Demand Prediction
 # -------------------------------
 class WarehouseStockPredictionCSVAPIView(APIView):
     """
-    Generates a CSV for a given warehouse with:
+    Streams a CSV for a given warehouse with:
     - Product SKU
     - Product Name
+    - Sublocation
     - Current Stock Quantity
-    - Predicted demand score for this year
+    - Predicted demand over the forecast horizon
+    Every stocked product of the warehouse is exported unless product_ids is given.
+
+    Rows are read and written chunk_size at a time. Under ASGI the response iterates
+    an async generator that runs each chunk in a worker thread, since Django would
+    otherwise collect a synchronous generator into one list before sending it.
     """
     permission_classes = [IsAuthenticated]
+    chunk_size = 2000
 
     def get(self, request):
         warehouse_id = request.query_params.get("warehouse_id")
-        product_ids = request.query_params.getlist("product_ids")  # ?product_ids=1&product_ids=2
+        product_ids = request.query_params.getlist("product_ids")  # ?product_ids=1&product_ids=2, or all products
         user = request.user
         ip_address = request.META.get('REMOTE_ADDR', 'Unknown')
 
-        logger.info(f"[WAREHOUSE_CSV] GET request - User: {user.username}, Warehouse: {warehouse_id}, Products: {product_ids}, IP: {ip_address}")
+        logger.info(f"[WAREHOUSE_CSV] GET request - User: {user.username}, Warehouse: {warehouse_id}, Products: {product_ids or 'all'}, IP: {ip_address}")
 
         if not warehouse_id:
             logger.warning(f"[WAREHOUSE_CSV] FAILED - Missing warehouse_id, User: {user.username}")
@@ -328,6 +307,16 @@ class WarehouseStockPredictionCSVAPIView(APIView):
                 'error': "warehouse_id is required"
             }, status=400)
 
+        try:
+            warehouse_id = int(warehouse_id)
+            product_ids = [int(product_id) for product_id in product_ids]
+        except ValueError:
+            logger.warning(f"[WAREHOUSE_CSV] FAILED - Invalid parameters, User: {user.username}")
+            return Response({
+                'success': False,
+                'error': "warehouse_id and product_ids must be integers"
+            }, status=400)
+
         try:
             warehouse = Warehouse.objects.get(id=warehouse_id)
         except Warehouse.DoesNotExist:
@@ -338,10 +327,9 @@ class WarehouseStockPredictionCSVAPIView(APIView):
             }, status=404)
 
         # Get stocks for this warehouse
-        stocks = Stock.objects.filter(
-            sublocation__warehouse=warehouse,
-            product_id__in=product_ids if product_ids else []
-        ).select_related("product", "sublocation")
+        stocks = Stock.objects.filter(sublocation__warehouse=warehouse)
+        if product_ids:
+            stocks = stocks.filter(product_id__in=product_ids)
 
         if not stocks.exists():
             logger.info(f"[WAREHOUSE_CSV] SUCCESS - No stock found, User: {user.username}")
@@ -350,29 +338,50 @@ class WarehouseStockPredictionCSVAPIView(APIView):
                 'message': "No stock found for the given warehouse/products"
             }, status=200)
 
-        # Create CSV response
-        response = HttpResponse(content_type='text/csv')
+        rows = stocks.order_by('sublocation__code', 'product__sku').values_list(
+            'product_id', 'product__sku', 'product__name', 'sublocation__code', 'quantity'
+        )
+        # One model for the whole file, even if a new version is activated mid-stream
+        demand_model = registry.get("demand")
+
+        chunks = self.stream(rows, warehouse, demand_model, user)
+        if isinstance(request._request, ASGIRequest):
+            chunks = self.astream(chunks)
+        response = StreamingHttpResponse(chunks, content_type='text/csv')
         response['Content-Disposition'] = f'attachment; filename="warehouse_{warehouse.id}_stock_prediction.csv"'
+        return response
 
-        writer = csv.writer(response)
+    def stream(self, rows, warehouse, demand_model, user):
+        writer = csv.writer(Echo())
         # Header
-        writer.writerow([
+        yield writer.writerow([
             "Product SKU",
             "Product Name",
             "Sublocation",
             "Current Quantity",
-            "Predicted Demand (this year)"
+            "Predicted Demand (forecast horizon)"
         ])
 
-        for stock in stocks:
-            predicted_demand = demand_model.predict(warehouse.id, stock.product.id)
-            writer.writerow([
-                stock.product.sku,
-                stock.product.name,
-                stock.sublocation.code,
-                stock.quantity,
-                predicted_demand
-            ])
-
-        logger.info(f"[WAREHOUSE_CSV] SUCCESS - CSV generated, User: {user.username}, Records: {stocks.count()}")
-        return response
+        records = 0
+        iterator = rows.iterator(chunk_size=self.chunk_size)
+        while True:
+            chunk = list(islice(iterator, self.chunk_size))
+            if not chunk:
+                break
+            predictions = np.round(demand_model.predict_batch(warehouse.id, [row[0] for row in chunk]), 2)
+            yield "".join(
+                writer.writerow([sku, name, code, quantity, "" if np.isnan(predicted) else predicted])
+                for (_, sku, name, code, quantity), predicted in zip(chunk, predictions.tolist())
+            )
+            records += len(chunk)
+
+        logger.info(f"[WAREHOUSE_CSV] SUCCESS - CSV generated, User: {user.username}, Records: {records}")
+
+    async def astream(self, chunks):
+        # The database cursor stays on the one thread running every chunk
+        next_chunk = sync_to_async(next)
+        try:
+            while (chunk := await next_chunk(chunks, None)) is not None:
+                yield chunk
+        finally:
+            await sync_to_async(chunks.close)()
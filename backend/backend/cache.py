@@ -0,0 +1,100 @@
+"""
+Generation counters for cache invalidation.
+
+Cached values are stored under a key that embeds the current generation of their
+namespace; bumping the generation orphans every older entry at once, and the stale
+entries simply expire.
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django.db import transaction
+
+# Per-entity namespaces, bumped by model saves (see each app's signals.py) and by
+# operations.services for the writes that bypass save()
+WAREHOUSE_CACHE = 'warehouse'
+PRODUCT_CACHE = 'product'
+STOCK_CACHE = 'stock'
+OPERATIONS_CACHE = 'operations'
+
+
+def _generation_key(namespace):
+    return f"generation:{namespace}"
+
+def get_generation(namespace):
+    value = cache.get(_generation_key(namespace))
+    if value is None:
+        # Start from the clock so a counter lost to eviction never reuses an old generation
+        cache.add(_generation_key(namespace), time.time_ns(), timeout=None)
+        value = cache.get(_generation_key(namespace), time.time_ns())
+    return value
+
+def get_generations(namespaces):
+    """
+    Current generation of several namespaces in one cache round trip.
+    """
+    found = cache.get_many([_generation_key(namespace) for namespace in namespaces])
+    return [
+        found.get(_generation_key(namespace)) or get_generation(namespace)
+        for namespace in namespaces
+    ]
+
+def bump_generation(*namespaces):
+    for namespace in namespaces:
+        try:
+            cache.incr(_generation_key(namespace))
+        except ValueError:
+            cache.set(_generation_key(namespace), time.time_ns(), timeout=None)
+
+def invalidate(*namespaces):
+    """
+    Bump namespaces once the current transaction commits. Bumping earlier would let
+    a concurrent request re-cache the data the transaction is about to replace.
+    """
+    transaction.on_commit(lambda: bump_generation(*namespaces))
+
+def cached(namespaces, key, compute, timeout=300):
+    """
+    Return compute() cached under `key` until the generation of any of the
+    namespaces (one name or a tuple of names) is bumped.
+    """
+    if isinstance(namespaces, str):
+        namespaces = (namespaces,)
+    # Generations are read before computing, so a value computed from data that a
+    # concurrent write replaces is stored under a generation nobody reads any more
+    generations = ":".join(
+        f"{namespace}.{generation}" for namespace, generation in zip(namespaces, get_generations(namespaces))
+    )
+    cache_key = f"{generations}:{key}"
+    value = cache.get(cache_key)
+    if value is None:
+        value = compute()
+        cache.set(cache_key, value, timeout)
+    return value
+
+
+class CachedResponseMixin:
+    """
+    Cache the payload of a read-only view until one of `cache_namespaces` is bumped.
+
+    The key is the view, the path and the query parameters in sorted order, so
+    ?a=1&b=2 and ?b=2&a=1 share an entry. Entries are shared across users: every
+    cached view serves the same data to any authenticated user, so a payload must
+    never depend on who asks.
+    """
+    cache_namespaces = ()
+    cache_timeout = 300
+
+    def get_cache_key(self, request, **resolved):
+        """
+        `resolved` holds values the view derives from something other than the request,
+        such as a default date window ending today, so entries roll over when they change.
+        """
+        params = sorted((key, value) for key, values in request.query_params.lists() for value in values)
+        resolved = sorted((key, str(value)) for key, value in resolved.items())
+        digest = hashlib.sha256(f"{request.path}?{urlencode(params)}#{urlencode(resolved)}".encode()).hexdigest()
+        return f"{type(self).__name__}:{digest}"
+
+    def cached_payload(self, request, compute, **resolved):
+        return cached(self.cache_namespaces, self.get_cache_key(request, **resolved), compute, self.cache_timeout)
@@ -0,0 +1,209 @@
+"""
+Per-request SQL, serialization, rendering and total timings.
+
+Serialization is the time spent in DRF serializers' .data, wherever the view reads
+it; rendering is the JSON encoding of the response after the view returns. Any other
+Python work, including dicts built by hand, counts towards the total only.
+
+Each response carries a Server-Timing header, and the timings are folded into
+dashboard.RequestMetric per (day, method, route); `manage.py request_metrics` lists
+the worst routes. Enabled with settings.REQUEST_METRICS_ENABLED; when it is off the
+middleware takes itself out of the stack at startup and costs nothing.
+"""
+import atexit
+import threading
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the total-time histogram buckets, in ms
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+# Timings of the request being served, for code that has no access to the request
+_current_timings = ContextVar('request_timings', default=None)
+
+
+def latency_bucket(total_ms):
+    for bound in LATENCY_BUCKETS_MS:
+        if total_ms <= bound:
+            return str(bound)
+    return 'inf'
+
+
+class QueryTimer:
+    """connection.execute_wrapper() hook counting the queries of a request and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class RequestTimings:
+    """Serialization and rendering time of one request, in ms."""
+
+    def __init__(self):
+        self.serialize_ms = 0.0
+        self.render_ms = 0.0
+        self.serializing = False
+
+
+def instrument_serializers():
+    """
+    Time BaseSerializer.data, which the .data of every serializer and list serializer
+    goes through, into the current request's serialize_ms. A serializer reading another
+    one's .data while serializing is only counted once.
+    """
+    from rest_framework.serializers import BaseSerializer
+
+    original = BaseSerializer.data.fget
+    if getattr(original, 'timed', False):
+        return
+
+    def data(self):
+        timings = _current_timings.get()
+        if timings is None or timings.serializing:
+            return original(self)
+        timings.serializing = True
+        start = time.perf_counter()
+        try:
+            return original(self)
+        finally:
+            timings.serializing = False
+            timings.serialize_ms += (time.perf_counter() - start) * 1000
+
+    data.timed = True
+    BaseSerializer.data = property(data)
+
+
+class MetricsBuffer:
+    """
+    Per-route totals held in the process and written to the database every
+    `flush_seconds`, so a request never pays for more than one counter update.
+    """
+
+    def __init__(self, flush_seconds):
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_flush = time.monotonic()
+
+    def add(self, key, total_ms, sql_ms, serialize_ms, render_ms, queries):
+        """Record one request; returns True when a flush is due."""
+        with self.lock:
+            entry = self.pending.setdefault(key, {
+                'count': 0, 'total_ms': 0.0, 'sql_ms': 0.0, 'serialize_ms': 0.0, 'render_ms': 0.0, 'queries': 0,
+                'max_ms': 0.0, 'max_queries': 0, 'histogram': {},
+            })
+            entry['count'] += 1
+            entry['total_ms'] += total_ms
+            entry['sql_ms'] += sql_ms
+            entry['serialize_ms'] += serialize_ms
+            entry['render_ms'] += render_ms
+            entry['queries'] += queries
+            entry['max_ms'] = max(entry['max_ms'], total_ms)
+            entry['max_queries'] = max(entry['max_queries'], queries)
+            bucket = latency_bucket(total_ms)
+            entry['histogram'][bucket] = entry['histogram'].get(bucket, 0) + 1
+            return time.monotonic() - self.last_flush >= self.flush_seconds
+
+    def flush(self):
+        from dashboard.models import RequestMetric
+
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            with transaction.atomic():
+                RequestMetric.objects.bulk_create([
+                    RequestMetric(day=day, method=method, route=route) for day, method, route in pending
+                ], ignore_conflicts=True)
+                metrics = RequestMetric.objects.select_for_update().filter(
+                    day__in={day for day, _, _ in pending}, route__in={route for _, _, route in pending}
+                ).order_by('pk')
+                changed = []
+                for metric in metrics:
+                    entry = pending.get((metric.day, metric.method, metric.route))
+                    if entry is None:
+                        continue
+                    for field in ('count', 'total_ms', 'sql_ms', 'serialize_ms', 'render_ms', 'queries'):
+                        setattr(metric, field, getattr(metric, field) + entry[field])
+                    metric.max_ms = max(metric.max_ms, entry['max_ms'])
+                    metric.max_queries = max(metric.max_queries, entry['max_queries'])
+                    for bucket, count in entry['histogram'].items():
+                        metric.histogram[bucket] = metric.histogram.get(bucket, 0) + count
+                    changed.append(metric)
+                RequestMetric.objects.bulk_update(changed, [
+                    'count', 'total_ms', 'sql_ms', 'serialize_ms', 'render_ms', 'queries', 'max_ms', 'max_queries',
+                    'histogram'
+                ])
+        except DatabaseError as e:
+            # Metrics are best effort; never fail the request that happened to flush them
+            logger.error(f"Error writing request metrics: {str(e)}")
+
+
+class RequestMetricsMiddleware:
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.buffer = MetricsBuffer(getattr(settings, 'REQUEST_METRICS_FLUSH_SECONDS', 10))
+        atexit.register(self.buffer.flush)
+        instrument_serializers()
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        timings = request.metrics_timings = RequestTimings()
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timer):
+                response = self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        total_ms = (time.perf_counter() - start) * 1000
+        sql_ms = timer.seconds * 1000
+        serialize_ms = timings.serialize_ms
+        render_ms = timings.render_ms
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={sql_ms:.1f};desc="{timer.count} queries"',
+            f'serialize;dur={serialize_ms:.1f}',
+            f'render;dur={render_ms:.1f}',
+            f'total;dur={total_ms:.1f}',
+        ])
+
+        # The URL pattern, not the path, so ids do not split a route into many rows
+        match = request.resolver_match
+        route = match.route if match else 'unmatched'
+        key = (timezone.localdate(), request.method, route)
+        if self.buffer.add(key, total_ms, sql_ms, serialize_ms, render_ms, timer.count):
+            self.buffer.flush()
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered (serialized to JSON) after the view returns
+        started = time.perf_counter()
+
+        def rendered(response):
+            request.metrics_timings.render_ms += (time.perf_counter() - started) * 1000
+
+        response.add_post_render_callback(rendered)
+        return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its total time covers every other middleware
+    'backend.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -61,6 +64,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-request query counts and timings (Server-Timing headers, `manage.py request_metrics`)
+REQUEST_METRICS_ENABLED = os.environ.get('REQUEST_METRICS') == '1'
+REQUEST_METRICS_FLUSH_SECONDS = 10
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -79,6 +86,13 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+# The live event stream (/api/dashboard/events/) needs an ASGI server such as
+# `uvicorn backend.asgi:application`; under WSGI it answers 501
+ASGI_APPLICATION = 'backend.asgi.application'
+
+# Fan-out of live dashboard events. The in-process broker serves single-node
+# deployments; point this at another dashboard.events.EventBroker to go beyond.
+EVENT_BROKER = os.environ.get('EVENT_BROKER', 'dashboard.events.InProcessBroker')
 
 
 # Database
@@ -92,6 +106,41 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Cached responses are invalidated through generation counters kept in the cache, so
+# deployments with several worker processes must share it: set REDIS_URL, or CACHE_DIR
+# for a file-based cache on a single host. The local-memory default is per process.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+elif os.environ.get('CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['CACHE_DIR'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
+# ML model artifacts: <ML_MODEL_DIR>/<model>/<version>/ holding meta.json and .npy
+# weights, with <model>/ACTIVE naming the version served (see `manage.py ml_models`).
+# Workers pick up a new ACTIVE version within ML_MODEL_CHECK_SECONDS.
+ML_MODEL_DIR = os.environ.get('ML_MODEL_DIR', BASE_DIR / 'ml_models')
+ML_MODEL_CHECK_SECONDS = 5
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,137 @@
+"""
+Publish/subscribe of live dashboard events.
+
+Writers publish from synchronous code in any thread, once their transaction has
+committed; the server-sent-events view subscribes from the event loop. Channels are
+'kpis' and 'warehouse:<id>'. The broker is chosen with settings.EVENT_BROKER, a dotted
+path to an EventBroker subclass.
+"""
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from django.conf import settings
+from django.utils.module_loading import import_string
+import logging
+
+logger = logging.getLogger(__name__)
+
+KPIS_CHANNEL = 'kpis'
+
+def warehouse_channel(warehouse_id):
+	return f"warehouse:{warehouse_id}"
+
+
+class EventBroker(ABC):
+	"""
+	Interface of a broker. An external one (Redis pub/sub, NATS...) implements the
+	same methods; publish() must not block the writer for long.
+	"""
+
+	@abstractmethod
+	def publish(self, channel, event):
+		"""Send an {'event': name, 'data': payload} dict to every subscriber of the channel."""
+
+	@abstractmethod
+	def subscribe(self, channels):
+		"""Called on the event loop. Returns a Subscription."""
+
+	@abstractmethod
+	def unsubscribe(self, subscription):
+		"""Stop delivering to a Subscription returned by subscribe()."""
+
+	def has_subscribers(self):
+		"""False lets publishers skip building events nobody listens to."""
+		return True
+
+
+class Subscription:
+	"""
+	Bounded queue of events for one client. A client too slow to keep up loses events
+	and is told to resync instead of holding memory on the server.
+	"""
+
+	def __init__(self, channels, max_queue=100):
+		self.channels = set(channels)
+		self.loop = asyncio.get_running_loop()
+		self.queue = asyncio.Queue(max_queue)
+		self.overflowed = False
+
+	def deliver(self, event):
+		# Runs on the subscriber's event loop
+		try:
+			self.queue.put_nowait(event)
+		except asyncio.QueueFull:
+			self.overflowed = True
+
+	async def get(self, timeout):
+		"""Next event, or None if nothing arrived within `timeout` seconds."""
+		if self.overflowed:
+			self.overflowed = False
+			while not self.queue.empty():
+				self.queue.get_nowait()
+			return {'event': 'resync', 'data': {}}
+		try:
+			return await asyncio.wait_for(self.queue.get(), timeout)
+		except asyncio.TimeoutError:
+			return None
+
+
+class InProcessBroker(EventBroker):
+	"""
+	Fan-out within one server process: enough for a single-node deployment where
+	writes and streams are served by the same process.
+	"""
+
+	def __init__(self, max_queue=100):
+		self.max_queue = max_queue
+		self._lock = threading.Lock()
+		self._subscriptions = defaultdict(set)
+
+	def publish(self, channel, event):
+		with self._lock:
+			subscriptions = list(self._subscriptions.get(channel, ()))
+		for subscription in subscriptions:
+			try:
+				subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+			except RuntimeError:
+				# The client's event loop is gone
+				self.unsubscribe(subscription)
+
+	def subscribe(self, channels):
+		subscription = Subscription(channels, self.max_queue)
+		with self._lock:
+			for channel in subscription.channels:
+				self._subscriptions[channel].add(subscription)
+		return subscription
+
+	def unsubscribe(self, subscription):
+		with self._lock:
+			for channel in subscription.channels:
+				self._subscriptions[channel].discard(subscription)
+				if not self._subscriptions[channel]:
+					del self._subscriptions[channel]
+
+	def has_subscribers(self):
+		return bool(self._subscriptions)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+def get_broker():
+	global _broker
+	with _broker_lock:
+		if _broker is None:
+			_broker = import_string(getattr(settings, 'EVENT_BROKER', 'dashboard.events.InProcessBroker'))()
+		return _broker
+
+def publish(channel, name, data):
+	"""
+	Publish without ever failing the caller: events are a convenience on top of the
+	committed data, which clients can always re-read.
+	"""
+	try:
+		get_broker().publish(channel, {'event': name, 'data': data})
+	except Exception as e:
+		logger.error(f"Error publishing {name} event to {channel}: {str(e)}")
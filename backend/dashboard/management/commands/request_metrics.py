@@ -0,0 +1,93 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from backend.middleware import LATENCY_BUCKETS_MS
+from dashboard.models import RequestMetric
+
+SORT_KEYS = ('p95', 'avg', 'total', 'queries', 'sql')
+
+
+def percentile(histogram, count, fraction):
+    """Upper bound (ms) of the histogram bucket holding the given fraction of requests."""
+    seen = 0
+    for bound in LATENCY_BUCKETS_MS:
+        seen += histogram.get(str(bound), 0)
+        if seen >= fraction * count:
+            return float(bound)
+    return float('inf')
+
+
+class Command(BaseCommand):
+    help = 'List the slowest or most query-heavy routes recorded by the request metrics middleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=7,
+            help='Include the last N days',
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=20,
+            help='Number of routes to list',
+        )
+        parser.add_argument(
+            '--sort',
+            choices=SORT_KEYS,
+            default='p95',
+            help='p95 or average total time, total time spent, average queries or average SQL time',
+        )
+
+    def handle(self, *args, **options):
+        since = timezone.localdate() - timedelta(days=options['days'] - 1)
+        routes = defaultdict(lambda: {
+            'count': 0, 'total_ms': 0.0, 'sql_ms': 0.0, 'serialize_ms': 0.0, 'render_ms': 0.0, 'queries': 0,
+            'max_ms': 0.0, 'max_queries': 0, 'histogram': defaultdict(int),
+        })
+        for metric in RequestMetric.objects.filter(day__gte=since):
+            route = routes[(metric.method, metric.route)]
+            for field in ('count', 'total_ms', 'sql_ms', 'serialize_ms', 'render_ms', 'queries'):
+                route[field] += getattr(metric, field)
+            route['max_ms'] = max(route['max_ms'], metric.max_ms)
+            route['max_queries'] = max(route['max_queries'], metric.max_queries)
+            for bucket, count in metric.histogram.items():
+                route['histogram'][bucket] += count
+
+        if not routes:
+            self.stdout.write(self.style.WARNING(
+                f'No request metrics since {since}. Is REQUEST_METRICS=1 set on the servers?'
+            ))
+            return
+
+        rows = []
+        for (method, path), route in routes.items():
+            count = route['count']
+            rows.append({
+                'route': f'{method} /{path}',
+                'count': count,
+                'avg': route['total_ms'] / count,
+                'p95': percentile(route['histogram'], count, 0.95),
+                'max': route['max_ms'],
+                'total': route['total_ms'],
+                'queries': route['queries'] / count,
+                'max_queries': route['max_queries'],
+                'sql': route['sql_ms'] / count,
+                'serialize': route['serialize_ms'] / count,
+                'render': route['render_ms'] / count,
+            })
+        rows.sort(key=lambda row: row[options['sort']], reverse=True)
+
+        self.stdout.write(
+            f"{'route':<60} {'count':>8} {'avg ms':>9} {'p95 ms':>9} {'max ms':>9} "
+            f"{'queries':>8} {'max q':>6} {'sql ms':>8} {'ser ms':>8} {'render':>8}"
+        )
+        for row in rows[:options['top']]:
+            p95 = f"{row['p95']:.0f}" if row['p95'] != float('inf') else f">{LATENCY_BUCKETS_MS[-1]}"
+            self.stdout.write(
+                f"{row['route'][:60]:<60} {row['count']:>8} {row['avg']:>9.1f} {p95:>9} {row['max']:>9.1f} "
+                f"{row['queries']:>8.1f} {row['max_queries']:>6} {row['sql']:>8.1f} {row['serialize']:>8.1f} "
+                f"{row['render']:>8.1f}"
+            )
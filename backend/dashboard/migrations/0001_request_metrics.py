@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('method', models.CharField(max_length=10)),
+                ('route', models.CharField(max_length=255)),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('sql_ms', models.FloatField(default=0)),
+                ('render_ms', models.FloatField(default=0)),
+                ('queries', models.PositiveBigIntegerField(default=0)),
+                ('max_ms', models.FloatField(default=0)),
+                ('max_queries', models.PositiveIntegerField(default=0)),
+                ('histogram', models.JSONField(default=dict)),
+            ],
+            options={
+                'unique_together': {('day', 'method', 'route')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0001_request_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestmetric',
+            name='serialize_ms',
+            field=models.FloatField(default=0),
+        ),
+    ]
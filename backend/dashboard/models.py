@@ -1,3 +1,26 @@
 from django.db import models
 
-# Create your models here.
+
+class RequestMetric(models.Model):
+    """
+    Request timings per (day, method, route), folded in by backend.middleware.RequestMetricsMiddleware.
+    `histogram` counts requests per total-time bucket, keyed by the bucket's upper bound in ms.
+    """
+    day = models.DateField()
+    method = models.CharField(max_length=10)
+    route = models.CharField(max_length=255)
+    count = models.PositiveBigIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    sql_ms = models.FloatField(default=0)
+    serialize_ms = models.FloatField(default=0)
+    render_ms = models.FloatField(default=0)
+    queries = models.PositiveBigIntegerField(default=0)
+    max_ms = models.FloatField(default=0)
+    max_queries = models.PositiveIntegerField(default=0)
+    histogram = models.JSONField(default=dict)
+
+    class Meta:
+        unique_together = ('day', 'method', 'route')
+
+    def __str__(self):
+        return f"{self.day} {self.method} {self.route} x{self.count}"
@@ -0,0 +1,116 @@
+"""
+Top-N movers by product, category, warehouse, sublocation or user.
+
+Product, category and warehouse rankings are read from the daily movement rollups, so
+their cost depends on the number of days and keys in range, not on the ledger size.
+Sublocations and users are not part of the rollups: they are ranked with one grouped
+query over the date-indexed ledger, which is why their range is capped.
+Every ranking is ordered and limited in the database, with ties broken by ID.
+"""
+from datetime import datetime, time, timedelta
+from django.contrib.auth.models import User
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Abs, Coalesce
+from django.utils import timezone
+from product.models import Product
+from warehouse.models import SubLocation, Warehouse
+from operations.models import DailyMovementRollup, MoveHistory
+
+DIMENSIONS = ('product', 'category', 'warehouse', 'sublocation', 'user')
+MEASURES = ('quantity', 'count', 'value')
+DIRECTIONS = ('in', 'out')
+LEDGER_DIMENSIONS = ('sublocation', 'user')
+MAX_LIMIT = 100
+MAX_LEDGER_DAYS = 366
+
+ROLLUP_KEYS = {
+	'product': 'product_id',
+	'category': 'product__category',
+	'warehouse': 'warehouse_id',
+}
+# Incoming value is the purchase value, outgoing value the (weighted-average) cost
+ROLLUP_MEASURES = {
+	'in': {'quantity': 'quantity_in', 'value': 'value'},
+	'out': {'quantity': 'quantity_out', 'value': 'cost_average'},
+}
+
+
+def _rollup_ranking(dimension, measure, direction, day_from, day_to, warehouse_id, move_type):
+	key = ROLLUP_KEYS[dimension]
+	rollups = DailyMovementRollup.objects.filter(day__range=(day_from, day_to))
+	# Warehouse rankings read the warehouse total rows, the others the per-product rows
+	rollups = rollups.filter(product__isnull=dimension == 'warehouse')
+	if warehouse_id:
+		rollups = rollups.filter(warehouse_id=warehouse_id)
+	if move_type:
+		rollups = rollups.filter(move_type=move_type)
+
+	quantity_field = ROLLUP_MEASURES[direction]['quantity']
+	if measure == 'count':
+		total = Sum('document_count', filter=Q(**{f'{quantity_field}__gt': 0}))
+	else:
+		total = Sum(ROLLUP_MEASURES[direction][measure])
+	return rollups.values(key=F(key)).annotate(total=total).filter(total__gt=0)
+
+def _ledger_ranking(dimension, measure, direction, day_from, day_to, warehouse_id, move_type):
+	start = timezone.make_aware(datetime.combine(day_from, time.min))
+	end = timezone.make_aware(datetime.combine(day_to + timedelta(days=1), time.min))
+	moves = MoveHistory.objects.filter(date__gte=start, date__lt=end)
+	if move_type:
+		moves = moves.filter(move_type=move_type)
+
+	if direction == 'in':
+		moves = moves.filter(to_location__isnull=False, quantity__gt=0)
+		location = F('to_location_id')
+		if warehouse_id:
+			moves = moves.filter(to_location__warehouse_id=warehouse_id)
+	else:
+		# Negative adjustments take stock out of their location
+		moves = moves.filter(Q(from_location__isnull=False) | Q(quantity__lt=0))
+		location = Coalesce('from_location_id', 'to_location_id')
+		if warehouse_id:
+			moves = moves.filter(
+				Q(from_location__warehouse_id=warehouse_id) | Q(from_location__isnull=True, to_location__warehouse_id=warehouse_id)
+			)
+
+	if measure == 'quantity':
+		total = Sum(Abs('quantity'))
+	elif measure == 'count':
+		total = Count('operation_reference', distinct=True)
+	else:
+		total = Sum(F('quantity') * F('unit_price'))
+	key = location if dimension == 'sublocation' else F('user_id')
+	return moves.values(key=key).annotate(total=total).filter(key__isnull=False, total__gt=0)
+
+def _labels(dimension, keys):
+	if dimension == 'product':
+		return {product.pk: f"{product.name} ({product.sku})" for product in Product.objects.filter(pk__in=keys)}
+	if dimension == 'category':
+		return dict(Product.CATEGORY_CHOICES)
+	if dimension == 'warehouse':
+		return {warehouse.pk: warehouse.name for warehouse in Warehouse.objects.filter(pk__in=keys)}
+	if dimension == 'sublocation':
+		return dict(SubLocation.objects.filter(pk__in=keys).values_list('id', 'code'))
+	return dict(User.objects.filter(pk__in=keys).values_list('id', 'username'))
+
+def top_movers(dimension, measure, direction, limit, day_from, day_to, warehouse_id=None, move_type=None):
+	"""
+	The `limit` keys of `dimension` with the largest `measure` of stock moving `direction`
+	between day_from and day_to, as [{'key', 'label', 'total'}].
+	Raises ValueError for combinations that cannot be answered.
+	"""
+	if dimension in LEDGER_DIMENSIONS:
+		if measure == 'value' and direction == 'out':
+			raise ValueError("Outgoing value is only available by product, category or warehouse")
+		if (day_to - day_from).days >= MAX_LEDGER_DAYS:
+			raise ValueError(f"Rankings by {dimension} cover at most {MAX_LEDGER_DAYS} days")
+		ranking = _ledger_ranking(dimension, measure, direction, day_from, day_to, warehouse_id, move_type)
+	else:
+		ranking = _rollup_ranking(dimension, measure, direction, day_from, day_to, warehouse_id, move_type)
+
+	rows = list(ranking.order_by('-total', 'key')[:limit])
+	labels = _labels(dimension, [row['key'] for row in rows])
+	return [
+		{'key': row['key'], 'label': labels.get(row['key'], row['key']), 'total': float(row['total'])}
+		for row in rows
+	]
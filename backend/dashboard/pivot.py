@@ -0,0 +1,73 @@
+"""
+Warehouse x product category grid. One grouped query per measure returns the
+non-empty cells; NumPy lays them onto the dense grid and adds the totals.
+"""
+from django.db.models import F, Sum
+import numpy as np
+from product.models import Product
+from warehouse.models import ProductWarehouseStockTotal, Warehouse
+from operations.models import DailyMovementRollup, StockValuation
+
+# measure: (model, value expression, whether the measure covers a date range)
+MEASURES = {
+	'on_hand': (ProductWarehouseStockTotal, 'quantity', False),
+	'stock_value': (StockValuation, 'average_value', False),
+	'quantity_in': (DailyMovementRollup, 'quantity_in', True),
+	'quantity_out': (DailyMovementRollup, 'quantity_out', True),
+}
+
+
+def grouped_cells(measure, day_from=None, day_to=None):
+	"""Rows of {'warehouse_', 'category_', 'total'} for the cells that have data."""
+	model, field, ranged = MEASURES[measure]
+	queryset = model.objects.all()
+	if ranged:
+		queryset = queryset.filter(product__isnull=False, day__range=(day_from, day_to))
+	return queryset.values(warehouse_=F('warehouse_id'), category_=F('product__category')).annotate(
+		total=Sum(field)
+	).order_by()
+
+def pivot_matrix(row_keys, column_keys, cells):
+	"""
+	Scatter cells onto a len(row_keys) x len(column_keys) float matrix.
+	row_keys must be sorted; cells outside the keys are dropped.
+	"""
+	matrix = np.zeros((len(row_keys), len(column_keys)))
+	if not cells or not len(row_keys):
+		return matrix
+	row_keys = np.asarray(row_keys)
+	warehouses = np.array([cell['warehouse_'] for cell in cells])
+	rows = np.minimum(np.searchsorted(row_keys, warehouses), len(row_keys) - 1)
+	columns_index = {key: i for i, key in enumerate(column_keys)}
+	columns = np.array([columns_index.get(cell['category_'], -1) for cell in cells])
+	values = np.array([float(cell['total'] or 0) for cell in cells])
+	known = (row_keys[rows] == warehouses) & (columns >= 0)
+	np.add.at(matrix, (rows[known], columns[known]), values[known])
+	return matrix
+
+def warehouse_category_pivot(measure, day_from=None, day_to=None):
+	"""
+	Column-oriented grid: warehouse ids and names along the rows, category codes
+	and labels along the columns, then the values row by row and the totals.
+	"""
+	warehouses = list(Warehouse.objects.order_by('id').values_list('id', 'name'))
+	categories = Product.CATEGORY_CHOICES
+	matrix = pivot_matrix(
+		[warehouse_id for warehouse_id, _ in warehouses],
+		[code for code, _ in categories],
+		list(grouped_cells(measure, day_from, day_to)),
+	)
+	return {
+		'rows': {
+			'ids': [warehouse_id for warehouse_id, _ in warehouses],
+			'labels': [name for _, name in warehouses],
+		},
+		'columns': {
+			'codes': [code for code, _ in categories],
+			'labels': [label for _, label in categories],
+		},
+		'values': matrix.tolist(),
+		'row_totals': matrix.sum(axis=1).tolist(),
+		'column_totals': matrix.sum(axis=0).tolist(),
+		'grand_total': float(matrix.sum()),
+	}
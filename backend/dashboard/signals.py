@@ -0,0 +1,42 @@
+from collections import defaultdict
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from warehouse.models import Stock
+from operations.models import Receipt, Delivery, InternalTransfer
+from operations.signals import stock_changed
+from .events import KPIS_CHANNEL, get_broker, publish, warehouse_channel
+
+
+@receiver(stock_changed)
+def stock_changed_handler(sender, keys, **kwargs):
+	"""
+	Push the new quantities of the changed Stock rows to their warehouse's channel.
+	stock_changed is sent after commit, so the rows read here are the committed ones.
+	"""
+	if not get_broker().has_subscribers():
+		return
+	changed = defaultdict(list)
+	rows = Stock.objects.filter(
+		product_id__in={product_id for product_id, _ in keys},
+		sublocation_id__in={sublocation_id for _, sublocation_id in keys},
+	).values('product_id', 'sublocation_id', 'sublocation__warehouse_id', 'quantity', 'reserved_quantity')
+	for row in rows:
+		if (row['product_id'], row['sublocation_id']) in keys:
+			changed[row['sublocation__warehouse_id']].append({
+				'product_id': row['product_id'],
+				'sublocation_id': row['sublocation_id'],
+				'quantity': row['quantity'],
+				'reserved_quantity': row['reserved_quantity'],
+			})
+	for warehouse_id, stocks in changed.items():
+		publish(warehouse_channel(warehouse_id), 'stock', {'warehouse_id': warehouse_id, 'stocks': stocks})
+	publish(KPIS_CHANNEL, 'kpis', {})
+
+def document_changed_handler(sender, **kwargs):
+	# Pending document counts are part of the KPIs
+	transaction.on_commit(lambda: publish(KPIS_CHANNEL, 'kpis', {}))
+
+for model in (Receipt, Delivery, InternalTransfer):
+	post_save.connect(document_changed_handler, sender=model, dispatch_uid=f'dashboard_{model.__name__}_saved')
+	post_delete.connect(document_changed_handler, sender=model, dispatch_uid=f'dashboard_{model.__name__}_deleted')
@@ -1,3 +1,442 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import itertools
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from backend.middleware import RequestTimings, _current_timings, instrument_serializers
+from product.models import Product
+from product.serializers import ProductListSerializer
+from warehouse.models import Stock, SubLocation, Warehouse
+from operations.models import Delivery, DeliveryItem, InternalTransfer, Receipt, ReceiptItem
+from operations.services import validate_documents
+from .events import KPIS_CHANNEL, EventBroker, InProcessBroker, publish, warehouse_channel
+from .models import RequestMetric
+from .movers import MAX_LEDGER_DAYS, top_movers
+from .pivot import pivot_matrix, warehouse_category_pivot
+from .timeseries import bucket_axis, bucket_start, dense_matrix, trailing_mean
+from .views import LiveEventsView, compute_kpis
+
+
+def make_products(count, prefix='P'):
+	return Product.objects.bulk_create([
+		Product(sku=f"{prefix}-{i:05d}", name=f"Product {i}", category='FIN', type='Unit', weight=1)
+		for i in range(count)
+	])
+
+
+class KPITests(TestCase):
+	"""
+	KPIs come from the maintained stock totals and stay cached until a write.
+	"""
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+		cls.location = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+		cls.plenty, cls.few, cls.none = make_products(3)
+		cls.user = User.objects.create_user("clerk", password="x")
+
+	def setUp(self):
+		cache.clear()
+		for number, (product, quantity) in enumerate(((self.plenty, 50), (self.few, 4)), start=1):
+			self.receive(number, product, quantity, validate=True)
+		# The last unit of `none` leaves again
+		self.receive(3, self.none, 1, validate=True)
+		delivery = Delivery.objects.create(
+			reference="WH/OUT/0001", warehouse=self.warehouse, customer="C", date=datetime.date.today()
+		)
+		DeliveryItem.objects.create(delivery=delivery, product=self.none, location=self.location, quantity=1)
+		validate_documents({'delivery': [delivery.pk]})
+
+	def receive(self, number, product, quantity, validate=False):
+		receipt = Receipt.objects.create(
+			reference=f"WH/IN/{number:04d}", warehouse=self.warehouse, supplier="S", date=datetime.date.today()
+		)
+		ReceiptItem.objects.create(receipt=receipt, product=product, location=self.location, quantity=quantity)
+		if validate:
+			validate_documents({'receipt': [receipt.pk]})
+		return receipt
+
+	def kpis(self, threshold=10):
+		client = APIClient()
+		client.force_authenticate(self.user)
+		return client.get(f"/api/dashboard/kpis/?low_stock_threshold={threshold}").json()['kpis']
+
+	def test_counts_in_two_queries(self):
+		self.receive(4, self.plenty, 1)
+		InternalTransfer.objects.create(
+			reference="WH/INT/0001", from_warehouse=self.warehouse, to_warehouse=self.warehouse, date=datetime.date.today()
+		)
+
+		with CaptureQueriesContext(connection) as ctx:
+			kpis = compute_kpis(10)
+
+		self.assertEqual(len(ctx.captured_queries), 2)
+		self.assertEqual(kpis, {
+			'total_products_in_stock': 54,
+			'low_stock_items': 2,
+			'out_of_stock_items': 1,
+			'pending_receipts': 1,
+			'pending_deliveries': 0,
+			'internal_transfers_scheduled': 1,
+		})
+		self.assertEqual(compute_kpis(3)['low_stock_items'], 1)
+
+	def test_cached_until_a_write(self):
+		self.assertEqual(self.kpis()['pending_receipts'], 0)
+		with CaptureQueriesContext(connection) as ctx:
+			self.kpis()
+		# Only the session's user lookup, no KPI queries
+		self.assertFalse(any('stock' in query['sql'].lower() for query in ctx.captured_queries))
+
+		with self.captureOnCommitCallbacks(execute=True):
+			self.receive(4, self.plenty, 1)
+		self.assertEqual(self.kpis()['pending_receipts'], 1)
+
+
+class TopMoversTests(TestCase):
+	"""
+	Product, category and warehouse rankings read the rollups; sublocation and user
+	rankings read the ledger over a capped range.
+	"""
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+		cls.front = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+		cls.back = SubLocation.objects.create(warehouse=cls.warehouse, aisle="B1")
+		cls.apple, cls.pear = make_products(2)
+		cls.pear.category = 'RAW'
+		cls.pear.save()
+		cls.clerk = User.objects.create_user("clerk", password="x")
+		cls.picker = User.objects.create_user("picker", password="x")
+
+		receipt = Receipt.objects.create(
+			reference="WH/IN/0001", warehouse=cls.warehouse, supplier="S", date=datetime.date.today()
+		)
+		ReceiptItem.objects.create(receipt=receipt, product=cls.apple, location=cls.front, quantity=10)
+		ReceiptItem.objects.create(receipt=receipt, product=cls.pear, location=cls.back, quantity=10)
+		validate_documents({'receipt': [receipt.pk]}, user=cls.clerk)
+		for number, (product, location, quantity) in enumerate(((cls.apple, cls.front, 6), (cls.pear, cls.back, 2)), start=1):
+			delivery = Delivery.objects.create(
+				reference=f"WH/OUT/{number:04d}", warehouse=cls.warehouse, customer="C", date=datetime.date.today()
+			)
+			DeliveryItem.objects.create(delivery=delivery, product=product, location=location, quantity=quantity)
+			validate_documents({'delivery': [delivery.pk]}, user=cls.picker)
+
+	def rank(self, dimension, measure='quantity', direction='out', limit=10, days=30):
+		today = datetime.date.today()
+		with CaptureQueriesContext(connection) as ctx:
+			results = top_movers(dimension, measure, direction, limit, today - datetime.timedelta(days=days), today)
+		ledger = any('operations_movehistory' in query['sql'] for query in ctx.captured_queries)
+		return [(row['label'], row['total']) for row in results], ledger
+
+	def test_rollup_dimensions_do_not_read_the_ledger(self):
+		self.assertEqual(self.rank('product'), ([(str(self.apple), 6), (str(self.pear), 2)], False))
+		self.assertEqual(self.rank('product', limit=1), ([(str(self.apple), 6)], False))
+		self.assertEqual(self.rank('category', measure='count'), ([('Finished Goods', 1), ('Raw Material', 1)], False))
+		self.assertEqual(self.rank('warehouse', direction='in'), ([("Main", 20)], False))
+
+	def test_ledger_dimensions_read_the_ledger(self):
+		self.assertEqual(self.rank('sublocation'), ([(self.front.code, 6), (self.back.code, 2)], True))
+		self.assertEqual(self.rank('user', direction='in'), ([("clerk", 20)], True))
+		self.assertEqual(self.rank('user', measure='count'), ([("picker", 2)], True))
+
+	def test_ledger_range_is_capped(self):
+		self.rank('sublocation', days=MAX_LEDGER_DAYS - 1)
+		with self.assertRaises(ValueError):
+			self.rank('sublocation', days=MAX_LEDGER_DAYS)
+		with self.assertRaises(ValueError):
+			self.rank('user', measure='value')
+		# Rollup rankings have no cap
+		self.assertEqual(self.rank('product', days=3 * MAX_LEDGER_DAYS)[0][0], (str(self.apple), 6))
+
+		client = APIClient()
+		client.force_authenticate(self.clerk)
+		response = client.get("/api/dashboard/top-movers/?dimension=user&date_from=2020-01-01&date_to=2024-01-01")
+		self.assertEqual(response.status_code, 400)
+		self.assertIn(str(MAX_LEDGER_DAYS), response.json()['error'])
+
+
+class PivotTests(TestCase):
+
+	def test_cells_outside_the_keys_are_dropped(self):
+		cells = [
+			{'warehouse_': 2, 'category_': 'RAW', 'total': 3},
+			{'warehouse_': 2, 'category_': 'RAW', 'total': 1},
+			{'warehouse_': 5, 'category_': 'FIN', 'total': None},
+			# Before, between and after the known warehouses, and an unknown category
+			{'warehouse_': 1, 'category_': 'RAW', 'total': 7},
+			{'warehouse_': 3, 'category_': 'RAW', 'total': 7},
+			{'warehouse_': 9, 'category_': 'FIN', 'total': 7},
+			{'warehouse_': 5, 'category_': 'OLD', 'total': 7},
+		]
+		matrix = pivot_matrix([2, 5], ['RAW', 'FIN'], cells)
+		self.assertEqual(matrix.tolist(), [[4, 0], [0, 0]])
+		self.assertEqual(pivot_matrix([], ['RAW'], cells).shape, (0, 1))
+
+	def test_grid_totals(self):
+		north = Warehouse.objects.create(name="North", code="N")
+		south = Warehouse.objects.create(name="South", code="S")
+		Warehouse.objects.create(name="Empty", code="E")
+		raw, fin = make_products(2)
+		raw.category = 'RAW'
+		raw.save()
+		north_bin = SubLocation.objects.create(warehouse=north, aisle="A1")
+		south_bin = SubLocation.objects.create(warehouse=south, aisle="B1")
+		Stock.objects.create(product=raw, sublocation=north_bin, quantity=5)
+		Stock.objects.create(product=fin, sublocation=north_bin, quantity=2)
+		Stock.objects.create(product=fin, sublocation=south_bin, quantity=3)
+
+		pivot = warehouse_category_pivot('on_hand')
+
+		self.assertEqual(pivot['rows']['labels'], ["North", "South", "Empty"])
+		self.assertEqual(pivot['columns']['codes'], ['RAW', 'FIN', 'PART'])
+		self.assertEqual(pivot['values'], [[5, 2, 0], [0, 3, 0], [0, 0, 0]])
+		self.assertEqual(pivot['row_totals'], [7, 3, 0])
+		self.assertEqual(pivot['column_totals'], [5, 5, 0])
+		self.assertEqual(pivot['grand_total'], 10)
+
+
+class TimeSeriesBucketTests(SimpleTestCase):
+
+	def days(self, axis):
+		return [str(day) for day in axis]
+
+	def test_month_axis_crosses_month_and_year_ends(self):
+		axis = bucket_axis(datetime.date(2024, 12, 31), datetime.date(2025, 3, 1), 'month')
+		self.assertEqual(self.days(axis), ['2024-12-01', '2025-01-01', '2025-02-01', '2025-03-01'])
+		self.assertEqual(bucket_start(datetime.date(2024, 2, 29), 'month'), datetime.date(2024, 2, 1))
+
+	def test_week_axis_starts_on_monday(self):
+		# Sunday 2025-03-02 belongs to the week of Monday 2025-02-24
+		axis = bucket_axis(datetime.date(2025, 3, 2), datetime.date(2025, 3, 10), 'week')
+		self.assertEqual(self.days(axis), ['2025-02-24', '2025-03-03', '2025-03-10'])
+
+	def test_day_axis_is_inclusive(self):
+		axis = bucket_axis(datetime.date(2025, 2, 27), datetime.date(2025, 3, 1), 'day')
+		self.assertEqual(self.days(axis), ['2025-02-27', '2025-02-28', '2025-03-01'])
+
+	def test_dense_matrix_fills_gaps_and_sums_duplicates(self):
+		axis = bucket_axis(datetime.date(2025, 1, 1), datetime.date(2025, 3, 31), 'month')
+		rows = [
+			{'bucket': datetime.date(2025, 1, 1), 'move_type': 'IN', 'quantity': 4},
+			{'bucket': datetime.date(2025, 3, 1), 'move_type': 'OUT', 'quantity': 2},
+			{'bucket': datetime.date(2025, 3, 1), 'move_type': 'OUT', 'quantity': 1},
+			{'bucket': datetime.date(2025, 3, 1), 'move_type': 'IN', 'quantity': None},
+		]
+		matrix = dense_matrix(axis, rows, ['IN', 'OUT'], 'quantity')
+		self.assertEqual(matrix.tolist(), [[4, 0, 0], [0, 0, 3]])
+		self.assertEqual(dense_matrix(axis, [], ['IN'], 'quantity').tolist(), [[0, 0, 0]])
+
+	def test_trailing_mean_window_longer_than_series(self):
+		self.assertEqual(trailing_mean(np.array([2.0, 4.0, 6.0]), 7).tolist(), [2.0, 3.0, 4.0])
+		self.assertEqual(trailing_mean(np.array([2.0, 4.0, 6.0, 8.0]), 2).tolist(), [2.0, 3.0, 5.0, 7.0])
+		self.assertEqual(trailing_mean(np.array([]), 3).tolist(), [])
+
+
+class RequestMetricsTests(TestCase):
+	"""
+	The metrics middleware splits request time into SQL, serializer and rendering
+	time and folds it per route; request_metrics lists the worst routes.
+	"""
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user("clerk", password="x")
+		make_products(5)
+
+	@override_settings(REQUEST_METRICS_ENABLED=True, REQUEST_METRICS_FLUSH_SECONDS=0)
+	def test_requests_are_timed_per_route(self):
+		client = APIClient()
+		client.force_authenticate(self.user)
+		for _ in range(2):
+			response = client.get("/api/product/")
+			self.assertEqual(response.status_code, 200)
+
+		timings = dict(part.split(';')[:2] for part in response['Server-Timing'].split(', '))
+		self.assertEqual(set(timings), {'db', 'serialize', 'render', 'total'})
+		metric = RequestMetric.objects.get()
+		self.assertEqual((metric.method, metric.route, metric.count), ('GET', 'api/product/', 2))
+		self.assertGreater(metric.queries, 0)
+		self.assertGreater(metric.serialize_ms, 0)
+		self.assertGreater(metric.render_ms, 0)
+		self.assertEqual(sum(metric.histogram.values()), 2)
+
+	def test_nested_serializer_data_counts_once(self):
+		instrument_serializers()
+
+		class Outer(serializers.Serializer):
+			products = serializers.SerializerMethodField()
+
+			def get_products(self, obj):
+				return ProductListSerializer(Product.objects.all(), many=True).data
+
+		# Every perf_counter() call advances the clock by one second
+		with mock.patch('backend.middleware.time.perf_counter', side_effect=itertools.count()):
+			self.assertEqual(len(Outer({}).data['products']), 5)
+			timings = RequestTimings()
+			token = _current_timings.set(timings)
+			try:
+				Outer({}).data
+			finally:
+				_current_timings.reset(token)
+		self.assertEqual(timings.serialize_ms, 1000)
+
+	def test_command_lists_the_slowest_routes(self):
+		today = timezone.localdate()
+		RequestMetric.objects.bulk_create([
+			RequestMetric(day=today, method='GET', route='api/fast/', count=4, total_ms=40, sql_ms=8,
+				serialize_ms=4, render_ms=4, queries=8, max_ms=20, max_queries=2, histogram={'10': 3, '25': 1}),
+			RequestMetric(day=today, method='GET', route='api/slow/', count=2, total_ms=600, sql_ms=500,
+				serialize_ms=60, render_ms=20, queries=40, max_ms=400, max_queries=30, histogram={'250': 1, '500': 1}),
+			RequestMetric(day=today - datetime.timedelta(days=30), method='GET', route='api/old/', count=1,
+				total_ms=90000, histogram={'inf': 1}),
+		])
+
+		out = io.StringIO()
+		call_command('request_metrics', '--sort', 'avg', stdout=out)
+		lines = out.getvalue().splitlines()
+		self.assertEqual([line.split()[1] for line in lines[1:]], ['/api/slow/', '/api/fast/'])
+		# count, avg, p95, max, queries, max q, sql, serialize, render
+		self.assertEqual(lines[1].split()[2:], ['2', '300.0', '500', '400.0', '20.0', '30', '250.0', '30.0', '10.0'])
+
+		out = io.StringIO()
+		call_command('request_metrics', '--days', '1', '--sort', 'queries', '--top', '1', stdout=out)
+		self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+		RequestMetric.objects.all().delete()
+		out = io.StringIO()
+		call_command('request_metrics', stdout=out)
+		self.assertIn('No request metrics', out.getvalue())
+
+
+class LiveEventsAuthenticationTests(TestCase):
+	"""
+	The event stream takes the access token from the Authorization header only;
+	URLs carry a short-lived, single-use ticket instead.
+	"""
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user("clerk", password="x")
+
+	def setUp(self):
+		cache.clear()
+
+	def ticket(self):
+		client = APIClient()
+		client.force_authenticate(self.user)
+		response = client.post("/api/dashboard/events/ticket/")
+		self.assertEqual(response.status_code, 200, response.content)
+		return response.json()['ticket']
+
+	def authenticate(self, query='', **headers):
+		request = RequestFactory().get(f"/api/dashboard/events/{query}", **headers)
+		return async_to_sync(LiveEventsView().authenticate)(request)
+
+	def test_ticket_opens_one_stream(self):
+		ticket = self.ticket()
+
+		self.assertEqual(self.authenticate(f"?ticket={ticket}"), self.user)
+		self.assertIsNone(self.authenticate(f"?ticket={ticket}"))
+
+	def test_expired_or_forged_ticket_is_refused(self):
+		ticket = self.ticket()
+		with mock.patch('dashboard.views.EVENTS_TICKET_SECONDS', -1):
+			self.assertIsNone(self.authenticate(f"?ticket={ticket}"))
+		self.assertIsNone(self.authenticate(f"?ticket={ticket[:-2]}xx"))
+
+	def test_access_token_is_only_read_from_the_header(self):
+		token = str(AccessToken.for_user(self.user))
+
+		self.assertIsNone(self.authenticate(f"?token={token}"))
+		self.assertEqual(self.authenticate(HTTP_AUTHORIZATION=f"Bearer {token}"), self.user)
+
+	def test_ticket_requires_authentication(self):
+		self.assertEqual(APIClient().post("/api/dashboard/events/ticket/").status_code, 401)
+
+
+class LiveEventsStreamTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user("clerk", password="x")
+		cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+
+	def url(self):
+		return f"/api/dashboard/events/?warehouse={self.warehouse.pk}&kpis=0"
+
+	def test_refused_under_wsgi(self):
+		token = str(AccessToken.for_user(self.user))
+		response = self.client.get(self.url(), headers={'authorization': f"Bearer {token}"})
+		self.assertEqual(response.status_code, 501)
+
+	async def test_stream_delivers_published_events(self):
+		token = str(AccessToken.for_user(self.user))
+		response = await self.async_client.get(self.url(), headers={'authorization': f"Bearer {token}"})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+		stream = aiter(response.streaming_content)
+		self.assertEqual(await anext(stream), b"retry: 2000\n\n")
+		# Published from another thread, as writers do after their commit
+		await sync_to_async(publish, thread_sensitive=False)(warehouse_channel(self.warehouse.pk), 'stock', {'quantity': 3})
+		event = await asyncio.wait_for(anext(stream), 5)
+		await stream.aclose()
+
+		self.assertTrue(event.startswith(b"event: stock\n"), event)
+		self.assertIn(b'"quantity": 3', event)
+
+
+class EventBrokerTests(TestCase):
+
+	def test_broker_must_implement_the_interface(self):
+		class Incomplete(EventBroker):
+			def publish(self, channel, event):
+				pass
+
+		with self.assertRaises(TypeError):
+			Incomplete()
+
+	def test_events_reach_subscribers_of_their_channel_only(self):
+		broker = InProcessBroker()
+
+		async def scenario():
+			north = broker.subscribe([warehouse_channel(1), KPIS_CHANNEL])
+			south = broker.subscribe([warehouse_channel(2)])
+			await sync_to_async(broker.publish, thread_sensitive=False)(warehouse_channel(1), {'event': 'stock', 'data': 1})
+			received = await north.get(5), await south.get(0.05)
+			broker.unsubscribe(north)
+			broker.unsubscribe(south)
+			return received
+
+		self.assertEqual(async_to_sync(scenario)(), ({'event': 'stock', 'data': 1}, None))
+		self.assertFalse(broker.has_subscribers())
+
+	def test_slow_subscriber_is_told_to_resync(self):
+		broker = InProcessBroker(max_queue=2)
+
+		async def scenario():
+			subscription = broker.subscribe([KPIS_CHANNEL])
+			for i in range(3):
+				broker.publish(KPIS_CHANNEL, {'event': 'kpis', 'data': i})
+			# Deliveries are scheduled on the loop; let them run
+			await asyncio.sleep(0)
+			return await subscription.get(1), await subscription.get(0.05)
+
+		self.assertEqual(async_to_sync(scenario)(), ({'event': 'resync', 'data': {}}, None))
@@ -0,0 +1,50 @@
+"""
+Bucketing helpers for the movement time series. The database truncates and sums,
+NumPy lays the rows onto a dense bucket axis and derives the running series.
+"""
+from datetime import timedelta
+import numpy as np
+
+INTERVALS = ('day', 'week', 'month')
+DEFAULT_WINDOWS = {'day': 7, 'week': 4, 'month': 3}
+MAX_BUCKETS = 1000
+
+
+def bucket_start(day, interval):
+	"""First day of the bucket containing `day`, matching the database truncation."""
+	if interval == 'week':
+		return day - timedelta(days=day.weekday())
+	if interval == 'month':
+		return day.replace(day=1)
+	return day
+
+def bucket_axis(day_from, day_to, interval):
+	"""Every bucket start from day_from to day_to inclusive, as datetime64[D]."""
+	start = np.datetime64(bucket_start(day_from, interval), 'D')
+	end = np.datetime64(bucket_start(day_to, interval), 'D')
+	if interval == 'month':
+		return np.arange(start.astype('datetime64[M]'), end.astype('datetime64[M]') + 1).astype('datetime64[D]')
+	step = 7 if interval == 'week' else 1
+	return np.arange(start, end + 1, step, dtype='datetime64[D]')
+
+def dense_matrix(axis, rows, series, value_field):
+	"""
+	Scatter grouped rows ({'bucket', 'move_type', value_field}) into a
+	len(series) x len(axis) matrix, zero where the database returned nothing.
+	"""
+	matrix = np.zeros((len(series), len(axis)))
+	if not rows:
+		return matrix
+	buckets = np.array([row['bucket'] for row in rows], dtype='datetime64[D]')
+	columns = np.searchsorted(axis, buckets)
+	index = {name: i for i, name in enumerate(series)}
+	lines = np.array([index[row['move_type']] for row in rows])
+	values = np.array([row[value_field] or 0 for row in rows], dtype=float)
+	np.add.at(matrix, (lines, columns), values)
+	return matrix
+
+def trailing_mean(values, window):
+	"""Mean over the last `window` buckets (fewer at the start of the series)."""
+	sums = np.cumsum(values)
+	sums[window:] = sums[window:] - sums[:-window]
+	return sums / np.minimum(np.arange(1, len(values) + 1), window)
@@ -1,7 +1,12 @@
 from django.urls import path
-from .views import DashboardKPIsView, DashboardStatisticsView
+from .views import DashboardKPIsView, DashboardStatisticsView, LiveEventsTicketView, LiveEventsView, MovementTimeSeriesView, TopMoversView, WarehouseCategoryPivotView
 
 urlpatterns = [
     path('kpis/', DashboardKPIsView.as_view(), name='dashboard-kpis'),
     path('statistics/', DashboardStatisticsView.as_view(), name='dashboard-statistics'),
+    path('timeseries/', MovementTimeSeriesView.as_view(), name='dashboard-timeseries'),
+    path('top-movers/', TopMoversView.as_view(), name='dashboard-top-movers'),
+    path('pivot/', WarehouseCategoryPivotView.as_view(), name='dashboard-pivot'),
+    path('events/', LiveEventsView.as_view(), name='dashboard-events'),
+    path('events/ticket/', LiveEventsTicketView.as_view(), name='dashboard-events-ticket'),
 ]
@@ -2,51 +2,110 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from warehouse.models import Stock
+from warehouse.models import ProductStockTotal, ProductWarehouseStockTotal
 from product.models import Product
-from operations.models import Receipt, Delivery, InternalTransfer
-from django.db.models import Sum, Q, Count
+from operations.models import Receipt, Delivery, InternalTransfer, DailyMovementRollup, MoveHistory, StockValuation
+from django.db.models import Sum, Q, Count, Value, F
+from django.db.models.functions import TruncMonth, TruncWeek
 from django.utils import timezone
 from datetime import timedelta, datetime
+from backend.cache import OPERATIONS_CACHE, PRODUCT_CACHE, STOCK_CACHE, WAREHOUSE_CACHE, CachedResponseMixin, cached
+from .events import KPIS_CHANNEL, get_broker, warehouse_channel
+from .movers import DIMENSIONS, DIRECTIONS, MAX_LIMIT, MEASURES, top_movers
+from .pivot import MEASURES as PIVOT_MEASURES, warehouse_category_pivot
+from .timeseries import DEFAULT_WINDOWS, INTERVALS, MAX_BUCKETS, bucket_axis, bucket_start, dense_matrix, trailing_mean
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+import asyncio
+import json
+import logging
+import numpy as np
+import secrets
+
+logger = logging.getLogger(__name__)
+
+# Stock levels, documents and the ledger, and product names in top lists
+DASHBOARD_CACHES = (STOCK_CACHE, OPERATIONS_CACHE, PRODUCT_CACHE)
+
+EVENTS_TICKET_SALT = 'dashboard.events.ticket'
+EVENTS_TICKET_SECONDS = 60
+
+def to_day(value):
+	"""Local calendar day of a datetime, as rollups are keyed by day."""
+	if not value:
+		return None
+	return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+def parse_day_range(params, periods, default_period='30d'):
+	"""
+	(day_from, day_to) from ?date_from=&date_to= (ISO), or the ?period= ending today.
+	Raises ValueError with a message for the client.
+	"""
+	period = params.get('period', default_period)
+	if period not in periods:
+		raise ValueError(f"period must be one of {', '.join(periods)}")
+	try:
+		date_from = to_day(datetime.fromisoformat(params['date_from'].replace('Z', '+00:00'))) if params.get('date_from') else None
+		date_to = to_day(datetime.fromisoformat(params['date_to'].replace('Z', '+00:00'))) if params.get('date_to') else None
+	except ValueError:
+		raise ValueError('Invalid date format. Use ISO format.')
+	date_to = date_to or timezone.localdate()
+	date_from = date_from or date_to - timedelta(days=periods[period])
+	if date_from > date_to:
+		raise ValueError('date_from must not be after date_to')
+	return date_from, date_to
+
+def compute_kpis(low_stock_threshold):
+	"""
+	Dashboard KPIs in two queries: one pass over the maintained per-product stock totals,
+	counted in the database, and one over the unvalidated documents.
+	"""
+	stock = ProductStockTotal.objects.aggregate(
+		total_products_in_stock=Sum('quantity'),
+		low_stock_items=Count('pk', filter=Q(quantity__lte=low_stock_threshold)),
+		out_of_stock_items=Count('pk', filter=Q(quantity__lte=0)),
+	)
+	pending = dict(
+		Receipt.objects.filter(validated=False).values(kind=Value('pending_receipts')).annotate(n=Count('id')).values_list('kind', 'n')
+		.union(Delivery.objects.filter(validated=False).values(kind=Value('pending_deliveries')).annotate(n=Count('id')).values_list('kind', 'n'))
+		.union(InternalTransfer.objects.filter(validated=False).values(kind=Value('internal_transfers_scheduled')).annotate(n=Count('id')).values_list('kind', 'n'))
+	)
+	return {
+		'total_products_in_stock': stock['total_products_in_stock'] or 0,
+		'low_stock_items': stock['low_stock_items'],
+		'out_of_stock_items': stock['out_of_stock_items'],
+		'pending_receipts': pending.get('pending_receipts', 0),
+		'pending_deliveries': pending.get('pending_deliveries', 0),
+		'internal_transfers_scheduled': pending.get('internal_transfers_scheduled', 0),
+	}
+
+def cached_kpis(low_stock_threshold):
+	# Served from cache until stock moves or a document is created, validated or deleted
+	return cached(DASHBOARD_CACHES, f'kpis:{low_stock_threshold}', lambda: compute_kpis(low_stock_threshold))
 
 class DashboardKPIsView(APIView):
 	permission_classes = [IsAuthenticated]
 
 	def get(self, request):
-		# Total products in stock
-		total_products_in_stock = Stock.objects.aggregate(total=Sum('quantity'))['total'] or 0
 		# Low stock / Out of stock items
 		low_stock_threshold = float(request.query_params.get('low_stock_threshold', 10))
-		low_stock = (
-			Stock.objects.values('product')
-			.annotate(total_qty=Sum('quantity'))
-			.filter(total_qty__lte=low_stock_threshold)
-		)
-		out_of_stock = (
-			Stock.objects.values('product')
-			.annotate(total_qty=Sum('quantity'))
-			.filter(total_qty__lte=0)
-		)
-		# Pending receipts
-		pending_receipts = Receipt.objects.filter(validated=False).count()
-		# Pending deliveries
-		pending_deliveries = Delivery.objects.filter(validated=False).count()
-		# Internal transfers scheduled
-		scheduled_transfers = InternalTransfer.objects.filter(validated=False).count()
+		kpis = cached_kpis(low_stock_threshold)
 		return Response({
 			'success': True,
-			'kpis': {
-				'total_products_in_stock': total_products_in_stock,
-				'low_stock_items': len(low_stock),
-				'out_of_stock_items': len(out_of_stock),
-				'pending_receipts': pending_receipts,
-				'pending_deliveries': pending_deliveries,
-				'internal_transfers_scheduled': scheduled_transfers,
-			}
+			'kpis': kpis
 		})
 
-class DashboardStatisticsView(APIView):
+class DashboardStatisticsView(CachedResponseMixin, APIView):
 	permission_classes = [IsAuthenticated]
+	cache_namespaces = DASHBOARD_CACHES
 
 	def get(self, request):
 		# Get filter parameters
@@ -81,64 +140,77 @@ class DashboardStatisticsView(APIView):
 				date_from = now - timedelta(days=365)
 			date_to = now
 
-		# Build base querysets with date filtering
-		receipts_qs = Receipt.objects.filter(created_at__range=(date_from, date_to))
-		deliveries_qs = Delivery.objects.filter(created_at__range=(date_from, date_to))
-		transfers_qs = InternalTransfer.objects.filter(created_at__range=(date_from, date_to))
+		# The default window ends now, so the key carries the days it resolved to
+		return Response(self.cached_payload(
+			request, lambda: self.compute_statistics(date_from, date_to, warehouse_id, product_id, period),
+			day_from=to_day(date_from), day_to=to_day(date_to)
+		))
+
+	def compute_statistics(self, date_from, date_to, warehouse_id, product_id, period):
+		# Movement statistics come from the daily rollups, so the cost depends on the
+		# number of days in range rather than on the number of documents
+		day_from, day_to = to_day(date_from), to_day(date_to)
+		rollups_qs = DailyMovementRollup.objects.all()
+		if day_from:
+			rollups_qs = rollups_qs.filter(day__gte=day_from)
+		if day_to:
+			rollups_qs = rollups_qs.filter(day__lte=day_to)
 
 		# Apply warehouse filter if provided
 		if warehouse_id:
-			receipts_qs = receipts_qs.filter(warehouse_id=warehouse_id)
-			deliveries_qs = deliveries_qs.filter(warehouse_id=warehouse_id)
-			transfers_qs = transfers_qs.filter(from_warehouse_id=warehouse_id) | transfers_qs.filter(to_warehouse_id=warehouse_id)
+			rollups_qs = rollups_qs.filter(warehouse_id=warehouse_id)
 
-		# Apply product filter if provided
-		if product_id:
-			receipts_qs = receipts_qs.filter(receipt_items__product_id=product_id).distinct()
-			deliveries_qs = deliveries_qs.filter(delivery_items__product_id=product_id).distinct()
-			transfers_qs = transfers_qs.filter(transfer_items__product_id=product_id).distinct()
-
-		# Calculate statistics
-		total_receipts = receipts_qs.count()
-		total_deliveries = deliveries_qs.count()
-		total_transfers = transfers_qs.count()
-
-		# Value statistics (assuming receipt_items, delivery_items, transfer_items have quantity and unit_price)
-		receipts_value = receipts_qs.aggregate(
-			total=Sum('receipt_items__quantity') * Sum('receipt_items__unit_price')
-		)['total'] or 0
+		# Product rows when filtering by product, warehouse total rows otherwise
+		totals_qs = rollups_qs.filter(product_id=product_id) if product_id else rollups_qs.filter(product__isnull=True)
 
-		deliveries_value = deliveries_qs.aggregate(
-			total=Sum('delivery_items__quantity') * Sum('delivery_items__unit_price')
-		)['total'] or 0
-
-		transfers_value = transfers_qs.aggregate(
-			total=Sum('transfer_items__quantity') * Sum('transfer_items__unit_price')
-		)['total'] or 0
+		# Calculate statistics in one pass
+		movements = totals_qs.aggregate(
+			total_receipts=Sum('document_count', filter=Q(move_type='IN')),
+			total_deliveries=Sum('document_count', filter=Q(move_type='OUT')),
+			total_transfers=Sum('document_count', filter=Q(move_type='INTERNAL')),
+			receipts_value=Sum('value', filter=Q(move_type='IN')),
+			# Only receipts carry a price; deliveries and transfers are valued at the
+			# weighted-average cost of the units they took out of a warehouse
+			transfers_value=Sum('cost_average', filter=Q(move_type='INTERNAL')),
+			cost_of_goods_sold=Sum('cost_average', filter=Q(move_type='OUT')),
+			cost_of_goods_sold_fifo=Sum('cost_fifo', filter=Q(move_type='OUT')),
+		)
+		total_receipts = movements['total_receipts'] or 0
+		total_deliveries = movements['total_deliveries'] or 0
+		total_transfers = movements['total_transfers'] or 0
+		receipts_value = movements['receipts_value'] or 0
+		deliveries_value = movements['cost_of_goods_sold'] or 0
+		transfers_value = movements['transfers_value'] or 0
 
-		# Stock levels
-		stock_qs = Stock.objects.all()
+		# Stock levels and value, from the maintained per (product, warehouse) totals and valuations
+		totals_filter = {}
 		if warehouse_id:
-			stock_qs = stock_qs.filter(sublocation__warehouse_id=warehouse_id)
+			totals_filter['warehouse_id'] = warehouse_id
 		if product_id:
-			stock_qs = stock_qs.filter(product_id=product_id)
+			totals_filter['product_id'] = product_id
 
-		total_stock_value = stock_qs.aggregate(
-			total=Sum('quantity') * Sum('product__unit_price')
+		total_stock_quantity = ProductWarehouseStockTotal.objects.filter(**totals_filter).aggregate(
+			total=Sum('quantity')
 		)['total'] or 0
-
-		total_stock_quantity = stock_qs.aggregate(total=Sum('quantity'))['total'] or 0
+		stock = StockValuation.objects.filter(**totals_filter).aggregate(
+			total_value=Sum('average_value'),
+			total_value_fifo=Sum('fifo_value'),
+		)
 
 		# Top products by movement
-		top_products_receipts = receipts_qs.values('receipt_items__product__name').annotate(
-			total_qty=Sum('receipt_items__quantity')
+		product_rollups_qs = rollups_qs.filter(product__isnull=False)
+		if product_id:
+			product_rollups_qs = product_rollups_qs.filter(product_id=product_id)
+
+		top_products_receipts = product_rollups_qs.filter(move_type='IN').values('product__name').annotate(
+			total_qty=Sum('quantity_in')
 		).order_by('-total_qty')[:5]
 
-		top_products_deliveries = deliveries_qs.values('delivery_items__product__name').annotate(
-			total_qty=Sum('delivery_items__quantity')
+		top_products_deliveries = product_rollups_qs.filter(move_type='OUT').values('product__name').annotate(
+			total_qty=Sum('quantity_out')
 		).order_by('-total_qty')[:5]
 
-		return Response({
+		return {
 			'success': True,
 			'filters_applied': {
 				'date_from': date_from.isoformat() if date_from else None,
@@ -154,15 +226,307 @@ class DashboardStatisticsView(APIView):
 					'total_transfers': total_transfers,
 					'receipts_value': float(receipts_value),
 					'deliveries_value': float(deliveries_value),
-					'transfers_value': float(transfers_value)
+					'transfers_value': float(transfers_value),
+					'cost_of_goods_sold': float(movements['cost_of_goods_sold'] or 0),
+					'cost_of_goods_sold_fifo': float(movements['cost_of_goods_sold_fifo'] or 0)
 				},
 				'stock': {
 					'total_quantity': total_stock_quantity,
-					'total_value': float(total_stock_value)
+					'total_value': float(stock['total_value'] or 0),
+					'total_value_fifo': float(stock['total_value_fifo'] or 0)
 				},
 				'top_products': {
 					'by_receipts': list(top_products_receipts),
 					'by_deliveries': list(top_products_deliveries)
 				}
 			}
+		}
+
+
+class MovementTimeSeriesView(APIView):
+	"""
+	Movement quantities per day, week or month, split by move type.
+	GET ?interval=day|week|month&date_from=&date_to=&period=30d&warehouse=&product=&window=
+	"""
+	permission_classes = [IsAuthenticated]
+	periods = {'7d': 7, '30d': 30, '90d': 90, '1y': 365}
+
+	def get(self, request):
+		interval = request.query_params.get('interval', 'day')
+		warehouse_id = request.query_params.get('warehouse')
+		product_id = request.query_params.get('product')
+		if interval not in INTERVALS:
+			return Response({'success': False, 'error': f"interval must be one of {', '.join(INTERVALS)}"}, status=400)
+		try:
+			date_from, date_to = parse_day_range(request.query_params, self.periods)
+		except ValueError as e:
+			return Response({'success': False, 'error': str(e)}, status=400)
+		try:
+			window = int(request.query_params.get('window', DEFAULT_WINDOWS[interval]))
+		except ValueError:
+			return Response({'success': False, 'error': 'window must be an integer'}, status=400)
+		if window < 1:
+			return Response({'success': False, 'error': 'window must be at least 1'}, status=400)
+
+		axis = bucket_axis(date_from, date_to, interval)
+		if len(axis) > MAX_BUCKETS:
+			return Response({'success': False, 'error': f'Too many buckets; use a wider interval or a shorter range (max {MAX_BUCKETS})'}, status=400)
+
+		# Warehouse total rows unless a product is asked for
+		rollups_qs = DailyMovementRollup.objects.filter(day__range=(bucket_start(date_from, interval), date_to))
+		if warehouse_id:
+			rollups_qs = rollups_qs.filter(warehouse_id=warehouse_id)
+		rollups_qs = rollups_qs.filter(product_id=product_id) if product_id else rollups_qs.filter(product__isnull=True)
+
+		bucket = F('day') if interval == 'day' else (TruncWeek('day') if interval == 'week' else TruncMonth('day'))
+		rows = list(
+			rollups_qs.annotate(bucket=bucket).values('bucket', 'move_type')
+			.annotate(quantity_in=Sum('quantity_in'), quantity_out=Sum('quantity_out'))
+			.order_by('bucket')
+		)
+
+		move_types = [code for code, _ in MoveHistory.MOVE_TYPE_CHOICES]
+		quantity_in = dense_matrix(axis, rows, move_types, 'quantity_in')
+		quantity_out = dense_matrix(axis, rows, move_types, 'quantity_out')
+		net = (quantity_in - quantity_out).sum(axis=0)
+
+		return Response({
+			'success': True,
+			'filters_applied': {
+				'date_from': date_from.isoformat(),
+				'date_to': date_to.isoformat(),
+				'interval': interval,
+				'warehouse_id': warehouse_id,
+				'product_id': product_id,
+				'window': window
+			},
+			'buckets': np.datetime_as_string(axis).tolist(),
+			'series': {
+				move_type: {
+					'quantity_in': quantity_in[i].tolist(),
+					'quantity_out': quantity_out[i].tolist()
+				}
+				for i, move_type in enumerate(move_types)
+			},
+			'totals': {
+				'net': net.tolist(),
+				'cumulative_net': np.cumsum(net).tolist(),
+				'moving_average_net': trailing_mean(net, window).tolist()
+			}
 		})
+
+
+class TopMoversView(CachedResponseMixin, APIView):
+	"""
+	Top-N movers over a date range.
+	GET ?dimension=product|category|warehouse|sublocation|user&measure=quantity|count|value
+		&direction=in|out&limit=10&date_from=&date_to=&period=30d&warehouse=&move_type=
+	"""
+	permission_classes = [IsAuthenticated]
+	cache_namespaces = DASHBOARD_CACHES + (WAREHOUSE_CACHE,)
+	periods = {'7d': 7, '30d': 30, '90d': 90, '1y': 365}
+
+	def get(self, request):
+		params = request.query_params
+		dimension = params.get('dimension', 'product')
+		measure = params.get('measure', 'quantity')
+		direction = params.get('direction', 'out')
+		move_type = params.get('move_type')
+		warehouse_id = params.get('warehouse')
+		choices = {'dimension': (dimension, DIMENSIONS), 'measure': (measure, MEASURES), 'direction': (direction, DIRECTIONS)}
+		for name, (value, allowed) in choices.items():
+			if value not in allowed:
+				return Response({'success': False, 'error': f"{name} must be one of {', '.join(allowed)}"}, status=400)
+		if move_type and move_type not in dict(MoveHistory.MOVE_TYPE_CHOICES):
+			return Response({'success': False, 'error': 'Unknown move_type'}, status=400)
+		try:
+			limit = int(params.get('limit', 10))
+			date_from, date_to = parse_day_range(params, self.periods)
+		except ValueError as e:
+			return Response({'success': False, 'error': str(e)}, status=400)
+		if not 1 <= limit <= MAX_LIMIT:
+			return Response({'success': False, 'error': f'limit must be between 1 and {MAX_LIMIT}'}, status=400)
+
+		def compute():
+			return {
+				'success': True,
+				'filters_applied': {
+					'dimension': dimension,
+					'measure': measure,
+					'direction': direction,
+					'limit': limit,
+					'date_from': date_from.isoformat(),
+					'date_to': date_to.isoformat(),
+					'warehouse_id': warehouse_id,
+					'move_type': move_type
+				},
+				'results': top_movers(dimension, measure, direction, limit, date_from, date_to, warehouse_id, move_type)
+			}
+		try:
+			return Response(self.cached_payload(request, compute, date_from=date_from, date_to=date_to))
+		except ValueError as e:
+			return Response({'success': False, 'error': str(e)}, status=400)
+
+
+class WarehouseCategoryPivotView(CachedResponseMixin, APIView):
+	"""
+	Warehouse x product category grid with row and column totals.
+	GET ?measure=on_hand|stock_value|quantity_in|quantity_out&date_from=&date_to=&period=30d
+	The date range only applies to the movement measures.
+	"""
+	permission_classes = [IsAuthenticated]
+	cache_namespaces = DASHBOARD_CACHES + (WAREHOUSE_CACHE,)
+	periods = {'7d': 7, '30d': 30, '90d': 90, '1y': 365}
+
+	def get(self, request):
+		measure = request.query_params.get('measure', 'on_hand')
+		if measure not in PIVOT_MEASURES:
+			return Response({'success': False, 'error': f"measure must be one of {', '.join(PIVOT_MEASURES)}"}, status=400)
+		date_from = date_to = None
+		if PIVOT_MEASURES[measure][2]:
+			try:
+				date_from, date_to = parse_day_range(request.query_params, self.periods)
+			except ValueError as e:
+				return Response({'success': False, 'error': str(e)}, status=400)
+
+		def compute():
+			return {
+				'success': True,
+				'filters_applied': {
+					'measure': measure,
+					'date_from': date_from.isoformat() if date_from else None,
+					'date_to': date_to.isoformat() if date_to else None
+				},
+				'pivot': warehouse_category_pivot(measure, date_from, date_to)
+			}
+		return Response(self.cached_payload(request, compute, date_from=date_from, date_to=date_to))
+
+
+def sse(name, data):
+	return f"event: {name}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+def issue_events_ticket(user):
+	"""Signed ticket that opens one event stream for `user` within EVENTS_TICKET_SECONDS."""
+	return signing.dumps({'user': user.pk, 'nonce': secrets.token_urlsafe(12)}, salt=EVENTS_TICKET_SALT)
+
+def redeem_events_ticket(ticket):
+	"""
+	User id of a valid ticket on its first use, None otherwise. Used tickets are
+	remembered until they expire, so one copied from a log opens nothing.
+	"""
+	try:
+		payload = signing.loads(ticket, salt=EVENTS_TICKET_SALT, max_age=EVENTS_TICKET_SECONDS)
+	except signing.BadSignature:
+		return None
+	if not cache.add(f"events-ticket:{payload['nonce']}", True, timeout=EVENTS_TICKET_SECONDS):
+		return None
+	return payload['user']
+
+
+class LiveEventsTicketView(APIView):
+	"""
+	POST: a short-lived, single-use ticket for opening the event stream with ?ticket=,
+	for clients such as EventSource that cannot send an Authorization header.
+	"""
+	permission_classes = [IsAuthenticated]
+
+	def post(self, request):
+		user = request.user
+		logger.info(f"[EVENTS] Ticket issued to user: {user.username} (ID: {user.id})")
+		return Response({
+			'success': True,
+			'ticket': issue_events_ticket(user),
+			'expires_in': EVENTS_TICKET_SECONDS
+		})
+
+class LiveEventsView(View):
+	"""
+	Server-sent events for the dashboard and the mobile app, instead of polling.
+	GET ?warehouse=<id>&warehouse=<id>&kpis=1&low_stock_threshold=10&ticket=<ticket>
+
+	Events: 'stock' with the new quantities of changed Stock rows in a subscribed
+	warehouse, 'kpis' with the recomputed KPIs, and 'resync' when the client fell
+	behind and should re-read everything. Authenticated by the JWT access token in
+	Authorization or, since EventSource cannot send headers, by a ticket from
+	POST events/ticket/; the access token itself never goes in the URL, where proxies
+	and access logs would record it. A ticket opens one stream, so reconnecting
+	takes a new one.
+
+	Only served under ASGI (uvicorn backend.asgi:application): a WSGI worker would be
+	held by the endless stream and buffer it in memory, so it answers 501 there.
+	"""
+	heartbeat_seconds = 15
+	# KPI changes are coalesced: a burst of validations costs one recompute per client
+	kpis_interval_seconds = 1
+
+	async def get(self, request):
+		if not isinstance(request, ASGIRequest):
+			return JsonResponse({'success': False, 'error': 'Live events need the ASGI server; poll the dashboard endpoints instead.'}, status=501)
+		user = await self.authenticate(request)
+		if user is None:
+			return JsonResponse({'success': False, 'error': 'Authentication credentials were not provided or are invalid.'}, status=401)
+		try:
+			warehouse_ids = sorted({int(value) for value in request.GET.getlist('warehouse')})
+			low_stock_threshold = float(request.GET.get('low_stock_threshold', 10))
+		except ValueError:
+			return JsonResponse({'success': False, 'error': 'warehouse must be an integer and low_stock_threshold a number'}, status=400)
+		with_kpis = request.GET.get('kpis', '1') not in ('0', 'false')
+
+		channels = [warehouse_channel(warehouse_id) for warehouse_id in warehouse_ids]
+		if with_kpis:
+			channels.append(KPIS_CHANNEL)
+		if not channels:
+			return JsonResponse({'success': False, 'error': 'Subscribe to at least one warehouse or to kpis'}, status=400)
+
+		logger.info(f"[EVENTS] Stream opened by user: {user.username} (ID: {user.id}) for channels: {', '.join(channels)}")
+		response = StreamingHttpResponse(
+			self.stream(channels, with_kpis, low_stock_threshold), content_type='text/event-stream'
+		)
+		response['Cache-Control'] = 'no-cache'
+		# Keep reverse proxies from buffering the stream
+		response['X-Accel-Buffering'] = 'no'
+		return response
+
+	async def authenticate(self, request):
+		authentication = JWTAuthentication()
+		header = authentication.get_header(request)
+		if header is None:
+			ticket = request.GET.get('ticket')
+			user_id = await sync_to_async(redeem_events_ticket)(ticket) if ticket else None
+			if user_id is None:
+				return None
+			return await get_user_model().objects.filter(pk=user_id, is_active=True).afirst()
+		raw_token = authentication.get_raw_token(header)
+		if not raw_token:
+			return None
+		try:
+			validated_token = authentication.get_validated_token(raw_token)
+			return await sync_to_async(authentication.get_user)(validated_token)
+		except AuthenticationFailed:
+			return None
+
+	async def stream(self, channels, with_kpis, low_stock_threshold):
+		broker = get_broker()
+		subscription = broker.subscribe(channels)
+		loop = asyncio.get_running_loop()
+		get_kpis = sync_to_async(cached_kpis)
+		try:
+			yield "retry: 2000\n\n"
+			if with_kpis:
+				yield sse('kpis', await get_kpis(low_stock_threshold))
+			kpis_due = None
+			while True:
+				timeout = self.heartbeat_seconds if kpis_due is None else max(kpis_due - loop.time(), 0)
+				event = await subscription.get(timeout)
+				if event is not None and event['event'] == 'kpis':
+					kpis_due = kpis_due or loop.time() + self.kpis_interval_seconds
+				elif event is not None:
+					yield sse(event['event'], event['data'])
+				if kpis_due is not None and loop.time() >= kpis_due:
+					kpis_due = None
+					yield sse('kpis', await get_kpis(low_stock_threshold))
+				elif event is None:
+					yield ": keep-alive\n\n"
+		finally:
+			broker.unsubscribe(subscription)
+			logger.info(f"[EVENTS] Stream closed for channels: {', '.join(channels)}")
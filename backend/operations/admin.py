@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Receipt, Delivery, InternalTransfer, StockAdjustment, MoveHistory
+from .models import Receipt, Delivery, InternalTransfer, StockAdjustment, MoveHistory, ValidationJob
 
 # Register your models here.
 
@@ -95,3 +95,21 @@ class MoveHistoryAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+
+    # The ledger is append-only; moves are written by operations.services
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ValidationJob)
+class ValidationJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'document_type', 'document_id', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'document_type', 'created_at')
+    search_fields = ('document_id', 'error')
+    readonly_fields = ('created_at', 'started_at', 'finished_at', 'attempts', 'worker')
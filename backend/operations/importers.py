@@ -0,0 +1,228 @@
+import csv
+import io
+import json
+from itertools import islice
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from backend.cache import PRODUCT_CACHE, WAREHOUSE_CACHE, invalidate
+from product.models import Product
+from warehouse.models import SubLocation, Warehouse
+from operations.services import adjust_stock_to_counts
+import logging
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+
+
+class RowError(ValueError):
+    pass
+
+
+def iter_records(stream, fmt):
+    """
+    Yield (row number, record or parse error) from a binary CSV or JSONL stream,
+    one line at a time so memory stays flat whatever the file size.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        # Row 1 is the header
+        for number, record in enumerate(csv.DictReader(text), start=2):
+            yield number, {key.strip(): (value or '').strip() for key, value in record.items() if key}
+    elif fmt == 'jsonl':
+        for number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield number, RowError(f"Invalid JSON: {e}")
+                continue
+            yield number, record if isinstance(record, dict) else RowError("Expected a JSON object")
+    else:
+        raise ValueError(f"Unsupported format '{fmt}', expected one of {', '.join(FORMATS)}")
+
+def _required(record, field):
+    value = record.get(field)
+    if value is None or str(value).strip() == '':
+        raise RowError(f"{field} is required")
+    return str(value).strip()
+
+def _number(record, field):
+    try:
+        return float(_required(record, field))
+    except ValueError:
+        raise RowError(f"{field} must be a number")
+
+def _clean(instance, exclude=()):
+    """
+    Field-level checks (lengths, choices, formats) of an unsaved row, so a bad value
+    rejects its row rather than failing the chunk's insert. Uniqueness and foreign
+    keys are checked for the whole chunk by the importers, not here row by row.
+    """
+    try:
+        instance.full_clean(exclude=exclude, validate_unique=False, validate_constraints=False)
+    except DjangoValidationError as e:
+        raise RowError('; '.join(f"{field}: {' '.join(messages)}" for field, messages in e.message_dict.items()))
+    return instance
+
+
+def _import_products(rows, dry_run, user):
+    """
+    Columns: sku, name, category (RAW/FIN/PART), type, weight.
+    """
+    categories = {code for code, _ in Product.CATEGORY_CHOICES}
+    products, errors = {}, []
+    for number, record in rows:
+        try:
+            sku = _required(record, 'sku')
+            category = _required(record, 'category').upper()
+            if category not in categories:
+                raise RowError(f"category must be one of {', '.join(sorted(categories))}")
+            product = _clean(Product(
+                sku=sku, name=_required(record, 'name'), category=category,
+                type=_required(record, 'type'), weight=_number(record, 'weight')
+            ))
+        except RowError as e:
+            errors.append((number, str(e)))
+            continue
+        if sku in products:
+            errors.append((number, f"Duplicate sku {sku} in file"))
+            continue
+        products[sku] = (number, product)
+
+    existing = set(Product.objects.filter(sku__in=products).values_list('sku', flat=True))
+    errors.extend((number, f"Product with sku {sku} already exists") for sku, (number, _) in products.items() if sku in existing)
+    new = [product for sku, (_, product) in products.items() if sku not in existing]
+    if not dry_run:
+        Product.objects.bulk_create(new)
+        invalidate(PRODUCT_CACHE)
+    return len(new), errors
+
+def _import_sublocations(rows, dry_run, user):
+    """
+    Columns: warehouse (code), aisle, rack, bin. At least one of aisle, rack and bin is required.
+    """
+    parsed, errors = [], []
+    for number, record in rows:
+        try:
+            warehouse_code = _required(record, 'warehouse')
+            aisle, rack, bin_ = [str(record.get(field) or '').strip() or None for field in ('aisle', 'rack', 'bin')]
+            if not any((aisle, rack, bin_)):
+                raise RowError("one of aisle, rack or bin is required")
+            # Same code as SubLocation.save(), which bulk_create bypasses
+            code = "-".join([x for x in [aisle, rack, bin_] if x])
+            sublocation = _clean(SubLocation(aisle=aisle, rack=rack, bin=bin_, code=code), exclude=['warehouse'])
+        except RowError as e:
+            errors.append((number, str(e)))
+            continue
+        parsed.append((number, warehouse_code, sublocation))
+
+    warehouses = {
+        warehouse.code: warehouse
+        for warehouse in Warehouse.objects.filter(code__in={code for _, code, _ in parsed})
+    }
+    sublocations = {}
+    for number, warehouse_code, sublocation in parsed:
+        if warehouse_code not in warehouses:
+            errors.append((number, f"Unknown warehouse {warehouse_code}"))
+        elif sublocation.code in sublocations:
+            errors.append((number, f"Duplicate sublocation {sublocation.code} in file"))
+        else:
+            sublocation.warehouse = warehouses[warehouse_code]
+            sublocations[sublocation.code] = (number, sublocation)
+
+    existing = set(SubLocation.objects.filter(code__in=sublocations).values_list('code', flat=True))
+    errors.extend((number, f"Sublocation {code} already exists") for code, (number, _) in sublocations.items() if code in existing)
+    new = [sublocation for code, (_, sublocation) in sublocations.items() if code not in existing]
+    if not dry_run:
+        SubLocation.objects.bulk_create(new)
+        invalidate(WAREHOUSE_CACHE)
+    return len(new), errors
+
+def _import_opening_stock(rows, dry_run, user):
+    """
+    Columns: sku, location (sublocation code), quantity.
+    Sets the on-hand quantity through the ledger, like a physical count; a later row
+    for the same product and location wins.
+    """
+    parsed, errors = [], []
+    for number, record in rows:
+        try:
+            quantity = _number(record, 'quantity')
+            if quantity < 0:
+                raise RowError("quantity cannot be negative")
+            parsed.append((number, _required(record, 'sku'), _required(record, 'location'), quantity))
+        except RowError as e:
+            errors.append((number, str(e)))
+
+    products = dict(Product.objects.filter(sku__in={sku for _, sku, _, _ in parsed}).values_list('sku', 'id'))
+    locations = dict(SubLocation.objects.filter(code__in={code for _, _, code, _ in parsed}).values_list('code', 'id'))
+    counted = {}
+    for number, sku, code, quantity in parsed:
+        if sku not in products:
+            errors.append((number, f"Unknown product {sku}"))
+        elif code not in locations:
+            errors.append((number, f"Unknown location {code}"))
+        else:
+            counted[(products[sku], locations[code])] = quantity
+
+    if not dry_run:
+        adjust_stock_to_counts(counted, f"IMPORT/{timezone.now():%Y%m%d%H%M%S}", user)
+    return len(counted), errors
+
+
+IMPORTERS = {
+    'products': _import_products,
+    'sublocations': _import_sublocations,
+    'opening-stock': _import_opening_stock,
+}
+
+
+def run_import(kind, stream, fmt, dry_run=False, chunk_size=500, user=None, max_errors=100):
+    """
+    Import a CSV or JSONL stream chunk by chunk. Every chunk is validated with a handful
+    of queries and written in its own transaction, so a bad row only rejects itself and
+    a failing chunk does not undo the ones before it.
+    Returns a summary with the first `max_errors` row errors.
+    With dry_run nothing is written; duplicates spanning chunks are then only caught by the real run.
+    """
+    if kind not in IMPORTERS:
+        raise ValueError(f"Unknown import '{kind}', expected one of {', '.join(IMPORTERS)}")
+    importer = IMPORTERS[kind]
+
+    summary = {'kind': kind, 'dry_run': dry_run, 'rows': 0, 'imported': 0, 'error_count': 0, 'errors': []}
+
+    def report(number, message):
+        summary['error_count'] += 1
+        if len(summary['errors']) < max_errors:
+            summary['errors'].append({'row': number, 'error': message})
+
+    records = iter_records(stream, fmt)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        summary['rows'] += len(chunk)
+        rows = []
+        for number, record in chunk:
+            if isinstance(record, RowError):
+                report(number, str(record))
+            else:
+                rows.append((number, record))
+        try:
+            with transaction.atomic():
+                imported, errors = importer(rows, dry_run, user)
+        except DatabaseError as e:
+            logger.error(f"Import {kind}: chunk at row {chunk[0][0]} failed: {str(e)}")
+            imported, errors = 0, [(number, f"Chunk rejected: {e}") for number, _ in rows]
+        summary['imported'] += imported
+        for number, message in sorted(errors):
+            report(number, message)
+
+    logger.info(
+        f"Import {kind}{' (dry run)' if dry_run else ''}: {summary['imported']} of {summary['rows']} rows imported, "
+        f"{summary['error_count']} errors"
+    )
+    return summary
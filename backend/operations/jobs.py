@@ -0,0 +1,105 @@
+import uuid
+from collections import defaultdict
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from operations.models import ValidationJob
+from operations.services import validate_documents
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_validation(document_type, document_id, user=None):
+    """
+    Queue validation of a document and return its job.
+    Enqueueing the same document again returns the existing job; a failed job is re-queued.
+    """
+    try:
+        with transaction.atomic():
+            job, created = ValidationJob.objects.get_or_create(
+                document_type=document_type,
+                document_id=document_id,
+                defaults={'user': user if user and user.is_authenticated else None},
+            )
+    except IntegrityError:
+        # Lost the race against a concurrent retry of the same request
+        job, created = ValidationJob.objects.get(document_type=document_type, document_id=document_id), False
+
+    if not created and job.status == 'FAILED':
+        ValidationJob.objects.filter(pk=job.pk, status='FAILED').update(status='PENDING', error='', worker='')
+        job.refresh_from_db()
+    return job
+
+def requeue_stale_jobs(older_than):
+    """
+    Put RUNNING jobs whose worker disappeared back in the queue.
+    """
+    return ValidationJob.objects.filter(
+        status='RUNNING', started_at__lt=timezone.now() - older_than
+    ).update(status='PENDING', worker='')
+
+def claim_jobs(limit, worker=None):
+    """
+    Atomically claim up to `limit` pending jobs for this worker.
+    The conditional UPDATE guarantees a job is never claimed twice.
+    """
+    worker = worker or uuid.uuid4().hex
+    candidates = list(
+        ValidationJob.objects.filter(status='PENDING').order_by('id').values_list('id', flat=True)[:limit]
+    )
+    if not candidates:
+        return []
+    ValidationJob.objects.filter(pk__in=candidates, status='PENDING').update(
+        status='RUNNING', worker=worker, started_at=timezone.now(), attempts=F('attempts') + 1
+    )
+    return list(ValidationJob.objects.filter(pk__in=candidates, status='RUNNING', worker=worker))
+
+def run_jobs(jobs):
+    """
+    Validate claimed jobs, batching the documents of each requesting user into one
+    validate_documents() call. Returns the number of jobs that succeeded.
+    """
+    by_user = defaultdict(list)
+    for job in jobs:
+        by_user[job.user_id].append(job)
+
+    succeeded = 0
+    for user_id, user_jobs in by_user.items():
+        documents = defaultdict(list)
+        failure = 'Validation did not run'
+        for job in user_jobs:
+            documents[job.document_type].append(job.document_id)
+        try:
+            user = User.objects.filter(pk=user_id).first() if user_id else None
+            results = {
+                (result['type'], result['id']): result
+                for result in validate_documents(documents, user)
+            }
+        except Exception as e:
+            logger.error(f"Error running validation jobs {[job.id for job in user_jobs]}: {str(e)}")
+            results = {}
+            failure = str(e)
+
+        now = timezone.now()
+        for job in user_jobs:
+            result = results.get((job.document_type, job.document_id))
+            job.finished_at = now
+            if result and result['success']:
+                job.status, job.error = 'SUCCEEDED', ''
+                succeeded += 1
+            else:
+                job.status, job.error = 'FAILED', result['error'] if result else failure
+        ValidationJob.objects.bulk_update(user_jobs, ['status', 'error', 'finished_at'])
+    return succeeded
+
+def process_pending_jobs(batch_size=50, worker=None):
+    """
+    Claim and run one batch of pending jobs. Returns the number of jobs processed.
+    """
+    jobs = claim_jobs(batch_size, worker)
+    if jobs:
+        succeeded = run_jobs(jobs)
+        logger.info(f"Processed {len(jobs)} validation jobs, {succeeded} succeeded")
+    return len(jobs)
@@ -1,9 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.core.mail import send_mail
 from django.conf import settings
-from warehouse.models import Stock
-from product.models import Product
-from django.db.models import Sum
+from warehouse.models import ProductStockTotal
 import logging
 
 logger = logging.getLogger(__name__)
@@ -36,21 +34,18 @@ class Command(BaseCommand):
 
         self.stdout.write(f'Checking for products with stock below {threshold}...')
 
-        # Get low stock products
-        low_stock_products = (
-            Stock.objects.values('product')
-            .annotate(total_qty=Sum('quantity'))
-            .filter(total_qty__lte=threshold)
+        # Get low stock products from the maintained per-product totals
+        low_stock_totals = (
+            ProductStockTotal.objects.filter(quantity__lte=threshold)
             .select_related('product')
+            .order_by('quantity')
         )
 
         low_stock_items = []
-        for item in low_stock_products:
-            product = Product.objects.get(id=item['product'])
-            total_qty = item['total_qty']
+        for total in low_stock_totals:
             low_stock_items.append({
-                'product': product,
-                'quantity': total_qty,
+                'product': total.product,
+                'quantity': total.quantity,
                 'threshold': threshold
             })
 
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from operations.importers import FORMATS, IMPORTERS, run_import
+
+class Command(BaseCommand):
+    help = 'Bulk import products, sublocations or opening stock from a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(IMPORTERS))
+        parser.add_argument('path', help='CSV or JSONL file to import')
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='File format (defaults to the file extension)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Rows validated and written per transaction',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Validate the file without writing',
+        )
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or options['path'].rsplit('.', 1)[-1].lower()
+        if fmt not in FORMATS:
+            raise CommandError(f"Cannot tell the format of {options['path']}, pass --format")
+
+        with open(options['path'], 'rb') as stream:
+            summary = run_import(
+                options['kind'], stream, fmt,
+                dry_run=options['dry_run'], chunk_size=options['chunk_size'], max_errors=1000
+            )
+
+        for error in summary['errors']:
+            self.stdout.write(f"  - row {error['row']}: {error['error']}")
+        if summary['error_count'] > len(summary['errors']):
+            self.stdout.write(f"  ... and {summary['error_count'] - len(summary['errors'])} more errors")
+
+        message = f"{summary['imported']} of {summary['rows']} rows imported, {summary['error_count']} errors"
+        if summary['dry_run']:
+            self.stdout.write(self.style.WARNING(f'Dry run: {message}.'))
+        elif summary['error_count']:
+            self.stdout.write(self.style.WARNING(f'{message}.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{message}.'))
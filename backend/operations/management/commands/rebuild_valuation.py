@@ -0,0 +1,68 @@
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from warehouse.models import SubLocation
+from operations.models import CostLayer, DailyMovementRollup, MoveHistory, StockValuation
+from operations.rollups import COST_FIELDS, lock_rollups, movement_rollup_deltas
+from operations.valuation import ValuationState, lock_valuations
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild stock valuations, FIFO cost layers and the cost columns of the daily rollups by replaying the MoveHistory ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Ledger rows fetched per database round trip',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        warehouses = dict(SubLocation.objects.values_list('id', 'warehouse_id'))
+
+        with transaction.atomic():
+            # Hold off validations, including those that would insert rows for new keys,
+            # until the replaced valuations, layers and rollup costs are committed
+            lock_valuations()
+            lock_rollups()
+
+            self.stdout.write('Replaying ledger...')
+            state = ValuationState({}, defaultdict(list))
+            costs = defaultdict(lambda: dict.fromkeys(COST_FIELDS, Decimal(0)))
+            moves = MoveHistory.objects.order_by('id').iterator(chunk_size=chunk_size)
+            while True:
+                chunk = list(islice(moves, chunk_size))
+                if not chunk:
+                    break
+                chunk_costs = state.apply(chunk, warehouses)
+                for key, totals in movement_rollup_deltas(chunk, warehouses, chunk_costs).items():
+                    if totals['cost_average'] or totals['cost_fifo']:
+                        for field in COST_FIELDS:
+                            costs[key][field] += totals[field]
+
+            layers = [layer for open_layers in state.layers.values() for layer in open_layers]
+            StockValuation.objects.all().delete()
+            CostLayer.objects.all().delete()
+            StockValuation.objects.bulk_create(state.valuations.values(), batch_size=chunk_size)
+            CostLayer.objects.bulk_create(layers, batch_size=chunk_size)
+
+            DailyMovementRollup.objects.exclude(cost_average=0, cost_fifo=0).update(cost_average=0, cost_fifo=0)
+            rollups = []
+            for rollup in DailyMovementRollup.objects.all().iterator(chunk_size=chunk_size):
+                key = (rollup.day, rollup.warehouse_id, rollup.product_id, rollup.move_type)
+                if key in costs:
+                    rollup.cost_average = costs[key]['cost_average']
+                    rollup.cost_fifo = costs[key]['cost_fifo']
+                    rollups.append(rollup)
+            DailyMovementRollup.objects.bulk_update(rollups, COST_FIELDS, batch_size=chunk_size)
+
+        summary = f'{len(state.valuations)} valuations, {len(layers)} open cost layers and {len(rollups)} rollup costs'
+        logger.info(f"Inventory valuation rebuilt from ledger: {summary}")
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {summary}.'))
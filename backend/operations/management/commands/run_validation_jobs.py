@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection
+from operations.jobs import process_pending_jobs, requeue_stale_jobs
+from operations.models import ValidationJob
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Process queued document validation jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=1,
+            help='Number of worker threads (keep 1 on SQLite)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Jobs claimed and validated together by a worker',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to sleep when the queue is empty',
+        )
+        parser.add_argument(
+            '--stale-after',
+            type=int,
+            default=15,
+            help='Re-queue RUNNING jobs started more than this many minutes ago',
+        )
+        parser.add_argument(
+            '--requeue-interval',
+            type=float,
+            default=60.0,
+            help='Seconds between checks for stale jobs while the workers run',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the queue and exit instead of polling forever',
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        self.stdout.write(f'Starting {concurrency} validation worker(s)...')
+        stop = threading.Event()
+        workers = [
+            threading.Thread(target=self.work, args=(f'{os.getpid()}-{i}', options, stop), daemon=True)
+            for i in range(concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(timeout=1)
+        except KeyboardInterrupt:
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+        self.stdout.write(self.style.SUCCESS('Validation workers stopped.'))
+
+    def work(self, name, options, stop):
+        next_requeue = 0
+        try:
+            while not stop.is_set():
+                # Jobs of a crashed worker stay RUNNING; hand them back while the others keep going
+                if time.monotonic() >= next_requeue:
+                    next_requeue = time.monotonic() + options['requeue_interval']
+                    try:
+                        requeued = requeue_stale_jobs(timedelta(minutes=options['stale_after']))
+                    except Exception as e:
+                        logger.error(f"Validation worker {name} could not re-queue stale jobs: {str(e)}")
+                        requeued = 0
+                    if requeued:
+                        logger.warning(f"Validation worker {name} re-queued {requeued} stale jobs")
+                        self.stdout.write(self.style.WARNING(f'[{name}] re-queued {requeued} stale jobs'))
+                try:
+                    processed = process_pending_jobs(options['batch_size'], worker=name)
+                except Exception as e:
+                    # The jobs are still queued; back off and try again
+                    logger.error(f"Validation worker {name} failed: {str(e)}")
+                    stop.wait(options['poll_interval'])
+                    continue
+                if processed:
+                    self.stdout.write(f'[{name}] processed {processed} jobs')
+                # Nothing claimed can also mean another worker won the race, so only an
+                # empty queue ends a --once run
+                elif options['once'] and not ValidationJob.objects.filter(status='PENDING').exists():
+                    break
+                else:
+                    stop.wait(options['poll_interval'])
+        finally:
+            connection.close()
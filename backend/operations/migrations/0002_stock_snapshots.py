@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0001_initial'),
+        ('product', '0001_initial'),
+        ('warehouse', '0002_stock'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField(unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-taken_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshotLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.FloatField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='movehistory',
+            index=models.Index(fields=['date'], name='operations__date_1f493e_idx'),
+        ),
+        migrations.AddField(
+            model_name='stocksnapshotline',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product.product'),
+        ),
+        migrations.AddField(
+            model_name='stocksnapshotline',
+            name='snapshot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='operations.stocksnapshot'),
+        ),
+        migrations.AddField(
+            model_name='stocksnapshotline',
+            name='sublocation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='warehouse.sublocation'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stocksnapshotline',
+            unique_together={('snapshot', 'product', 'sublocation')},
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0004_delivery_item_reservations'),
+        ('warehouse', '0003_stock_reserved_quantity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operation_type', models.CharField(choices=[('IN', 'Receipt'), ('OUT', 'Delivery'), ('INT', 'Internal Transfer')], max_length=10)),
+                ('last_value', models.PositiveBigIntegerField(default=0)),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_sequences', to='warehouse.warehouse')),
+            ],
+            options={
+                'unique_together': {('warehouse', 'operation_type')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0005_document_sequences'),
+        ('product', '0001_initial'),
+        ('warehouse', '0003_stock_reserved_quantity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movehistory',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.CreateModel(
+            name='DailyMovementRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('move_type', models.CharField(choices=[('IN', 'Receipt'), ('OUT', 'Delivery'), ('INTERNAL', 'Internal Transfer'), ('ADJUSTMENT', 'Stock Adjustment')], max_length=20)),
+                ('quantity_in', models.FloatField(default=0)),
+                ('quantity_out', models.FloatField(default=0)),
+                ('value', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+                ('document_count', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='product.product')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movement_rollups', to='warehouse.warehouse')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('product__isnull', False)), fields=('day', 'warehouse', 'product', 'move_type'), name='unique_product_movement_rollup'), models.UniqueConstraint(condition=models.Q(('product__isnull', True)), fields=('day', 'warehouse', 'move_type'), name='unique_warehouse_movement_rollup')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0006_daily_movement_rollups'),
+        ('product', '0001_initial'),
+        ('warehouse', '0004_stock_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailymovementrollup',
+            name='cost_average',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='dailymovementrollup',
+            name='cost_fifo',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=20),
+        ),
+        migrations.CreateModel(
+            name='CostLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('received_at', models.DateTimeField()),
+                ('unit_cost', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('quantity', models.FloatField()),
+                ('remaining_quantity', models.FloatField()),
+                ('operation_reference', models.CharField(max_length=50)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_layers', to='product.product')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_layers', to='warehouse.warehouse')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('remaining_quantity__gt', 0)), fields=['product', 'warehouse', 'received_at', 'id'], name='open_cost_layers')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockValuation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.FloatField(default=0)),
+                ('average_value', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+                ('fifo_value', models.DecimalField(decimal_places=4, default=0, max_digits=20)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='valuations', to='product.product')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='valuations', to='warehouse.warehouse')),
+            ],
+            options={
+                'unique_together': {('product', 'warehouse')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0007_inventory_valuation'),
+        ('product', '0001_initial'),
+        ('warehouse', '0004_stock_totals'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='movehistory',
+            name='from_location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='moves_out', to='warehouse.sublocation'),
+        ),
+        migrations.AlterField(
+            model_name='movehistory',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='product.product'),
+        ),
+        migrations.AlterField(
+            model_name='movehistory',
+            name='to_location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='moves_in', to='warehouse.sublocation'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 # operations/models.py
+from decimal import Decimal
 from django.db import models
 from django.contrib.auth.models import User
 from warehouse.models import Warehouse, SubLocation
@@ -49,6 +50,8 @@ class DeliveryItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     location = models.ForeignKey(SubLocation, on_delete=models.CASCADE)
     quantity = models.FloatField()
+    # Part of `quantity` held on the Stock row until validation or deletion
+    reserved_quantity = models.FloatField(default=0)
 
     def __str__(self):
         return f"{self.product.name} x {self.quantity}"
@@ -101,6 +104,10 @@ class StockAdjustment(models.Model):
 
 
 class MoveHistory(models.Model):
+    """
+    Append-only stock ledger. Stock quantities are a projection of these rows
+    (see operations.services.fold_moves); mistakes are corrected with new moves.
+    """
     MOVE_TYPE_CHOICES = [
         ('IN', 'Receipt'),
         ('OUT', 'Delivery'),
@@ -109,13 +116,201 @@ class MoveHistory(models.Model):
     ]
 
     operation_reference = models.CharField(max_length=50)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    from_location = models.ForeignKey(SubLocation, on_delete=models.SET_NULL, null=True, blank=True, related_name='moves_out')
-    to_location = models.ForeignKey(SubLocation, on_delete=models.SET_NULL, null=True, blank=True, related_name='moves_in')
+    # PROTECT: deleting a product or sublocation must not rewrite the history Stock was built from
+    product = models.ForeignKey(Product, on_delete=models.PROTECT)
+    from_location = models.ForeignKey(SubLocation, on_delete=models.PROTECT, null=True, blank=True, related_name='moves_out')
+    to_location = models.ForeignKey(SubLocation, on_delete=models.PROTECT, null=True, blank=True, related_name='moves_in')
     quantity = models.FloatField()
+    # Purchase price of received units, used for movement value
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     move_type = models.CharField(max_length=20, choices=MOVE_TYPE_CHOICES)
     date = models.DateTimeField()
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['date'])]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("MoveHistory is append-only; record a correcting move instead")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("MoveHistory is append-only; record a correcting move instead")
+
     def __str__(self):
         return f"{self.move_type} {self.operation_reference}"
+
+
+class StockSnapshot(models.Model):
+    """
+    Stock position per (product, sublocation) after every move dated up to `taken_at`.
+    Only non-zero lines are stored.
+    """
+    taken_at = models.DateTimeField(unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-taken_at']
+
+    def __str__(self):
+        return f"Snapshot {self.taken_at:%Y-%m-%d %H:%M}"
+
+
+class StockSnapshotLine(models.Model):
+    snapshot = models.ForeignKey(StockSnapshot, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    sublocation = models.ForeignKey(SubLocation, on_delete=models.CASCADE)
+    quantity = models.FloatField()
+
+    class Meta:
+        unique_together = ('snapshot', 'product', 'sublocation')
+
+    def __str__(self):
+        return f"{self.snapshot} {self.product_id}@{self.sublocation_id} = {self.quantity}"
+
+
+class ValidationJob(models.Model):
+    """
+    Queued validation of one document, processed by the run_validation_jobs command.
+    There is at most one job per document, so enqueueing is idempotent.
+    """
+    DOCUMENT_TYPE_CHOICES = [
+        ('receipt', 'Receipt'),
+        ('delivery', 'Delivery'),
+        ('transfer', 'Internal Transfer'),
+    ]
+    STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('SUCCEEDED', 'Succeeded'),
+        ('FAILED', 'Failed'),
+    ]
+
+    document_type = models.CharField(max_length=20, choices=DOCUMENT_TYPE_CHOICES)
+    document_id = models.BigIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('document_type', 'document_id')
+        indexes = [models.Index(fields=['status', 'id'])]
+
+    def __str__(self):
+        return f"Validate {self.document_type} {self.document_id} ({self.status})"
+
+
+class DocumentSequence(models.Model):
+    """
+    Last reference number handed out per (warehouse, operation type).
+    Numbers only ever move forward, so deleted documents never have theirs reused.
+    """
+    OPERATION_TYPE_CHOICES = [
+        ('IN', 'Receipt'),
+        ('OUT', 'Delivery'),
+        ('INT', 'Internal Transfer'),
+    ]
+
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='document_sequences')
+    operation_type = models.CharField(max_length=10, choices=OPERATION_TYPE_CHOICES)
+    last_value = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('warehouse', 'operation_type')
+
+    def __str__(self):
+        return f"{self.warehouse.code}/{self.operation_type} @ {self.last_value}"
+
+
+class DailyMovementRollup(models.Model):
+    """
+    Movement totals per (day, warehouse, product, move type), kept up to date in the same
+    transaction that appends to MoveHistory. Rows with no product hold the warehouse totals,
+    where documents are counted once however many products they move.
+    A transfer's document counts under its source warehouse; its quantities count on both sides.
+    """
+    day = models.DateField()
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='movement_rollups')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True)
+    move_type = models.CharField(max_length=20, choices=MoveHistory.MOVE_TYPE_CHOICES)
+    quantity_in = models.FloatField(default=0)
+    quantity_out = models.FloatField(default=0)
+    value = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    # Cost of the units that left the warehouse, by weighted average and by FIFO
+    # (cost of goods sold on OUT rows)
+    cost_average = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    cost_fifo = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    document_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'warehouse', 'product', 'move_type'],
+                condition=models.Q(product__isnull=False),
+                name='unique_product_movement_rollup',
+            ),
+            models.UniqueConstraint(
+                fields=['day', 'warehouse', 'move_type'],
+                condition=models.Q(product__isnull=True),
+                name='unique_warehouse_movement_rollup',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.move_type} {self.warehouse_id}/{self.product_id or '*'}"
+
+
+class StockValuation(models.Model):
+    """
+    Inventory value per (product, warehouse), kept up to date by operations.valuation in the
+    transaction that appends to MoveHistory. `average_value` follows the weighted-average
+    cost method and `fifo_value` is the cost of the open FIFO layers.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='valuations')
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='valuations')
+    quantity = models.FloatField(default=0)
+    average_value = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    fifo_value = models.DecimalField(max_digits=20, decimal_places=4, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('product', 'warehouse')
+
+    @property
+    def average_unit_cost(self):
+        return self.average_value / Decimal(str(self.quantity)) if self.quantity > 0 else Decimal(0)
+
+    def __str__(self):
+        return f"{self.product_id}@{self.warehouse_id}: {self.quantity} = {self.average_value}"
+
+
+class CostLayer(models.Model):
+    """
+    Units that entered a warehouse at one unit cost. Layers are consumed oldest first;
+    a transfer carries its layers, with their original date, to the receiving warehouse.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='cost_layers')
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='cost_layers')
+    received_at = models.DateTimeField()
+    unit_cost = models.DecimalField(max_digits=14, decimal_places=4)
+    quantity = models.FloatField()
+    remaining_quantity = models.FloatField()
+    operation_reference = models.CharField(max_length=50)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['product', 'warehouse', 'received_at', 'id'],
+                condition=models.Q(remaining_quantity__gt=0),
+                name='open_cost_layers',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.operation_reference}: {self.remaining_quantity}/{self.quantity} @ {self.unit_cost}"
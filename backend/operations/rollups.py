@@ -0,0 +1,189 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import Case, Count, DecimalField, F, FloatField, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from backend.cache import OPERATIONS_CACHE, invalidate
+from warehouse.models import SubLocation
+from operations.models import DailyMovementRollup, MoveHistory
+from operations.valuation import apply_valuation
+
+ROLLUP_FIELDS = {
+    'quantity_in': FloatField(),
+    'quantity_out': FloatField(),
+    'value': DecimalField(max_digits=20, decimal_places=4),
+    'cost_average': DecimalField(max_digits=20, decimal_places=4),
+    'cost_fifo': DecimalField(max_digits=20, decimal_places=4),
+    'document_count': IntegerField(),
+}
+COST_FIELDS = ('cost_average', 'cost_fifo')
+
+
+def _empty_totals():
+    return {
+        'quantity_in': 0.0, 'quantity_out': 0.0, 'value': Decimal(0),
+        'cost_average': Decimal(0), 'cost_fifo': Decimal(0), 'document_count': 0,
+    }
+
+def location_warehouses(moves):
+    """
+    {sublocation_id: warehouse_id} for the locations of a list of moves.
+    """
+    location_ids = {move.from_location_id for move in moves} | {move.to_location_id for move in moves}
+    return dict(SubLocation.objects.filter(pk__in=location_ids - {None}).values_list('id', 'warehouse_id'))
+
+def movement_rollup_deltas(moves, warehouses, costs=None):
+    """
+    Rollup increments for a list of new MoveHistory rows, keyed by
+    (day, warehouse_id, product_id or None, move_type).
+    `costs` maps a move's index to the (average, FIFO) cost of the units it took out
+    of a warehouse, as returned by apply_valuation().
+    """
+    costs = costs or {}
+    deltas = defaultdict(_empty_totals)
+    documents = defaultdict(set)
+
+    for index, move in enumerate(moves):
+        day = timezone.localdate(move.date)
+        source = warehouses.get(move.from_location_id)
+        target = warehouses.get(move.to_location_id)
+        cost = costs.get(index)
+        for product_id in (move.product_id, None):
+            if target:
+                totals = deltas[(day, target, product_id, move.move_type)]
+                # Adjustments are signed moves into their location
+                if move.quantity >= 0:
+                    totals['quantity_in'] += move.quantity
+                else:
+                    totals['quantity_out'] -= move.quantity
+                if move.unit_price is not None:
+                    totals['value'] += Decimal(str(move.quantity)) * move.unit_price
+            if source:
+                deltas[(day, source, product_id, move.move_type)]['quantity_out'] += move.quantity
+            if cost and (source or target):
+                totals = deltas[(day, source or target, product_id, move.move_type)]
+                totals['cost_average'] += cost[0]
+                totals['cost_fifo'] += cost[1]
+            if source or target:
+                documents[(day, source or target, product_id, move.move_type)].add(move.operation_reference)
+
+    for key, references in documents.items():
+        deltas[key]['document_count'] += len(references)
+    return deltas
+
+def _lock_rollup_rows(keys):
+    days = {day for day, _, _, _ in keys}
+    warehouse_ids = {warehouse_id for _, warehouse_id, _, _ in keys}
+    product_ids = {product_id for _, _, product_id, _ in keys} - {None}
+    move_types = {move_type for _, _, _, move_type in keys}
+    rows = DailyMovementRollup.objects.select_for_update().filter(
+        Q(product_id__in=product_ids) | Q(product__isnull=True),
+        day__in=days, warehouse_id__in=warehouse_ids, move_type__in=move_types,
+    ).order_by('day', 'warehouse_id', 'move_type', 'product_id').values_list(
+        'pk', 'day', 'warehouse_id', 'product_id', 'move_type'
+    )
+    return {
+        (day, warehouse_id, product_id, move_type): pk
+        for pk, day, warehouse_id, product_id, move_type in rows
+        if (day, warehouse_id, product_id, move_type) in keys
+    }
+
+def apply_rollup_deltas(deltas):
+    """
+    Add rollup increments with one conditional UPDATE, creating missing rows first.
+    Rows are locked in a fixed order so concurrent validations cannot deadlock here.
+    """
+    if not deltas:
+        return
+    keys = set(deltas)
+    with transaction.atomic():
+        rows = _lock_rollup_rows(keys)
+        missing = keys - set(rows)
+        if missing:
+            DailyMovementRollup.objects.bulk_create([
+                DailyMovementRollup(day=day, warehouse_id=warehouse_id, product_id=product_id, move_type=move_type)
+                for day, warehouse_id, product_id, move_type in missing
+            ], ignore_conflicts=True)
+            rows = _lock_rollup_rows(keys)
+
+        updates = {
+            field: F(field) + Case(
+                *[When(pk=pk, then=Value(deltas[key][field])) for key, pk in rows.items()],
+                default=Value(0), output_field=output_field,
+            )
+            for field, output_field in ROLLUP_FIELDS.items()
+        }
+        DailyMovementRollup.objects.filter(pk__in=rows.values()).update(**updates)
+
+def lock_rollups():
+    """
+    Hold off every rollup write until the end of the current transaction, for rebuilds
+    that replace all rows. Taken before reading the ledger, so no validation can commit
+    moves between the read and the replace; readers are not blocked.
+    """
+    if connection.vendor == 'postgresql':
+        # Row locks would miss the rows a validation inserts for a new day or product
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'LOCK TABLE {connection.ops.quote_name(DailyMovementRollup._meta.db_table)} IN EXCLUSIVE MODE'
+            )
+    else:
+        list(DailyMovementRollup.objects.select_for_update().order_by(
+            'day', 'warehouse_id', 'move_type', 'product_id'
+        ).values_list('pk', flat=True))
+
+def record_moves(moves):
+    """
+    Append moves to the MoveHistory ledger and fold them into the inventory valuation
+    and the daily rollups.
+    """
+    if not moves:
+        return
+    MoveHistory.objects.bulk_create(moves)
+    warehouses = location_warehouses(moves)
+    costs = apply_valuation(moves, warehouses)
+    apply_rollup_deltas(movement_rollup_deltas(moves, warehouses, costs))
+    invalidate(OPERATIONS_CACHE)
+
+
+def _grouped(queryset, warehouse, product, **aggregates):
+    values = {'day_': TruncDate('date'), 'warehouse_': warehouse, 'move_type_': F('move_type')}
+    if product:
+        values['product_'] = F('product_id')
+    return queryset.values(**values).annotate(**aggregates).order_by()
+
+def compute_movement_rollups():
+    """
+    Recompute every rollup row from the ledger with grouped queries
+    (one set per warehouse side, with and without product).
+    """
+    rollups = defaultdict(_empty_totals)
+    moves = MoveHistory.objects.all()
+    positive = Q(quantity__gte=0)
+    for product in (True, False):
+        incoming = _grouped(
+            moves.filter(to_location__isnull=False), F('to_location__warehouse_id'), product,
+            quantity_in=Coalesce(Sum('quantity', filter=positive), 0.0),
+            adjusted_out=Coalesce(Sum(-F('quantity'), filter=~positive), 0.0),
+            value=Sum(F('quantity') * F('unit_price'), output_field=ROLLUP_FIELDS['value']),
+        )
+        outgoing = _grouped(
+            moves.filter(from_location__isnull=False), F('from_location__warehouse_id'), product,
+            quantity_out=Sum('quantity'),
+        )
+        documents = _grouped(
+            moves, Coalesce('from_location__warehouse_id', 'to_location__warehouse_id'), product,
+            document_count=Count('operation_reference', distinct=True),
+        )
+        for row in incoming:
+            totals = rollups[(row['day_'], row['warehouse_'], row.get('product_'), row['move_type_'])]
+            totals['quantity_in'] += row['quantity_in']
+            totals['quantity_out'] += row['adjusted_out']
+            totals['value'] += row['value'] or 0
+        for row in outgoing:
+            rollups[(row['day_'], row['warehouse_'], row.get('product_'), row['move_type_'])]['quantity_out'] += row['quantity_out']
+        for row in documents:
+            if row['warehouse_'] is not None:
+                rollups[(row['day_'], row['warehouse_'], row.get('product_'), row['move_type_'])]['document_count'] += row['document_count']
+    return rollups
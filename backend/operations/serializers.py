@@ -1,9 +1,165 @@
 # operations/serializers.py
+from collections import defaultdict
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from rest_framework import serializers
+from product.models import Product
+from warehouse.models import SubLocation
 from .models import (
     Receipt, ReceiptItem, Delivery, DeliveryItem,
-    InternalTransfer, TransferItem, StockAdjustment, MoveHistory
+    InternalTransfer, TransferItem, StockAdjustment, MoveHistory, ValidationJob
 )
+from .services import reserve_delivery_items, release_delivery_items
+
+
+class BulkItemsMixin:
+    """
+    Writes a document's `items` payload with bulk statements.
+    On update, items are matched to existing rows by `id`, or else by product and location,
+    and only the rows that changed are inserted, updated or deleted.
+    """
+    item_model = None
+    parent_field = None
+    # Item foreign key -> related model, each checked with one query per model
+    item_relations = {}
+    item_values = ('quantity',)
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        raw_items = self.initial_data.get('items', [])
+        # Checked again under lock in update(); this read only reports bad ids early
+        existing_ids = set(
+            self.instance.items.values_list('pk', flat=True)
+        ) if self.instance is not None and raw_items else set()
+        self._items = self.parse_items(raw_items, existing_ids)
+        return attrs
+
+    def parse_items(self, raw_items, existing_ids):
+        if not isinstance(raw_items, list):
+            raise serializers.ValidationError({'items': 'Expected a list of items.'})
+
+        items, errors, seen_ids = [], {}, set()
+        wanted = defaultdict(set)
+        for index, data in enumerate(raw_items):
+            if not isinstance(data, dict):
+                errors[index] = 'Expected an object.'
+                continue
+            try:
+                item = {'id': int(data['id']) if data.get('id') is not None else None}
+                for field, model in self.item_relations.items():
+                    value = data.get(field, data.get(f'{field}_id'))
+                    if value is None:
+                        raise DjangoValidationError(f'{field} is required.')
+                    item[f'{field}_id'] = int(value)
+                for field in self.item_values:
+                    model_field = self.item_model._meta.get_field(field)
+                    item[field] = model_field.to_python(data.get(field))
+                    if item[field] is None and not model_field.null:
+                        raise DjangoValidationError(f'{field} is required.')
+            except (TypeError, ValueError):
+                errors[index] = 'Invalid id.'
+                continue
+            except DjangoValidationError as e:
+                errors[index] = ' '.join(e.messages)
+                continue
+            if item['quantity'] <= 0:
+                errors[index] = 'quantity must be positive.'
+            elif item['id'] is not None and (item['id'] not in existing_ids or item['id'] in seen_ids):
+                errors[index] = f"Item {item['id']} is not an item of this document."
+            seen_ids.add(item['id'])
+            for field, model in self.item_relations.items():
+                wanted[model].add(item[f'{field}_id'])
+            items.append((index, item))
+
+        found = {
+            model: set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+            for model, ids in wanted.items()
+        }
+        for index, item in items:
+            for field, model in self.item_relations.items():
+                if item[f'{field}_id'] not in found[model]:
+                    errors.setdefault(index, f"Invalid {field} id {item[f'{field}_id']}.")
+
+        if errors:
+            raise serializers.ValidationError({'items': dict(sorted(errors.items()))})
+        return [item for _, item in items]
+
+    def item_key(self, item):
+        return tuple(getattr(item, f'{field}_id') for field in self.item_relations)
+
+    def write_items(self, instance, items, existing):
+        """
+        Apply the parsed items against `existing`, the document's current rows. On update
+        they must have been read under lock in the same transaction.
+        """
+        by_id = {row.pk: row for row in existing}
+        gone = [item['id'] for item in items if item['id'] is not None and item['id'] not in by_id]
+        if gone:
+            # Deleted by a concurrent edit after validate() read them
+            raise serializers.ValidationError({'items': f"Items {gone} are no longer part of this document."})
+        by_key = defaultdict(list)
+        for row in existing:
+            by_key[self.item_key(row)].append(row)
+
+        # Explicit ids claim their rows first, the rest pair up by product and location
+        matches = {index: by_id[item['id']] for index, item in enumerate(items) if item['id'] is not None}
+        matched = {row.pk for row in matches.values()}
+        for index, item in enumerate(items):
+            if index in matches:
+                continue
+            key = tuple(item[f'{field}_id'] for field in self.item_relations)
+            row = next((row for row in by_key.get(key, []) if row.pk not in matched), None)
+            if row is not None:
+                matches[index] = row
+                matched.add(row.pk)
+
+        created, changed, changed_fields = [], [], set()
+        for index, item in enumerate(items):
+            values = {field: value for field, value in item.items() if field != 'id'}
+            row = matches.get(index)
+            if row is None:
+                created.append(self.item_model(**{self.parent_field: instance}, **values))
+                continue
+            diff = {field: value for field, value in values.items() if getattr(row, field) != value}
+            if diff:
+                changed.append((row, diff))
+                changed_fields.update(diff)
+        removed = [row for row in existing if row.pk not in matched]
+
+        self.before_items_change(instance, [row for row, _ in changed] + removed)
+        if removed:
+            self.item_model.objects.filter(pk__in=[row.pk for row in removed]).delete()
+        for row, diff in changed:
+            for field, value in diff.items():
+                setattr(row, field, value)
+        if changed:
+            self.item_model.objects.bulk_update([row for row, _ in changed], sorted(changed_fields))
+        if created:
+            created = self.item_model.objects.bulk_create(created)
+        self.after_items_change(instance, [row for row, _ in changed] + created)
+
+    def before_items_change(self, instance, rows):
+        """Called with the rows about to be updated or deleted."""
+
+    def after_items_change(self, instance, rows):
+        """Called with the rows just updated or inserted."""
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            instance = super().create(validated_data)
+            self.write_items(instance, self._items, [])
+        return instance
+
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            instance = super().update(instance, validated_data)
+            if self._items:
+                existing = list(
+                    self.item_model.objects.select_for_update()
+                    .filter(**{self.parent_field: instance}).order_by('pk')
+                )
+                self.write_items(instance, self._items, existing)
+        return instance
 
 
 class ReceiptItemSerializer(serializers.ModelSerializer):
@@ -15,30 +171,18 @@ class ReceiptItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'product_name', 'location', 'location_code', 'quantity', 'unit_price']
 
 
-class ReceiptSerializer(serializers.ModelSerializer):
+class ReceiptSerializer(BulkItemsMixin, serializers.ModelSerializer):
     items = ReceiptItemSerializer(many=True, read_only=True)
+    item_model = ReceiptItem
+    parent_field = 'receipt'
+    item_relations = {'product': Product, 'location': SubLocation}
+    item_values = ('quantity', 'unit_price')
 
     class Meta:
         model = Receipt
         fields = ['id', 'reference', 'warehouse', 'supplier', 'date', 'notes', 'validated', 'items', 'created_at', 'updated_at']
         read_only_fields = ('reference', 'validated', 'created_at', 'updated_at')
 
-    def create(self, validated_data):
-        items_data = self.context['request'].data.get('items', [])
-        receipt = Receipt.objects.create(**validated_data)
-        for item_data in items_data:
-            ReceiptItem.objects.create(receipt=receipt, **item_data)
-        return receipt
-
-    def update(self, instance, validated_data):
-        items_data = self.context['request'].data.get('items', [])
-        instance = super().update(instance, validated_data)
-        if items_data:
-            instance.items.all().delete()  # Clear existing items
-            for item_data in items_data:
-                ReceiptItem.objects.create(receipt=instance, **item_data)
-        return instance
-
 
 class DeliveryItemSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
@@ -46,32 +190,28 @@ class DeliveryItemSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = DeliveryItem
-        fields = ['id', 'product', 'product_name', 'location', 'location_code', 'quantity']
+        fields = ['id', 'product', 'product_name', 'location', 'location_code', 'quantity', 'reserved_quantity']
+        read_only_fields = ('reserved_quantity',)
 
 
-class DeliverySerializer(serializers.ModelSerializer):
+class DeliverySerializer(BulkItemsMixin, serializers.ModelSerializer):
     items = DeliveryItemSerializer(many=True, read_only=True)
+    item_model = DeliveryItem
+    parent_field = 'delivery'
+    item_relations = {'product': Product, 'location': SubLocation}
 
     class Meta:
         model = Delivery
         fields = ['id', 'reference', 'warehouse', 'customer', 'date', 'notes', 'validated', 'items', 'created_at', 'updated_at']
         read_only_fields = ('reference', 'validated', 'created_at', 'updated_at')
 
-    def create(self, validated_data):
-        items_data = self.context['request'].data.get('items', [])
-        delivery = Delivery.objects.create(**validated_data)
-        for item_data in items_data:
-            DeliveryItem.objects.create(delivery=delivery, **item_data)
-        return delivery
+    def before_items_change(self, instance, rows):
+        release_delivery_items(rows)
 
-    def update(self, instance, validated_data):
-        items_data = self.context['request'].data.get('items', [])
-        instance = super().update(instance, validated_data)
-        if items_data:
-            instance.items.all().delete()
-            for item_data in items_data:
-                DeliveryItem.objects.create(delivery=instance, **item_data)
-        return instance
+    def after_items_change(self, instance, rows):
+        # Claim stock for the draft right away
+        if not instance.validated:
+            reserve_delivery_items(rows)
 
 
 class TransferItemSerializer(serializers.ModelSerializer):
@@ -84,30 +224,17 @@ class TransferItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'product_name', 'from_location', 'from_location_code', 'to_location', 'to_location_code', 'quantity']
 
 
-class InternalTransferSerializer(serializers.ModelSerializer):
+class InternalTransferSerializer(BulkItemsMixin, serializers.ModelSerializer):
     items = TransferItemSerializer(many=True, read_only=True)
+    item_model = TransferItem
+    parent_field = 'transfer'
+    item_relations = {'product': Product, 'from_location': SubLocation, 'to_location': SubLocation}
 
     class Meta:
         model = InternalTransfer
         fields = ['id', 'reference', 'from_warehouse', 'to_warehouse', 'date', 'notes', 'validated', 'items', 'created_at', 'updated_at']
         read_only_fields = ('reference', 'validated', 'created_at', 'updated_at')
 
-    def create(self, validated_data):
-        items_data = self.context['request'].data.get('items', [])
-        transfer = InternalTransfer.objects.create(**validated_data)
-        for item_data in items_data:
-            TransferItem.objects.create(transfer=transfer, **item_data)
-        return transfer
-
-    def update(self, instance, validated_data):
-        items_data = self.context['request'].data.get('items', [])
-        instance = super().update(instance, validated_data)
-        if items_data:
-            instance.items.all().delete()
-            for item_data in items_data:
-                TransferItem.objects.create(transfer=instance, **item_data)
-        return instance
-
 
 class StockAdjustmentSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
@@ -127,3 +254,10 @@ class MoveHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = MoveHistory
         fields = ['id', 'operation_reference', 'product', 'product_name', 'from_location', 'from_location_code', 'to_location', 'to_location_code', 'quantity', 'move_type', 'date', 'user', 'user_username']
+
+
+class ValidationJobSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ValidationJob
+        fields = ['id', 'document_type', 'document_id', 'status', 'error', 'attempts', 'created_at', 'started_at', 'finished_at']
@@ -1,96 +1,552 @@
+from collections import defaultdict
+from functools import reduce
+import operator
 from warehouse.models import Stock, SubLocation
+from warehouse.totals import apply_total_deltas
 from product.models import Product
-from operations.models import Receipt, Delivery, InternalTransfer, StockAdjustment, MoveHistory
+from operations.models import (
+    Receipt, ReceiptItem, Delivery, DeliveryItem, InternalTransfer, TransferItem, StockAdjustment,
+    MoveHistory, StockSnapshot, StockSnapshotLine
+)
+from operations.rollups import record_moves
+from operations.signals import stock_changed
+from backend.cache import OPERATIONS_CACHE, invalidate
 from django.db import transaction
+from django.db.models import Case, F, FloatField, Q, Sum, Value, When
 from django.utils import timezone
 
-def increase_stock_on_receipt(receipt, user=None):
+
+class InsufficientStock(ValueError):
+    """
+    Raised when a document would take a Stock row below zero.
+    `shortages` lists every short line, not only the first one.
+    """
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__("; ".join(
+            f"Not enough stock for {s['product_name']} at {s['location_code']}" for s in shortages
+        ))
+
+
+# OR branches per locking query; SQLite parses each branch one level deeper
+LOCK_BRANCHES = 500
+
+
+def _lock_stock_rows(keys):
+    """
+    Lock exactly the Stock rows for the given (product_id, sublocation_id) keys.
+    Rows are always locked in (product, sublocation) order.
+
+    The filter ORs one branch per product (or per sublocation, when the keys span fewer
+    of those), each listing only the requested partners, so rows of other key pairs
+    are never locked. Usually one query; very wide batches lock in chunks of products.
+    """
+    by_product = defaultdict(set)
+    by_sublocation = defaultdict(set)
+    for product_id, sublocation_id in keys:
+        by_product[product_id].add(sublocation_id)
+        by_sublocation[sublocation_id].add(product_id)
+
+    if len(by_sublocation) < len(by_product) and len(by_sublocation) <= LOCK_BRANCHES:
+        batches = [[
+            Q(sublocation_id=sublocation_id, product_id__in=product_ids)
+            for sublocation_id, product_ids in sorted(by_sublocation.items())
+        ]]
+    else:
+        branches = [
+            Q(product_id=product_id, sublocation_id__in=sublocation_ids)
+            for product_id, sublocation_ids in sorted(by_product.items())
+        ]
+        batches = [branches[i:i + LOCK_BRANCHES] for i in range(0, len(branches), LOCK_BRANCHES)]
+
+    stocks = {}
+    for batch in batches:
+        rows = (
+            Stock.objects.select_for_update(of=('self',))
+            .filter(reduce(operator.or_, batch))
+            .annotate(warehouse_id=F('sublocation__warehouse_id'))
+            .order_by('product_id', 'sublocation_id')
+        )
+        stocks.update(((stock.product_id, stock.sublocation_id), stock) for stock in rows)
+    return stocks
+
+def _describe_shortages(deltas, stocks, keys):
+    products = dict(Product.objects.filter(id__in={p for p, _ in keys}).values_list('id', 'name'))
+    locations = dict(SubLocation.objects.filter(id__in={s for _, s in keys}).values_list('id', 'code'))
+    return [
+        {
+            'product': product_id,
+            'product_name': products.get(product_id, product_id),
+            'location': sublocation_id,
+            'location_code': locations.get(sublocation_id, sublocation_id),
+            'requested': -deltas.get((product_id, sublocation_id), 0),
+            'available': stocks[(product_id, sublocation_id)].available_quantity if (product_id, sublocation_id) in stocks else 0,
+        }
+        for product_id, sublocation_id in sorted(keys)
+    ]
+
+def apply_stock_deltas(deltas, reserved_deltas=None, respect_reservations=True):
+    """
+    Apply {(product_id, sublocation_id): delta} to Stock as one all-or-nothing change.
+    `reserved_deltas` moves Stock.reserved_quantity the same way (negative releases).
+
+    Rows are locked in a fixed (product, sublocation) order so concurrent documents
+    cannot deadlock, and the deltas are written with a single conditional UPDATE so a
+    debit only lands if the row still holds enough stock. Unless
+    `respect_reservations` is False, stock reserved for other deliveries does not
+    count as enough. Raises InsufficientStock (and writes nothing) if any row falls short.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    reserved_deltas = {key: delta for key, delta in (reserved_deltas or {}).items() if delta}
+    keys = set(deltas) | set(reserved_deltas)
+    if not keys:
+        return
+
+    def required(key):
+        """Minimum current quantity the row must hold, or None if the change cannot fall short"""
+        delta, reserved_delta = deltas.get(key, 0), reserved_deltas.get(key, 0)
+        if respect_reservations and (delta < 0 or reserved_delta > 0):
+            return reserved_delta - delta
+        if delta < 0:
+            return -delta
+        return None
+
+    with transaction.atomic():
+        stocks = _lock_stock_rows(keys)
+        missing = [
+            Stock(product_id=product_id, sublocation_id=sublocation_id, quantity=0)
+            for (product_id, sublocation_id), delta in deltas.items()
+            if delta > 0 and (product_id, sublocation_id) not in stocks
+        ]
+        if missing:
+            # Another validation may create the same rows concurrently
+            Stock.objects.bulk_create(missing, ignore_conflicts=True)
+            stocks = _lock_stock_rows(keys)
+        # Nothing to release on rows that no longer exist
+        keys = {key for key in keys if key in stocks or required(key) is not None}
+        if not keys:
+            return
+
+        def is_short(key, quantity, reserved):
+            need = required(key)
+            if need is None:
+                return False
+            return quantity < (reserved + need if respect_reservations else need)
+
+        short = [
+            key for key in keys
+            if required(key) is not None and (
+                key not in stocks or is_short(key, stocks[key].quantity, stocks[key].reserved_quantity)
+            )
+        ]
+        if short:
+            raise InsufficientStock(_describe_shortages(deltas, stocks, short))
+
+        guards = []
+        for key in keys:
+            need = required(key)
+            if need is None:
+                guards.append(Q(pk=stocks[key].pk))
+            elif respect_reservations:
+                guards.append(Q(pk=stocks[key].pk, quantity__gte=F('reserved_quantity') + Value(need)))
+            else:
+                guards.append(Q(pk=stocks[key].pk, quantity__gte=need))
+
+        changes = {'updated_at': timezone.now()}
+        for field, field_deltas in (('quantity', deltas), ('reserved_quantity', reserved_deltas)):
+            if field_deltas:
+                changes[field] = F(field) + Case(
+                    *[When(pk=stocks[key].pk, then=Value(delta)) for key, delta in field_deltas.items()],
+                    default=Value(0.0),
+                    output_field=FloatField(),
+                )
+        updated = Stock.objects.filter(reduce(operator.or_, guards)).update(**changes)
+        if updated != len(keys):
+            # Backends without row locks (SQLite) can still lose the race between
+            # the read above and the UPDATE; the guard makes that fail safe.
+            current = {
+                pk: (quantity, reserved)
+                for pk, quantity, reserved in Stock.objects.filter(pk__in=[stock.pk for stock in stocks.values()])
+                .values_list('pk', 'quantity', 'reserved_quantity')
+            }
+            short = [
+                key for key in keys
+                if required(key) is not None and is_short(key, *current.get(stocks[key].pk, (0, 0)))
+            ] or [key for key in keys if required(key) is not None]
+            raise InsufficientStock(_describe_shortages(deltas, stocks, short))
+
+        apply_total_deltas(
+            {key: delta for key, delta in deltas.items() if key in keys},
+            {stock.sublocation_id: stock.warehouse_id for stock in stocks.values()}
+        )
+        transaction.on_commit(lambda: stock_changed.send(sender=Stock, keys=keys))
+
+def fold_moves(deltas, rows):
     """
-    Increase stock for all items in a receipt (on validation)
+    Fold ledger rows of (product_id, from_location_id, to_location_id, quantity)
+    into {(product_id, sublocation_id): delta}. This is the only rule that turns the
+    MoveHistory ledger into Stock quantities.
     """
-    for item in receipt.items.all():
-        stock, _ = Stock.objects.get_or_create(product=item.product, sublocation=item.location)
-        stock.quantity += item.quantity
-        stock.updated_at = timezone.now()
-        stock.save()
-        MoveHistory.objects.create(
+    for product_id, from_location_id, to_location_id, quantity in rows:
+        if from_location_id:
+            deltas[(product_id, from_location_id)] -= quantity
+        if to_location_id:
+            deltas[(product_id, to_location_id)] += quantity
+    return deltas
+
+def _move_deltas(moves):
+    return fold_moves(defaultdict(float), (
+        (move.product_id, move.from_location_id, move.to_location_id, move.quantity) for move in moves
+    ))
+
+def _reservation_releases(items):
+    """
+    Reserved-quantity deltas that release the reservations held by delivery items.
+    """
+    releases = defaultdict(float)
+    for item in items:
+        if item.reserved_quantity:
+            releases[(item.product_id, item.location_id)] -= item.reserved_quantity
+    return releases
+
+def _apply_moves(moves, reserved_deltas=None, respect_reservations=True):
+    """
+    Append a document's moves to the MoveHistory ledger and project them onto Stock
+    and the daily rollups, in the same transaction.
+    """
+    deltas = _move_deltas(moves)
+
+    with transaction.atomic():
+        apply_stock_deltas(deltas, reserved_deltas, respect_reservations)
+        record_moves(moves)
+
+def _receipt_moves(receipt, items, now, user):
+    return [
+        MoveHistory(
             operation_reference=receipt.reference,
-            product=item.product,
+            product_id=item.product_id,
             from_location=None,
-            to_location=item.location,
+            to_location_id=item.location_id,
             quantity=item.quantity,
+            unit_price=item.unit_price,
             move_type='IN',
-            date=timezone.now(),
+            date=now,
             user=user
         )
+        for item in items
+    ]
 
-def decrease_stock_on_delivery(delivery, user=None):
-    """
-    Decrease stock for all items in a delivery (on validation)
-    """
-    for item in delivery.items.all():
-        stock = Stock.objects.get(product=item.product, sublocation=item.location)
-        if stock.quantity < item.quantity:
-            raise ValueError(f"Not enough stock for {item.product.name} at {item.location.code}")
-        stock.quantity -= item.quantity
-        stock.updated_at = timezone.now()
-        stock.save()
-        MoveHistory.objects.create(
+def _delivery_moves(delivery, items, now, user):
+    return [
+        MoveHistory(
             operation_reference=delivery.reference,
-            product=item.product,
-            from_location=item.location,
+            product_id=item.product_id,
+            from_location_id=item.location_id,
             to_location=None,
             quantity=item.quantity,
             move_type='OUT',
-            date=timezone.now(),
+            date=now,
+            user=user
+        )
+        for item in items
+    ]
+
+def _transfer_moves(transfer, items, now, user):
+    return [
+        MoveHistory(
+            operation_reference=transfer.reference,
+            product_id=item.product_id,
+            from_location_id=item.from_location_id,
+            to_location_id=item.to_location_id,
+            quantity=item.quantity,
+            move_type='INTERNAL',
+            date=now,
             user=user
         )
+        for item in items
+    ]
+
+def increase_stock_on_receipt(receipt, user=None):
+    """
+    Increase stock for all items in a receipt (on validation).
+    Runs a constant number of queries regardless of the number of lines.
+    """
+    _apply_moves(_receipt_moves(receipt, receipt.items.all(), timezone.now(), user))
+
+def decrease_stock_on_delivery(delivery, user=None):
+    """
+    Decrease stock for all items in a delivery (on validation) and release its reservations.
+    Fails the whole delivery if any line is short.
+    """
+    items = list(delivery.items.all())
+    with transaction.atomic():
+        _apply_moves(
+            _delivery_moves(delivery, items, timezone.now(), user),
+            reserved_deltas=_reservation_releases(items),
+        )
+        DeliveryItem.objects.filter(delivery=delivery, reserved_quantity__gt=0).update(reserved_quantity=0)
 
 def transfer_stock_on_internal_transfer(transfer, user=None):
     """
-    Transfer stock for all items in an internal transfer (on validation)
-    """
-    for item in transfer.items.all():
-        with transaction.atomic():
-            # Decrease from source
-            stock_from = Stock.objects.get(product=item.product, sublocation=item.from_location)
-            if stock_from.quantity < item.quantity:
-                raise ValueError(f"Not enough stock for {item.product.name} at {item.from_location.code}")
-            stock_from.quantity -= item.quantity
-            stock_from.updated_at = timezone.now()
-            stock_from.save()
-            # Increase at destination
-            stock_to, _ = Stock.objects.get_or_create(product=item.product, sublocation=item.to_location)
-            stock_to.quantity += item.quantity
-            stock_to.updated_at = timezone.now()
-            stock_to.save()
-            MoveHistory.objects.create(
-                operation_reference=transfer.reference,
-                product=item.product,
-                from_location=item.from_location,
-                to_location=item.to_location,
-                quantity=item.quantity,
-                move_type='INTERNAL',
-                date=timezone.now(),
-                user=user
+    Transfer stock for all items in an internal transfer (on validation).
+    Fails the whole transfer if any source line is short.
+    """
+    _apply_moves(_transfer_moves(transfer, transfer.items.all(), timezone.now(), user))
+
+# Document kinds accepted by validate_documents, in the order they are applied:
+# receipts first so their stock can feed transfers and deliveries in the same batch.
+DOCUMENT_KINDS = {
+    'receipt': (Receipt, ReceiptItem, 'receipt_id', _receipt_moves),
+    'transfer': (InternalTransfer, TransferItem, 'transfer_id', _transfer_moves),
+    'delivery': (Delivery, DeliveryItem, 'delivery_id', _delivery_moves),
+}
+
+def validate_documents(documents, user=None):
+    """
+    Validate many documents in one transaction.
+
+    `documents` maps a DOCUMENT_KINDS key to a list of document IDs. Stock deltas of
+    every document are grouped by (product, sublocation) and written with the same
+    set-based statements as a single document, so the query count depends on the
+    number of document kinds, not on the number of documents or lines. A document
+    that is missing, already validated or short on stock is skipped and reported;
+    the others are still validated.
+
+    Returns one {'type', 'id', 'reference', 'success', 'error'} dict per requested ID.
+    """
+    now = timezone.now()
+    results = {}
+    pending = []
+
+    with transaction.atomic():
+        for kind, (model, item_model, fk_name, build_moves) in DOCUMENT_KINDS.items():
+            ids = list(dict.fromkeys(documents.get(kind) or []))
+            if not ids:
+                continue
+            found = model.objects.select_for_update().order_by('pk').in_bulk(ids)
+            items = defaultdict(list)
+            for item in item_model.objects.filter(**{f'{fk_name}__in': found}):
+                items[getattr(item, fk_name)].append(item)
+
+            for document_id in ids:
+                document = found.get(document_id)
+                result = {'type': kind, 'id': document_id, 'reference': None, 'success': False, 'error': None}
+                results[(kind, document_id)] = result
+                if document is None:
+                    result['error'] = f"{kind.capitalize()} not found"
+                    continue
+                result['reference'] = document.reference
+                if document.validated:
+                    result['error'] = f"{kind.capitalize()} already validated"
+                    continue
+                releases = _reservation_releases(items[document_id]) if kind == 'delivery' else {}
+                pending.append((kind, document, build_moves(document, items[document_id], now, user), releases))
+
+        # Lock every row the batch touches at once, then settle documents in order
+        keys = set()
+        for _, _, moves, _ in pending:
+            keys.update(_move_deltas(moves))
+        available = {key: stock.available_quantity for key, stock in _lock_stock_rows(keys).items()}
+
+        net = defaultdict(float)
+        net_reserved = defaultdict(float)
+        accepted = defaultdict(list)
+        ledger = []
+        short_documents = []
+        for kind, document, moves, releases in pending:
+            deltas = _move_deltas(moves)
+            # A delivery may use the stock it reserved itself
+            short = [
+                key for key, delta in deltas.items()
+                if delta < 0 and available.get(key, 0) + delta - releases.get(key, 0) < 0
+            ]
+            if short:
+                short_documents.append((kind, document, short))
+                continue
+            for key in set(deltas) | set(releases):
+                available[key] = available.get(key, 0) + deltas.get(key, 0) - releases.get(key, 0)
+                net[key] += deltas.get(key, 0)
+                net_reserved[key] += releases.get(key, 0)
+            accepted[kind].append(document.pk)
+            ledger.extend(moves)
+
+        apply_stock_deltas(net, net_reserved)
+        record_moves(ledger)
+        for kind, ids in accepted.items():
+            DOCUMENT_KINDS[kind][0].objects.filter(pk__in=ids).update(validated=True, updated_at=now)
+        if accepted:
+            # The bulk UPDATE above sends no post_save
+            invalidate(OPERATIONS_CACHE)
+        if accepted['delivery']:
+            DeliveryItem.objects.filter(
+                delivery_id__in=accepted['delivery'], reserved_quantity__gt=0
+            ).update(reserved_quantity=0)
+
+    for kind, ids in accepted.items():
+        for document_id in ids:
+            results[(kind, document_id)]['success'] = True
+
+    if short_documents:
+        all_keys = {key for _, _, short in short_documents for key in short}
+        products = dict(Product.objects.filter(id__in={p for p, _ in all_keys}).values_list('id', 'name'))
+        locations = dict(SubLocation.objects.filter(id__in={s for _, s in all_keys}).values_list('id', 'code'))
+        for kind, document, short in short_documents:
+            results[(kind, document.pk)]['error'] = "; ".join(
+                f"Not enough stock for {products.get(p, p)} at {locations.get(s, s)}" for p, s in sorted(short)
             )
 
+    return [
+        results[(kind, document_id)]
+        for kind in DOCUMENT_KINDS
+        for document_id in dict.fromkeys(documents.get(kind) or [])
+    ]
+
+def adjust_stock_to_counts(counts, reference, user=None):
+    """
+    Set the on-hand quantity of {(product_id, location_id): counted quantity}, like a
+    physical count. Differences are read under the row locks and recorded in the ledger
+    as signed ADJUSTMENT moves; returns the moves (none for quantities already right).
+    """
+    if not counts:
+        return []
+    now = timezone.now()
+    with transaction.atomic():
+        stocks = _lock_stock_rows(counts)
+        moves = []
+        for (product_id, location_id), quantity in sorted(counts.items()):
+            current = stocks[(product_id, location_id)].quantity if (product_id, location_id) in stocks else 0
+            if quantity != current:
+                moves.append(MoveHistory(
+                    operation_reference=reference,
+                    product_id=product_id,
+                    from_location=None,
+                    to_location_id=location_id,
+                    quantity=quantity - current,
+                    move_type='ADJUSTMENT',
+                    date=now,
+                    user=user
+                ))
+        # A physical count is the truth even if it drops below what is reserved
+        _apply_moves(moves, respect_reservations=False)
+    return moves
+
 def adjust_stock_on_adjustment(adjustment, user=None):
     """
-    Adjust stock at a location to match counted quantity (on adjustment creation)
-    """
-    stock, _ = Stock.objects.get_or_create(product=adjustment.product, sublocation=adjustment.location)
-    difference = adjustment.counted_quantity - stock.quantity
-    stock.quantity = adjustment.counted_quantity
-    stock.updated_at = timezone.now()
-    stock.save()
-    MoveHistory.objects.create(
-        operation_reference=adjustment.reference,
-        product=adjustment.product,
-        from_location=None,
-        to_location=adjustment.location,
-        quantity=difference,
-        move_type='ADJUSTMENT',
-        date=timezone.now(),
-        user=user
+    Adjust stock at a location to match counted quantity (on adjustment creation).
+    """
+    adjust_stock_to_counts(
+        {(adjustment.product_id, adjustment.location_id): adjustment.counted_quantity}, adjustment.reference, user
     )
+
+
+def reserve_delivery_items(items):
+    """
+    Allocate stock to saved, unvalidated delivery items, as much of each line as is
+    available to promise. Sets and stores item.reserved_quantity and returns the items.
+    """
+    items = [item for item in items if item.quantity > 0]
+    if not items:
+        return items
+
+    keys = {(item.product_id, item.location_id) for item in items}
+    with transaction.atomic():
+        available = {key: max(stock.available_quantity, 0) for key, stock in _lock_stock_rows(keys).items()}
+        reserved = defaultdict(float)
+        for item in items:
+            key = (item.product_id, item.location_id)
+            item.reserved_quantity = min(item.quantity, available.get(key, 0))
+            available[key] = available.get(key, 0) - item.reserved_quantity
+            reserved[key] += item.reserved_quantity
+        apply_stock_deltas({}, reserved)
+        DeliveryItem.objects.bulk_update(items, ['reserved_quantity'])
+    return items
+
+def release_delivery_items(items):
+    """
+    Give back the stock reserved by delivery items (before they are deleted or changed).
+    """
+    items = [item for item in items if item.reserved_quantity]
+    if not items:
+        return
+    with transaction.atomic():
+        apply_stock_deltas({}, _reservation_releases(items))
+        for item in items:
+            item.reserved_quantity = 0
+        DeliveryItem.objects.bulk_update(items, ['reserved_quantity'])
+
+def available_to_promise(product_id, warehouse_id=None):
+    """
+    On-hand, reserved and available quantity of a product, read from its Stock rows
+    through the (product, sublocation) index without touching delivery items.
+    """
+    stocks = Stock.objects.filter(product_id=product_id)
+    if warehouse_id:
+        stocks = stocks.filter(sublocation__warehouse_id=warehouse_id)
+    totals = stocks.aggregate(on_hand=Sum('quantity'), reserved=Sum('reserved_quantity'))
+    on_hand, reserved = totals['on_hand'] or 0, totals['reserved'] or 0
+    return {'on_hand': on_hand, 'reserved': reserved, 'available': max(on_hand - reserved, 0)}
+
+def available_by_warehouse(product_ids):
+    """
+    {(product_id, warehouse_id): available} for many products in one grouped query,
+    available being on-hand less reserved as in available_to_promise(). Warehouses
+    with nothing available are left out.
+    """
+    rows = Stock.objects.filter(product_id__in=product_ids).values(
+        'product_id', warehouse_id=F('sublocation__warehouse_id')
+    ).annotate(available=Sum(F('quantity') - F('reserved_quantity'))).order_by()
+    return {
+        (row['product_id'], row['warehouse_id']): row['available']
+        for row in rows if row['available'] > 0
+    }
+
+def stock_as_of(as_of, warehouse_id=None, product_id=None):
+    """
+    Return {(product_id, sublocation_id): quantity} as of `as_of`, leaving out zero lines.
+
+    Starts from the newest snapshot taken at or before `as_of` and replays only the
+    ledger rows dated between the two, so the cost is bounded by the snapshot interval.
+    """
+    snapshot = StockSnapshot.objects.filter(taken_at__lte=as_of).first()
+
+    lines = StockSnapshotLine.objects.filter(snapshot=snapshot) if snapshot else StockSnapshotLine.objects.none()
+    moves = MoveHistory.objects.filter(date__lte=as_of)
+    if snapshot:
+        moves = moves.filter(date__gt=snapshot.taken_at)
+    if product_id:
+        lines = lines.filter(product_id=product_id)
+        moves = moves.filter(product_id=product_id)
+
+    positions = defaultdict(float)
+    for key_product, key_sublocation, quantity in (
+        lines.filter(sublocation__warehouse_id=warehouse_id) if warehouse_id else lines
+    ).values_list('product_id', 'sublocation_id', 'quantity'):
+        positions[(key_product, key_sublocation)] += quantity
+
+    # Replay the interval with two grouped queries instead of walking every move
+    for side, sign in (('to_location', 1), ('from_location', -1)):
+        side_moves = moves.filter(**{f'{side}__isnull': False})
+        if warehouse_id:
+            side_moves = side_moves.filter(**{f'{side}__warehouse_id': warehouse_id})
+        for key_product, key_sublocation, quantity in (
+            side_moves.values('product_id', f'{side}_id')
+            .annotate(total=Sum('quantity')).values_list('product_id', f'{side}_id', 'total')
+        ):
+            positions[(key_product, key_sublocation)] += sign * quantity
+
+    return {key: quantity for key, quantity in positions.items() if quantity}
+
+def take_stock_snapshot(taken_at):
+    """
+    Record a compact snapshot of every stock position as of `taken_at`,
+    built incrementally from the previous snapshot.
+    """
+    positions = stock_as_of(taken_at)
+    with transaction.atomic():
+        snapshot = StockSnapshot.objects.create(taken_at=taken_at)
+        StockSnapshotLine.objects.bulk_create([
+            StockSnapshotLine(snapshot=snapshot, product_id=product_id, sublocation_id=sublocation_id, quantity=quantity)
+            for (product_id, sublocation_id), quantity in positions.items()
+        ], batch_size=2000)
+    return snapshot
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from backend.cache import OPERATIONS_CACHE, invalidate
+from operations.models import Receipt, Delivery, InternalTransfer, StockAdjustment
+
+# Sent after a transaction that changed Stock quantities commits.
+# keys: set of (product_id, sublocation_id) that changed
+stock_changed = Signal()
+
+
+@receiver([post_save, post_delete], sender=Receipt)
+@receiver([post_save, post_delete], sender=Delivery)
+@receiver([post_save, post_delete], sender=InternalTransfer)
+@receiver([post_save, post_delete], sender=StockAdjustment)
+def document_saved_handler(sender, **kwargs):
+    invalidate(OPERATIONS_CACHE)
@@ -1,3 +1,1179 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import threading
 
-# Create your tests here.
+from datetime import timedelta
+from unittest import mock
+
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import ProtectedError, Sum
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from product.models import Product
+from warehouse.models import ProductStockTotal, Stock, SubLocation, Warehouse
+from .models import (
+    CostLayer, DailyMovementRollup, Delivery, DeliveryItem, InternalTransfer, MoveHistory, Receipt, ReceiptItem,
+    StockValuation, TransferItem, ValidationJob
+)
+from .importers import run_import
+from .rollups import compute_movement_rollups
+from .valuation import ValuationState
+from .serializers import ReceiptSerializer
+from .utils import generate_reference
+from . import services
+from .jobs import claim_jobs, enqueue_validation, process_pending_jobs, requeue_stale_jobs
+from .services import (
+    InsufficientStock, _lock_stock_rows, available_to_promise, decrease_stock_on_delivery, increase_stock_on_receipt,
+    stock_as_of, take_stock_snapshot, transfer_stock_on_internal_transfer, validate_documents
+)
+
+
+def make_products(count, prefix='P'):
+    return Product.objects.bulk_create([
+        Product(sku=f"{prefix}-{i:05d}", name=f"Product {i}", category='FIN', type='Unit', weight=1)
+        for i in range(count)
+    ])
+
+
+class ReceiptValidationBenchmarkTests(TestCase):
+    """
+    Validating a receipt must cost a constant number of queries, however many lines it has.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        cls.location = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+        cls.products = make_products(800)
+
+    def make_receipt(self, lines):
+        receipt = Receipt.objects.create(
+            reference=f"WH/IN/{lines:04d}", warehouse=self.warehouse,
+            supplier="Supplier", date=datetime.date.today()
+        )
+        ReceiptItem.objects.bulk_create([
+            ReceiptItem(receipt=receipt, product=product, location=self.location, quantity=5)
+            for product in self.products[:lines]
+        ])
+        return receipt
+
+    def capture_queries(self, receipt):
+        with CaptureQueriesContext(connection) as ctx:
+            increase_stock_on_receipt(receipt)
+        return [query['sql'] for query in ctx.captured_queries]
+
+    def count_queries(self, receipt):
+        return len(self.capture_queries(receipt))
+
+    def test_query_count_is_independent_of_line_count(self):
+        # Stay below the smallest SQLite bulk batch so the backend does not split statements
+        counts = {lines: self.count_queries(self.make_receipt(lines)) for lines in (1, 10, 100)}
+        self.assertEqual(len(set(counts.values())), 1, counts)
+
+    def test_existing_rows_are_updated_in_place(self):
+        increase_stock_on_receipt(self.make_receipt(10))
+        increase_stock_on_receipt(self.make_receipt(20))
+        self.assertEqual(Stock.objects.get(product=self.products[0]).quantity, 10)
+        self.assertEqual(Stock.objects.get(product=self.products[15]).quantity, 5)
+        self.assertEqual(Stock.objects.count(), 20)
+
+    def test_large_receipt(self):
+        baseline = self.capture_queries(self.make_receipt(1))
+        receipt = self.make_receipt(800)
+        queries = self.capture_queries(receipt)
+        # Only the backend's own bulk insert batching may add statements
+        is_insert = lambda sql: sql.startswith('INSERT')
+        self.assertEqual(
+            len([sql for sql in queries if not is_insert(sql)]),
+            len([sql for sql in baseline if not is_insert(sql)])
+        )
+        # Ledger, stock rows and cost layers are each inserted in SQLite-sized batches
+        self.assertLess(len(queries), 80)
+        self.assertEqual(MoveHistory.objects.filter(operation_reference=receipt.reference).count(), 800)
+        self.assertEqual(Stock.objects.count(), 800)
+        self.assertEqual(Stock.objects.aggregate(total=Sum('quantity'))['total'], 5 * 801)
+        self.assertEqual(ProductStockTotal.objects.aggregate(total=Sum('quantity'))['total'], 5 * 801)
+
+
+class StockLockTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        cls.bin_x = SubLocation.objects.create(warehouse=cls.warehouse, aisle="X1")
+        cls.bin_y = SubLocation.objects.create(warehouse=cls.warehouse, aisle="Y1")
+        cls.product_a, cls.product_b = make_products(2)
+        for product in (cls.product_a, cls.product_b):
+            for location in (cls.bin_x, cls.bin_y):
+                Stock.objects.create(product=product, sublocation=location, quantity=1)
+
+    def test_only_requested_pairs_are_locked(self):
+        keys = {(self.product_a.pk, self.bin_x.pk), (self.product_b.pk, self.bin_y.pk)}
+        with transaction.atomic(), CaptureQueriesContext(connection) as ctx:
+            locked = _lock_stock_rows(keys)
+            self.assertEqual(len(ctx.captured_queries), 1)
+            sql = ctx.captured_queries[0]['sql']
+            # Re-run the locking statement as sent: it must select the two pairs itself,
+            # not the four product x bin combinations
+            with connection.cursor() as cursor:
+                cursor.execute(sql)
+                selected = {(row[1], row[2]) for row in cursor.fetchall()}
+        self.assertEqual(selected, keys)
+        self.assertEqual(set(locked), keys)
+        if connection.features.has_select_for_update:
+            self.assertIn('FOR UPDATE', sql)
+
+
+class DeliveryValidationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        cls.location = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+        cls.apple, cls.pear = make_products(2)
+        Stock.objects.create(product=cls.apple, sublocation=cls.location, quantity=10)
+        Stock.objects.create(product=cls.pear, sublocation=cls.location, quantity=1)
+
+    def test_short_line_fails_whole_delivery(self):
+        delivery = Delivery.objects.create(
+            reference="WH/OUT/0001", warehouse=self.warehouse, customer="C", date=datetime.date.today()
+        )
+        DeliveryItem.objects.create(delivery=delivery, product=self.apple, location=self.location, quantity=4)
+        DeliveryItem.objects.create(delivery=delivery, product=self.pear, location=self.location, quantity=2)
+
+        with self.assertRaises(InsufficientStock) as ctx:
+            decrease_stock_on_delivery(delivery)
+
+        self.assertEqual([s['product'] for s in ctx.exception.shortages], [self.pear.id])
+        self.assertEqual(Stock.objects.get(product=self.apple).quantity, 10)
+        self.assertFalse(MoveHistory.objects.exists())
+
+
+class BulkItemsSerializerTests(TestCase):
+    """
+    Item payloads are diffed against the document's rows: matched by id, or else by
+    product and location, and only what changed is written.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        cls.bin_a = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+        cls.bin_b = SubLocation.objects.create(warehouse=cls.warehouse, aisle="B1")
+        cls.apple, cls.pear = make_products(2)
+
+    def setUp(self):
+        self.receipt = Receipt.objects.create(
+            reference="WH/IN/0001", warehouse=self.warehouse, supplier="S", date=datetime.date.today()
+        )
+        self.apple_item = ReceiptItem.objects.create(
+            receipt=self.receipt, product=self.apple, location=self.bin_a, quantity=5
+        )
+        self.pear_item = ReceiptItem.objects.create(
+            receipt=self.receipt, product=self.pear, location=self.bin_a, quantity=3
+        )
+
+    def item(self, product, location, quantity, id=None):
+        data = {'product': product.pk, 'location': location.pk, 'quantity': quantity}
+        if id is not None:
+            data['id'] = id
+        return data
+
+    def update(self, items, partial=True):
+        serializer = ReceiptSerializer(self.receipt, data={'items': items}, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def rows(self):
+        return sorted(
+            (row.pk, row.product_id, row.location_id, row.quantity) for row in self.receipt.items.all()
+        )
+
+    def test_create_inserts_every_item(self):
+        serializer = ReceiptSerializer(data={
+            'warehouse': self.warehouse.pk, 'supplier': "S", 'date': str(datetime.date.today()),
+            'items': [self.item(self.apple, self.bin_a, 1), self.item(self.pear, self.bin_b, 2)],
+        })
+        serializer.is_valid(raise_exception=True)
+        receipt = serializer.save(reference="WH/IN/0002")
+
+        self.assertEqual(
+            sorted(receipt.items.values_list('product_id', 'location_id', 'quantity')),
+            [(self.apple.pk, self.bin_a.pk, 1), (self.pear.pk, self.bin_b.pk, 2)]
+        )
+
+    def test_items_match_by_id_and_unchanged_rows_are_not_written(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.update([
+                self.item(self.apple, self.bin_a, 7, id=self.apple_item.pk),
+                self.item(self.pear, self.bin_a, 3, id=self.pear_item.pk),
+            ])
+
+        self.assertEqual(self.rows(), [
+            (self.apple_item.pk, self.apple.pk, self.bin_a.pk, 7),
+            (self.pear_item.pk, self.pear.pk, self.bin_a.pk, 3),
+        ])
+        writes = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith(('INSERT', 'DELETE'))]
+        self.assertEqual(writes, [])
+
+    def test_items_without_id_match_by_product_and_location(self):
+        self.update([self.item(self.pear, self.bin_a, 4), self.item(self.apple, self.bin_a, 5)])
+
+        self.assertEqual(self.rows(), [
+            (self.apple_item.pk, self.apple.pk, self.bin_a.pk, 5),
+            (self.pear_item.pk, self.pear.pk, self.bin_a.pk, 4),
+        ])
+
+    def test_moved_row_is_deleted_and_inserted(self):
+        self.update([self.item(self.apple, self.bin_b, 5), self.item(self.pear, self.bin_a, 3)])
+
+        rows = self.rows()
+        self.assertFalse(ReceiptItem.objects.filter(pk=self.apple_item.pk).exists())
+        self.assertIn((self.pear_item.pk, self.pear.pk, self.bin_a.pk, 3), rows)
+        self.assertEqual([row[1:] for row in rows if row[0] != self.pear_item.pk], [(self.apple.pk, self.bin_b.pk, 5)])
+
+    def test_id_keeps_its_row_when_product_or_location_changes(self):
+        self.update([self.item(self.apple, self.bin_b, 5, id=self.apple_item.pk)])
+
+        # The pear line was left out of the payload
+        self.assertEqual(self.rows(), [(self.apple_item.pk, self.apple.pk, self.bin_b.pk, 5)])
+
+    def test_partial_update_without_items_keeps_them(self):
+        serializer = ReceiptSerializer(self.receipt, data={'supplier': "Other"}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        self.assertEqual(len(self.rows()), 2)
+        self.receipt.refresh_from_db()
+        self.assertEqual(self.receipt.supplier, "Other")
+
+    def test_duplicate_and_foreign_ids_are_refused(self):
+        other = Receipt.objects.create(
+            reference="WH/IN/0002", warehouse=self.warehouse, supplier="S", date=datetime.date.today()
+        )
+        foreign = ReceiptItem.objects.create(receipt=other, product=self.apple, location=self.bin_a, quantity=1)
+
+        serializer = ReceiptSerializer(self.receipt, data={'items': [
+            self.item(self.apple, self.bin_a, 1, id=self.apple_item.pk),
+            self.item(self.apple, self.bin_a, 2, id=self.apple_item.pk),
+            self.item(self.pear, self.bin_a, 3, id=foreign.pk),
+            self.item(self.pear, self.bin_a, 0),
+        ]}, partial=True)
+
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(sorted(serializer.errors['items']), [1, 2, 3])
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.quantity, 1)
+
+    def test_item_deleted_after_validation_is_refused(self):
+        serializer = ReceiptSerializer(self.receipt, data={'supplier': "Other", 'items': [
+            self.item(self.apple, self.bin_a, 9, id=self.apple_item.pk),
+        ]}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        # A concurrent edit removes the row between validate() and save()
+        self.apple_item.delete()
+
+        with self.assertRaises(serializers.ValidationError):
+            serializer.save()
+
+        self.assertEqual(self.rows(), [(self.pear_item.pk, self.pear.pk, self.bin_a.pk, 3)])
+        self.receipt.refresh_from_db()
+        self.assertEqual(self.receipt.supplier, "S")
+
+
+class LedgerProtectionTests(TestCase):
+    """
+    Products and sublocations with moves cannot be deleted, so the ledger always replays
+    to the Stock it produced.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        cls.location = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+        cls.product, = make_products(1)
+        receipt = Receipt.objects.create(
+            reference="WH/IN/0001", warehouse=cls.warehouse, supplier="S", date=datetime.date.today()
+        )
+        ReceiptItem.objects.create(receipt=receipt, product=cls.product, location=cls.location, quantity=5)
+        increase_stock_on_receipt(receipt)
+
+    def test_referenced_product_cannot_be_deleted(self):
+        with self.assertRaises(ProtectedError):
+            self.product.delete()
+        self.assertEqual(MoveHistory.objects.filter(product=self.product).count(), 1)
+
+    def test_referenced_sublocation_cannot_be_deleted(self):
+        with self.assertRaises(ProtectedError):
+            self.location.delete()
+        with self.assertRaises(ProtectedError):
+            self.warehouse.delete()
+        self.assertEqual(MoveHistory.objects.filter(to_location=self.location).count(), 1)
+
+    def test_delete_endpoint_refuses(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user("clerk", password="x"))
+        response = client.delete(f"/api/warehouse/sublocations/{self.location.pk}/")
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(SubLocation.objects.filter(pk=self.location.pk).exists())
+
+
+class StockProjectionRebuildTests(TestCase):
+    """
+    rebuild_stock_projection sums the ledger under the Stock locks and repairs rows
+    that drifted from it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        cls.bin_a = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+        cls.bin_b = SubLocation.objects.create(warehouse=cls.warehouse, aisle="B1")
+        cls.product, = make_products(1)
+
+    def setUp(self):
+        receipt = Receipt.objects.create(
+            reference="WH/IN/0001", warehouse=self.warehouse, supplier="S", date=datetime.date.today()
+        )
+        ReceiptItem.objects.create(receipt=receipt, product=self.product, location=self.bin_a, quantity=10)
+        increase_stock_on_receipt(receipt)
+        transfer = InternalTransfer.objects.create(
+            reference="WH/INT/0001", from_warehouse=self.warehouse, to_warehouse=self.warehouse,
+            date=datetime.date.today()
+        )
+        TransferItem.objects.create(
+            transfer=transfer, product=self.product, from_location=self.bin_a, to_location=self.bin_b, quantity=4
+        )
+        transfer_stock_on_internal_transfer(transfer)
+
+    def quantities(self):
+        return dict(Stock.objects.values_list('sublocation_id', 'quantity'))
+
+    def rebuild(self, *args):
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('rebuild_stock_projection', *args, stdout=io.StringIO())
+        return ctx
+
+    def test_drifted_and_missing_rows_are_repaired(self):
+        Stock.objects.filter(sublocation=self.bin_a).update(quantity=99)
+        Stock.objects.filter(sublocation=self.bin_b).delete()
+
+        ctx = self.rebuild()
+
+        self.assertEqual(self.quantities(), {self.bin_a.pk: 6, self.bin_b.pk: 4})
+        # The ledger is summed after the Stock rows are locked, never streamed ahead of it
+        statements = [query['sql'] for query in ctx.captured_queries]
+        lock = next(i for i, sql in enumerate(statements) if 'FROM "warehouse_stock"' in sql)
+        ledger = [i for i, sql in enumerate(statements) if 'FROM "operations_movehistory"' in sql]
+        self.assertEqual(len(ledger), 2)
+        self.assertLess(lock, min(ledger))
+
+    def test_dry_run_writes_nothing(self):
+        Stock.objects.filter(sublocation=self.bin_a).update(quantity=99)
+
+        self.rebuild('--dry-run')
+
+        self.assertEqual(self.quantities(), {self.bin_a.pk: 99, self.bin_b.pk: 4})
+
+    def test_missing_row_created_meanwhile_is_kept(self):
+        Stock.objects.filter(sublocation=self.bin_b).delete()
+        create = Stock.objects.bulk_create
+
+        def concurrent_receipt_first(rows, **kwargs):
+            # A receipt creates the row between the lock and the repair
+            Stock.objects.create(product=self.product, sublocation=self.bin_b, quantity=7)
+            return create(rows, **kwargs)
+
+        with mock.patch.object(Stock.objects, 'bulk_create', side_effect=concurrent_receipt_first):
+            self.rebuild()
+
+        self.assertEqual(self.quantities(), {self.bin_a.pk: 6, self.bin_b.pk: 7})
+
+
+class StockAsOfTests(TestCase):
+    """
+    Stock as of a past moment replays the ledger from the newest snapshot before it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        cls.annex = Warehouse.objects.create(name="Annex", code="AX")
+        cls.bin_a = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+        cls.bin_b = SubLocation.objects.create(warehouse=cls.warehouse, aisle="B1")
+        cls.annex_bin = SubLocation.objects.create(warehouse=cls.annex, aisle="C1")
+        cls.apple, cls.pear = make_products(2)
+        cls.start = datetime.datetime(2026, 3, 1, 12, tzinfo=datetime.timezone.utc)
+
+        def move(day, product, quantity, source=None, target=None):
+            return MoveHistory(
+                operation_reference=f"M{day}", product=product, from_location=source, to_location=target,
+                quantity=quantity, move_type='ADJUSTMENT', date=cls.start + timedelta(days=day)
+            )
+        MoveHistory.objects.bulk_create([
+            move(0, cls.apple, 10, target=cls.bin_a),
+            move(0, cls.pear, 3, target=cls.bin_b),
+            move(1, cls.apple, 4, source=cls.bin_a, target=cls.bin_b),
+            move(2, cls.apple, 5, source=cls.bin_b, target=cls.annex_bin),
+            move(3, cls.pear, 3, source=cls.bin_b),
+        ])
+
+    def at(self, day, hours=1):
+        return self.start + timedelta(days=day, hours=hours)
+
+    def test_replays_the_ledger(self):
+        a, b, c = self.apple.pk, self.bin_a.pk, self.bin_b.pk
+        self.assertEqual(stock_as_of(self.start - timedelta(hours=1)), {})
+        self.assertEqual(stock_as_of(self.at(0)), {(a, b): 10, (self.pear.pk, c): 3})
+        self.assertEqual(stock_as_of(self.at(1)), {(a, b): 6, (a, c): 4, (self.pear.pk, c): 3})
+        # bin B went to -1 apples; the annex bin is filtered out by warehouse
+        self.assertEqual(stock_as_of(self.at(3), warehouse_id=self.warehouse.pk), {(a, b): 6, (a, c): -1})
+        self.assertEqual(stock_as_of(self.at(3), product_id=self.pear.pk), {})
+
+    def test_snapshot_gives_the_same_answer(self):
+        expected = {day: stock_as_of(self.at(day)) for day in range(4)}
+        take_stock_snapshot(self.at(1))
+
+        self.assertEqual({day: stock_as_of(self.at(day)) for day in range(4)}, expected)
+
+    def test_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user("clerk", password="x"))
+        url = f"/api/warehouse/stock/?warehouse={self.warehouse.pk}&as_of={self.at(1):%Y-%m-%dT%H:%M:%SZ}"
+
+        response = client.get(f"{url}&product={self.apple.pk}")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            [(stock['product_sku'], stock['sublocation_code'], stock['quantity']) for stock in response.json()['stocks']],
+            [(self.apple.sku, "A1", 6), (self.apple.sku, "B1", 4)]
+        )
+        for query in ("&product=apple", "&as_of=yesterday"):
+            self.assertEqual(client.get(f"{url}{query}").status_code, 400)
+
+
+class DeliveryReservationTests(TestCase):
+    """
+    Draft deliveries reserve stock on create, give it back on edit or delete, and
+    validations never take stock reserved for another delivery.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        cls.location = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+        cls.product, = make_products(1)
+        cls.user = User.objects.create_user("clerk", password="x")
+
+    def setUp(self):
+        self.stock = Stock.objects.create(product=self.product, sublocation=self.location, quantity=10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_delivery(self, quantity):
+        response = self.client.post("/api/operations/deliveries/", {
+            'warehouse': self.warehouse.pk, 'customer': "C", 'date': str(datetime.date.today()),
+            'items': [{'product': self.product.pk, 'location': self.location.pk, 'quantity': quantity}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Delivery.objects.get(pk=response.json()['id'])
+
+    def reserved(self):
+        self.stock.refresh_from_db()
+        return self.stock.reserved_quantity
+
+    def test_draft_reserves_what_is_available(self):
+        first = self.create_delivery(6)
+        second = self.create_delivery(6)
+
+        self.assertEqual(self.reserved(), 10)
+        self.assertEqual(first.items.get().reserved_quantity, 6)
+        # Only the remaining 4 could be promised to the second draft
+        self.assertEqual(second.items.get().reserved_quantity, 4)
+        self.assertEqual(
+            available_to_promise(self.product.pk, self.warehouse.pk), {'on_hand': 10, 'reserved': 10, 'available': 0}
+        )
+
+    def test_edit_releases_and_reserves_again(self):
+        delivery = self.create_delivery(6)
+        item = delivery.items.get()
+
+        response = self.client.patch(f"/api/operations/deliveries/{delivery.pk}/", {
+            'items': [{'id': item.pk, 'product': self.product.pk, 'location': self.location.pk, 'quantity': 2}],
+        }, format='json')
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.reserved(), 2)
+        self.assertEqual(DeliveryItem.objects.get(pk=item.pk).reserved_quantity, 2)
+
+    def test_delete_releases(self):
+        delivery = self.create_delivery(6)
+
+        response = self.client.delete(f"/api/operations/deliveries/{delivery.pk}/")
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.reserved(), 0)
+
+    def test_validation_cannot_take_stock_reserved_for_another_delivery(self):
+        self.create_delivery(8)
+        # Created behind the API's back, so it holds no reservation of its own
+        other = Delivery.objects.create(
+            reference="WH/OUT/9999", warehouse=self.warehouse, customer="C", date=datetime.date.today()
+        )
+        DeliveryItem.objects.create(delivery=other, product=self.product, location=self.location, quantity=5)
+
+        with self.assertRaises(InsufficientStock):
+            decrease_stock_on_delivery(other)
+
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.quantity, self.stock.reserved_quantity), (10, 8))
+
+    def test_validation_consumes_its_own_reservation(self):
+        delivery = self.create_delivery(8)
+
+        decrease_stock_on_delivery(delivery)
+
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.quantity, self.stock.reserved_quantity), (2, 0))
+        self.assertEqual(delivery.items.get().reserved_quantity, 0)
+
+
+class DocumentReferenceTests(TestCase):
+    """
+    References are unique and increasing per warehouse and operation, continuing after
+    documents that existed before the sequence did. Numbers are never reused, so a
+    create that fails after taking its number leaves a gap.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.main = Warehouse.objects.create(name="Main", code="WH")
+        cls.annex = Warehouse.objects.create(name="Annex", code="AX")
+
+    def test_back_to_back_documents_get_consecutive_references(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user("clerk", password="x"))
+        references = []
+        for _ in range(3):
+            response = client.post("/api/operations/receipts/", {
+                'warehouse': self.main.pk, 'supplier': "S", 'date': str(datetime.date.today()), 'items': [],
+            }, format='json')
+            self.assertEqual(response.status_code, 201, response.content)
+            references.append(response.json()['reference'])
+
+        self.assertEqual(references, ["WH/IN/0001", "WH/IN/0002", "WH/IN/0003"])
+
+    def test_sequences_are_independent_per_warehouse_and_operation(self):
+        self.assertEqual(generate_reference(self.main, 'IN'), "WH/IN/0001")
+        self.assertEqual(generate_reference(self.annex, 'IN'), "AX/IN/0001")
+        self.assertEqual(generate_reference(self.main, 'OUT'), "WH/OUT/0001")
+        self.assertEqual(generate_reference(self.main, 'IN'), "WH/IN/0002")
+
+    def test_new_sequence_continues_after_existing_references(self):
+        for reference in ("WH/OUT/0007", "WH/OUT/0012", "WH/OUT/legacy", "AX/OUT/0099"):
+            Delivery.objects.create(reference=reference, warehouse=self.main, customer="C", date=datetime.date.today())
+
+        self.assertEqual(generate_reference(self.main, 'OUT'), "WH/OUT/0013")
+        # Deleting the newest document never hands its number out again
+        Delivery.objects.filter(reference="WH/OUT/0013").delete()
+        Delivery.objects.create(reference="WH/OUT/0013", warehouse=self.main, customer="C", date=datetime.date.today())
+        Delivery.objects.filter(reference="WH/OUT/0013").delete()
+        self.assertEqual(generate_reference(self.main, 'OUT'), "WH/OUT/0014")
+
+
+class ImportTests(TestCase):
+    """
+    Imports run chunk by chunk: bad rows are reported with their row number and only
+    reject themselves, and a dry run writes nothing.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        cls.location = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+
+    def run_csv(self, kind, text, **kwargs):
+        return run_import(kind, io.BytesIO(text.encode()), 'csv', **kwargs)
+
+    def test_products_and_opening_stock(self):
+        summary = self.run_csv('products', (
+            "sku,name,category,type,weight\n"
+            "APL,Apple,fin,Unit,1\n"
+            "PER,Pear,FIN,Unit,2\n"
+            "FIG,Fig,RAW,Unit,0.5\n"
+        ), chunk_size=2)
+        self.assertEqual((summary['rows'], summary['imported'], summary['errors']), (3, 3, []))
+        self.assertEqual(Product.objects.get(sku="APL").category, 'FIN')
+
+        Stock.objects.create(product=Product.objects.get(sku="PER"), sublocation=self.location, quantity=5)
+        lines = [{'sku': sku, 'location': "A1", 'quantity': quantity} for sku, quantity in (("APL", 4), ("PER", 2))]
+        summary = run_import(
+            'opening-stock', io.BytesIO("\n".join(json.dumps(line) for line in lines).encode()), 'jsonl'
+        )
+
+        self.assertEqual((summary['imported'], summary['errors']), (2, []))
+        self.assertEqual(
+            dict(Stock.objects.values_list('product__sku', 'quantity')), {"APL": 4, "PER": 2}
+        )
+        self.assertEqual(
+            sorted(MoveHistory.objects.values_list('product__sku', 'quantity', 'move_type')),
+            [("APL", 4, 'ADJUSTMENT'), ("PER", -3, 'ADJUSTMENT')]
+        )
+
+    def test_bad_rows_only_reject_themselves(self):
+        Product.objects.create(sku="OLD", name="Old", category='FIN', type='Unit', weight=1)
+
+        summary = self.run_csv('products', (
+            "sku,name,category,type,weight\n"
+            "APL,Apple,FIN,Unit,1\n"
+            "BAD,Bad,NOPE,Unit,1\n"
+            "OLD,Old,FIN,Unit,1\n"
+            "HVY,Heavy,FIN,Unit,lots\n"
+            "APL,Apple again,FIN,Unit,1\n"
+            ",Nameless,FIN,Unit,1\n"
+        ), chunk_size=3)
+
+        self.assertEqual((summary['rows'], summary['imported'], summary['error_count']), (6, 1, 5))
+        self.assertEqual([error['row'] for error in summary['errors']], [3, 4, 5, 6, 7])
+        # APL's second row lands in the next chunk and hits the database check
+        self.assertEqual(summary['errors'][3]['error'], "Product with sku APL already exists")
+        self.assertEqual(sorted(Product.objects.values_list('sku', flat=True)), ["APL", "OLD"])
+
+    def test_overlong_values_reject_only_their_row(self):
+        summary = self.run_csv('products', (
+            "sku,name,category,type,weight\n"
+            f"{'S' * 101},Long sku,FIN,Unit,1\n"
+            "APL,Apple,FIN,Unit,1\n"
+            f"PER,{'N' * 201},FIN,Unit,1\n"
+        ))
+        self.assertEqual((summary['imported'], [error['row'] for error in summary['errors']]), (1, [2, 4]))
+        self.assertTrue(summary['errors'][0]['error'].startswith("sku: "))
+
+        summary = self.run_csv('sublocations', (
+            "warehouse,aisle,rack,bin\n"
+            f"WH,{'A' * 51},,\n"
+            "WH,B1,R1,\n"
+        ))
+        self.assertEqual((summary['imported'], [error['row'] for error in summary['errors']]), (1, [2]))
+        self.assertEqual(list(SubLocation.objects.filter(warehouse=self.warehouse).values_list('code', flat=True).order_by('code')), ["A1", "B1-R1"])
+
+    def test_opening_stock_errors_and_dry_run(self):
+        Product.objects.create(sku="APL", name="Apple", category='FIN', type='Unit', weight=1)
+        stream = io.BytesIO(b"\n".join([
+            b'{"sku": "APL", "location": "A1", "quantity": 7}',
+            b'{"sku": "APL", "location": "A1", "quantity": -1}',
+            b'{"sku": "NONE", "location": "A1", "quantity": 1}',
+            b'{"sku": "APL", "location": "Z9", "quantity": 1}',
+            b'not json',
+            b'[1, 2]',
+        ]))
+
+        summary = run_import('opening-stock', stream, 'jsonl', dry_run=True)
+
+        self.assertEqual((summary['imported'], summary['error_count']), (1, 5))
+        self.assertEqual(sorted(error['row'] for error in summary['errors']), [2, 3, 4, 5, 6])
+        self.assertFalse(Stock.objects.exists())
+        self.assertFalse(MoveHistory.objects.exists())
+
+
+class ValuationTests(TestCase):
+    """
+    Weighted-average and FIFO values follow receipts, transfers and deliveries.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.main = Warehouse.objects.create(name="Main", code="WH")
+        cls.annex = Warehouse.objects.create(name="Annex", code="AX")
+        cls.main_bin = SubLocation.objects.create(warehouse=cls.main, aisle="A1")
+        cls.annex_bin = SubLocation.objects.create(warehouse=cls.annex, aisle="B1")
+        cls.product, = make_products(1)
+
+    def receive(self, number, quantity, unit_price):
+        receipt = Receipt.objects.create(
+            reference=f"WH/IN/{number:04d}", warehouse=self.main, supplier="S", date=datetime.date.today()
+        )
+        ReceiptItem.objects.create(
+            receipt=receipt, product=self.product, location=self.main_bin, quantity=quantity, unit_price=unit_price
+        )
+        increase_stock_on_receipt(receipt)
+
+    def deliver(self, number, quantity, location):
+        delivery = Delivery.objects.create(
+            reference=f"WH/OUT/{number:04d}", warehouse=location.warehouse, customer="C", date=datetime.date.today()
+        )
+        DeliveryItem.objects.create(delivery=delivery, product=self.product, location=location, quantity=quantity)
+        decrease_stock_on_delivery(delivery)
+
+    def valuation(self, warehouse):
+        valuation = StockValuation.objects.get(product=self.product, warehouse=warehouse)
+        return valuation.quantity, valuation.average_value, valuation.fifo_value
+
+    def cost_of_goods_sold(self):
+        return DailyMovementRollup.objects.filter(move_type='OUT', product__isnull=True).aggregate(
+            average=Sum('cost_average'), fifo=Sum('cost_fifo')
+        )
+
+    def test_delivery_consumes_oldest_layers(self):
+        self.receive(1, 10, Decimal('2'))
+        self.receive(2, 10, Decimal('4'))
+        self.deliver(1, 15, self.main_bin)
+
+        self.assertEqual(self.valuation(self.main), (5, Decimal('15'), Decimal('20')))
+        self.assertEqual(self.cost_of_goods_sold(), {'average': Decimal('45'), 'fifo': Decimal('40')})
+        self.assertEqual(
+            list(CostLayer.objects.filter(remaining_quantity__gt=0).values_list('unit_cost', 'remaining_quantity')),
+            [(Decimal('4'), 5)]
+        )
+
+    def test_transfer_carries_layers_across_warehouses(self):
+        self.receive(1, 10, Decimal('2'))
+        self.receive(2, 10, Decimal('4'))
+        transfer = InternalTransfer.objects.create(
+            reference="WH/INT/0001", from_warehouse=self.main, to_warehouse=self.annex, date=datetime.date.today()
+        )
+        TransferItem.objects.create(
+            transfer=transfer, product=self.product, from_location=self.main_bin, to_location=self.annex_bin, quantity=12
+        )
+        transfer_stock_on_internal_transfer(transfer)
+        self.deliver(1, 12, self.annex_bin)
+
+        self.assertEqual(self.valuation(self.main), (8, Decimal('24'), Decimal('32')))
+        self.assertEqual(self.valuation(self.annex), (0, Decimal('0'), Decimal('0')))
+        self.assertEqual(self.cost_of_goods_sold(), {'average': Decimal('36'), 'fifo': Decimal('28')})
+
+    def test_rebuild_matches_incremental_valuation(self):
+        self.receive(1, 10, Decimal('2'))
+        self.receive(2, 10, Decimal('4'))
+        self.deliver(1, 15, self.main_bin)
+        incremental = (self.valuation(self.main), self.cost_of_goods_sold())
+
+        StockValuation.objects.all().delete()
+        CostLayer.objects.all().delete()
+        call_command('rebuild_valuation', stdout=io.StringIO())
+
+        self.assertEqual((self.valuation(self.main), self.cost_of_goods_sold()), incremental)
+
+    def test_rebuild_locks_valuations_and_rollups_before_replaying(self):
+        self.receive(1, 10, Decimal('2'))
+        self.deliver(1, 4, self.main_bin)
+        incremental = (self.valuation(self.main), self.cost_of_goods_sold())
+
+        calls = []
+        command = 'operations.management.commands.rebuild_valuation'
+        with mock.patch(f'{command}.lock_valuations', side_effect=lambda: calls.append('valuations')), mock.patch(
+            f'{command}.lock_rollups', side_effect=lambda: calls.append('rollups')
+        ), mock.patch(
+            f'{command}.ValuationState', side_effect=lambda *args: calls.append('replay') or ValuationState(*args)
+        ):
+            call_command('rebuild_valuation', stdout=io.StringIO())
+
+        self.assertEqual(calls, ['valuations', 'rollups', 'replay'])
+        self.assertEqual((self.valuation(self.main), self.cost_of_goods_sold()), incremental)
+
+    def test_statistics_value_deliveries_and_transfers_at_cost(self):
+        self.receive(1, 10, Decimal('2'))
+        self.receive(2, 10, Decimal('4'))
+        transfer = InternalTransfer.objects.create(
+            reference="WH/INT/0001", from_warehouse=self.main, to_warehouse=self.annex, date=datetime.date.today()
+        )
+        TransferItem.objects.create(
+            transfer=transfer, product=self.product, from_location=self.main_bin, to_location=self.annex_bin, quantity=5
+        )
+        transfer_stock_on_internal_transfer(transfer)
+        self.deliver(1, 5, self.main_bin)
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user("clerk", password="x"))
+        operations = client.get("/api/dashboard/statistics/").json()['statistics']['operations']
+
+        # 20 units received for 60; each 5 units taken out cost 15 at the average
+        self.assertEqual(
+            (operations['receipts_value'], operations['transfers_value'], operations['deliveries_value']),
+            (60.0, 15.0, 15.0)
+        )
+        self.assertEqual(operations['deliveries_value'], operations['cost_of_goods_sold'])
+
+    def test_backfill_locks_rollups_before_reading_the_ledger(self):
+        self.receive(1, 10, Decimal('2'))
+        self.deliver(1, 4, self.main_bin)
+        incremental = set(DailyMovementRollup.objects.values_list(
+            'warehouse_id', 'product_id', 'move_type', 'quantity_in', 'quantity_out', 'value', 'cost_average',
+            'document_count'
+        ))
+
+        calls = []
+        command = 'operations.management.commands.backfill_movement_rollups'
+        with mock.patch(f'{command}.lock_rollups', side_effect=lambda: calls.append('lock')), mock.patch(
+            f'{command}.compute_movement_rollups', side_effect=lambda: calls.append('compute') or compute_movement_rollups()
+        ):
+            call_command('backfill_movement_rollups', stdout=io.StringIO())
+
+        self.assertEqual(calls, ['lock', 'compute'])
+        call_command('backfill_movement_rollups', stdout=io.StringIO())
+        # Rebuilt totals match the incremental ones, and the costs survive the rebuild
+        self.assertEqual(set(DailyMovementRollup.objects.values_list(
+            'warehouse_id', 'product_id', 'move_type', 'quantity_in', 'quantity_out', 'value', 'cost_average',
+            'document_count'
+        )), incremental)
+
+
+class ValidationJobTests(TestCase):
+    """
+    The async validation queue claims each job once, batches per user and records failures.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        cls.location = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+        cls.product, = make_products(1)
+        cls.alice = User.objects.create_user("alice", password="x")
+        cls.bob = User.objects.create_user("bob", password="x")
+
+    def receipt(self, number, quantity=5):
+        receipt = Receipt.objects.create(
+            reference=f"WH/IN/{number:04d}", warehouse=self.warehouse, supplier="S", date=datetime.date.today()
+        )
+        ReceiptItem.objects.create(receipt=receipt, product=self.product, location=self.location, quantity=quantity)
+        return receipt
+
+    def delivery(self, number, quantity):
+        delivery = Delivery.objects.create(
+            reference=f"WH/OUT/{number:04d}", warehouse=self.warehouse, customer="C", date=datetime.date.today()
+        )
+        DeliveryItem.objects.create(delivery=delivery, product=self.product, location=self.location, quantity=quantity)
+        return delivery
+
+    def test_jobs_are_claimed_once(self):
+        jobs = [enqueue_validation('receipt', self.receipt(i).pk, self.alice) for i in range(3)]
+
+        first = claim_jobs(2, worker='w1')
+        second = claim_jobs(5, worker='w2')
+
+        self.assertEqual([job.pk for job in first], [jobs[0].pk, jobs[1].pk])
+        self.assertEqual([job.pk for job in second], [jobs[2].pk])
+        self.assertEqual(claim_jobs(5, worker='w3'), [])
+        self.assertEqual(
+            set(ValidationJob.objects.values_list('status', 'attempts')), {('RUNNING', 1)}
+        )
+
+    def test_documents_are_validated_per_user_in_one_call(self):
+        for i, user in enumerate((self.alice, self.alice, self.bob)):
+            enqueue_validation('receipt', self.receipt(i).pk, user)
+
+        with mock.patch('operations.jobs.validate_documents', wraps=validate_documents) as validate:
+            self.assertEqual(process_pending_jobs(10, worker='w1'), 3)
+
+        self.assertEqual(
+            sorted((len(call.args[0]['receipt']), call.args[1].username) for call in validate.call_args_list),
+            [(1, 'bob'), (2, 'alice')]
+        )
+        self.assertEqual(set(ValidationJob.objects.values_list('status', flat=True)), {'SUCCEEDED'})
+        self.assertEqual(Stock.objects.get().quantity, 15)
+
+    def test_failures_are_recorded_and_requeued_on_enqueue(self):
+        delivery = self.delivery(1, quantity=5)
+        job = enqueue_validation('delivery', delivery.pk, self.alice)
+
+        process_pending_jobs(10, worker='w1')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'FAILED')
+        self.assertIn('Not enough stock', job.error)
+
+        self.assertEqual(enqueue_validation('delivery', delivery.pk, self.alice).status, 'PENDING')
+
+    def test_unexpected_errors_fail_the_whole_batch(self):
+        enqueue_validation('receipt', self.receipt(1).pk, self.alice)
+        enqueue_validation('receipt', self.receipt(2).pk, self.alice)
+
+        with mock.patch('operations.jobs.validate_documents', side_effect=RuntimeError("database went away")):
+            process_pending_jobs(10, worker='w1')
+
+        self.assertEqual(
+            set(ValidationJob.objects.values_list('status', 'error')), {('FAILED', 'database went away')}
+        )
+
+    def test_stale_running_jobs_are_requeued(self):
+        stale = enqueue_validation('receipt', self.receipt(1).pk, self.alice)
+        fresh = enqueue_validation('receipt', self.receipt(2).pk, self.alice)
+        claim_jobs(10, worker='crashed')
+        ValidationJob.objects.filter(pk=stale.pk).update(
+            started_at=datetime.datetime.now(datetime.timezone.utc) - timedelta(hours=1)
+        )
+
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=15)), 1)
+        self.assertEqual(ValidationJob.objects.get(pk=stale.pk).status, 'PENDING')
+        self.assertEqual(ValidationJob.objects.get(pk=fresh.pk).status, 'RUNNING')
+
+
+class ValidationWorkerTests(TransactionTestCase):
+    """
+    Worker threads use their own connections, so the data must be committed.
+    """
+
+    def test_worker_requeues_stale_jobs_while_running(self):
+        warehouse = Warehouse.objects.create(name="Main", code="WH")
+        location = SubLocation.objects.create(warehouse=warehouse, aisle="A1")
+        product, = make_products(1)
+        receipt = Receipt.objects.create(
+            reference="WH/IN/0001", warehouse=warehouse, supplier="S", date=datetime.date.today()
+        )
+        ReceiptItem.objects.create(receipt=receipt, product=product, location=location, quantity=5)
+        job = enqueue_validation('receipt', receipt.pk)
+        claim_jobs(10, worker='crashed')
+        ValidationJob.objects.filter(pk=job.pk).update(
+            started_at=datetime.datetime.now(datetime.timezone.utc) - timedelta(hours=1)
+        )
+
+        call_command('run_validation_jobs', once=True, stale_after=15, stdout=io.StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('SUCCEEDED', 2))
+        self.assertEqual(Stock.objects.get().quantity, 5)
+
+    def test_once_keeps_going_until_the_queue_is_empty(self):
+        warehouse = Warehouse.objects.create(name="Main", code="WH")
+        location = SubLocation.objects.create(warehouse=warehouse, aisle="A1")
+        product, = make_products(1)
+        jobs = []
+        for i in range(2):
+            receipt = Receipt.objects.create(
+                reference=f"WH/IN/{i:04d}", warehouse=warehouse, supplier="S", date=datetime.date.today()
+            )
+            ReceiptItem.objects.create(receipt=receipt, product=product, location=location, quantity=5)
+            jobs.append(enqueue_validation('receipt', receipt.pk))
+
+        # The first attempt fails, the second loses the claim race; neither means the queue is empty
+        outcomes = [RuntimeError("database went away"), 0]
+
+        def flaky(batch_size, worker=None):
+            if outcomes:
+                outcome = outcomes.pop(0)
+                if isinstance(outcome, Exception):
+                    raise outcome
+                return outcome
+            return process_pending_jobs(batch_size, worker)
+
+        with mock.patch('operations.management.commands.run_validation_jobs.process_pending_jobs', side_effect=flaky):
+            call_command('run_validation_jobs', once=True, poll_interval=0, stdout=io.StringIO())
+
+        self.assertEqual(outcomes, [])
+        self.assertEqual(set(ValidationJob.objects.values_list('status', flat=True)), {'SUCCEEDED'})
+        self.assertEqual(Stock.objects.get().quantity, 10)
+
+
+class ResponseCacheTests(TestCase):
+    """
+    Cached list responses must never outlive the write that changes them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        cls.location = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+        cls.product, = make_products(1)
+        cls.user = User.objects.create(username="clerk")
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def stock_list(self, query='warehouse={}'):
+        return self.client.get(f"/api/warehouse/stock/?{query.format(self.warehouse.id)}").json()
+
+    def test_repeated_reads_are_served_from_cache(self):
+        self.stock_list()
+        with CaptureQueriesContext(connection) as ctx:
+            self.stock_list()
+            # Same parameters in another order
+            self.stock_list('ordering=quantity&warehouse={}'), self.stock_list('warehouse={}&ordering=quantity')
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_validation_invalidates_stock_list(self):
+        self.assertEqual(self.stock_list()['count'], 0)
+        receipt = Receipt.objects.create(
+            reference="WH/IN/0001", warehouse=self.warehouse, supplier="S", date=datetime.date.today()
+        )
+        ReceiptItem.objects.create(receipt=receipt, product=self.product, location=self.location, quantity=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            validate_documents({'receipt': [receipt.id]})
+        self.assertEqual([stock['quantity'] for stock in self.stock_list()['stocks']], [5])
+
+    def test_product_rename_invalidates_stock_list(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Stock.objects.create(product=self.product, sublocation=self.location, quantity=1)
+        self.stock_list()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = "Renamed"
+            self.product.save()
+        self.assertEqual(self.stock_list()['stocks'][0]['product_name'], "Renamed")
+
+    def test_default_statistics_window_rolls_over_without_writes(self):
+        def statistics(now):
+            with mock.patch('django.utils.timezone.now', return_value=now):
+                return self.client.get("/api/dashboard/statistics/?period=7d").json()['filters_applied']
+
+        evening = datetime.datetime(2026, 3, 2, 21, 0, tzinfo=datetime.timezone.utc)
+        first = statistics(evening)
+        self.assertEqual(statistics(evening + timedelta(hours=1)), first)
+
+        # Past midnight the cached window of the previous day must not be served
+        after_midnight = statistics(evening + timedelta(days=1))
+        self.assertEqual(after_midnight['date_to'], (evening + timedelta(days=1)).isoformat())
+
+
+class StockRaceTests(TestCase):
+    """
+    Runs on every backend, SQLite included: a competing validation commits between a
+    clerk's read of the stock rows and its write. Where row locks serialise the two
+    this cannot happen; where they do not, the conditional UPDATE must refuse the debit.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        cls.location = SubLocation.objects.create(warehouse=cls.warehouse, aisle="A1")
+        cls.product, = make_products(1)
+
+    def setUp(self):
+        Stock.objects.create(product=self.product, sublocation=self.location, quantity=10)
+
+    def delivery(self, number, quantity):
+        delivery = Delivery.objects.create(
+            reference=f"WH/OUT/{number:04d}", warehouse=self.warehouse, customer="C", date=datetime.date.today()
+        )
+        DeliveryItem.objects.create(delivery=delivery, product=self.product, location=self.location, quantity=quantity)
+        return delivery
+
+    def interleave(self, competing):
+        """Patch the row read so `competing` runs right after the first clerk has read."""
+        read_rows = services._lock_stock_rows
+        pending = [competing]
+
+        def read_then_compete(keys):
+            stocks = read_rows(keys)
+            if pending:
+                with transaction.atomic():
+                    pending.pop()()
+            return stocks
+        return mock.patch('operations.services._lock_stock_rows', side_effect=read_then_compete)
+
+    def test_stale_read_cannot_oversell(self):
+        first, second = self.delivery(1, 8), self.delivery(2, 8)
+
+        seen = []
+        with self.interleave(lambda: (decrease_stock_on_delivery(second), seen.append(Stock.objects.get().quantity))):
+            # The first clerk read 10 and passes the in-memory check; only the guarded
+            # UPDATE sees the 2 left and refuses, instead of writing -6
+            with self.assertRaises(InsufficientStock):
+                decrease_stock_on_delivery(first)
+
+        self.assertEqual(seen, [2])
+        # One connection runs both here, so the competing delivery rolls back with the refused one
+        self.assertEqual(Stock.objects.get().quantity, 10)
+        self.assertFalse(MoveHistory.objects.exists())
+
+    def test_stale_read_still_applies_when_stock_remains(self):
+        first, second = self.delivery(1, 4), self.delivery(2, 4)
+
+        with self.interleave(lambda: decrease_stock_on_delivery(second)):
+            decrease_stock_on_delivery(first)
+
+        self.assertEqual(Stock.objects.get().quantity, 2)
+        self.assertEqual(MoveHistory.objects.count(), 2)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class StockContentionStressTests(TransactionTestCase):
+    """
+    Many clerks validating against the same bins at once must never oversell.
+    Needs a backend with row locks (PostgreSQL, MySQL); SQLite serialises writers
+    and would not exercise the locking at all.
+    """
+    threads = 12
+
+    def setUp(self):
+        self.warehouse = Warehouse.objects.create(name="Main", code="WH")
+        self.bin_a = SubLocation.objects.create(warehouse=self.warehouse, aisle="A1")
+        self.bin_b = SubLocation.objects.create(warehouse=self.warehouse, aisle="B1")
+        self.product, = make_products(1)
+        Stock.objects.create(product=self.product, sublocation=self.bin_a, quantity=20)
+        Stock.objects.create(product=self.product, sublocation=self.bin_b, quantity=20)
+
+    def run_concurrently(self, jobs):
+        barrier = threading.Barrier(len(jobs))
+        outcomes = []
+
+        def run(job):
+            barrier.wait()
+            try:
+                # No retries: row locks must serialise the clerks, and a deadlock fails the test
+                with transaction.atomic():
+                    job()
+                outcomes.append(True)
+            except InsufficientStock:
+                outcomes.append(False)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=run, args=(job,)) for job in jobs]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(len(outcomes), len(jobs))
+        return outcomes.count(True)
+
+    def test_concurrent_deliveries_never_oversell(self):
+        deliveries = []
+        for i in range(self.threads):
+            delivery = Delivery.objects.create(
+                reference=f"WH/OUT/{i:04d}", warehouse=self.warehouse, customer="C", date=datetime.date.today()
+            )
+            DeliveryItem.objects.create(delivery=delivery, product=self.product, location=self.bin_a, quantity=3)
+            DeliveryItem.objects.create(delivery=delivery, product=self.product, location=self.bin_b, quantity=3)
+            deliveries.append(delivery)
+
+        succeeded = self.run_concurrently([
+            lambda delivery=delivery: decrease_stock_on_delivery(delivery) for delivery in deliveries
+        ])
+
+        quantities = list(Stock.objects.values_list('quantity', flat=True))
+        self.assertTrue(all(quantity >= 0 for quantity in quantities), quantities)
+        self.assertEqual(succeeded, 6)
+        self.assertEqual(quantities, [20 - 3 * succeeded] * 2)
+        self.assertEqual(MoveHistory.objects.count(), 2 * succeeded)
+
+    def test_opposing_transfers_keep_totals(self):
+        transfers = []
+        for i in range(self.threads):
+            source, target = (self.bin_a, self.bin_b) if i % 2 else (self.bin_b, self.bin_a)
+            transfer = InternalTransfer.objects.create(
+                reference=f"WH/INT/{i:04d}", from_warehouse=self.warehouse, to_warehouse=self.warehouse,
+                date=datetime.date.today()
+            )
+            TransferItem.objects.create(
+                transfer=transfer, product=self.product, from_location=source, to_location=target, quantity=15
+            )
+            transfers.append(transfer)
+
+        succeeded = self.run_concurrently([
+            lambda transfer=transfer: transfer_stock_on_internal_transfer(transfer) for transfer in transfers
+        ])
+
+        quantities = list(Stock.objects.values_list('quantity', flat=True))
+        self.assertTrue(all(quantity >= 0 for quantity in quantities), quantities)
+        self.assertEqual(sum(quantities), 40)
+        # The first transfer each way always fits; later ones depend on the interleaving
+        self.assertGreaterEqual(succeeded, 2)
+        self.assertEqual(MoveHistory.objects.count(), succeeded)
@@ -3,6 +3,7 @@ from .views import (
     ReceiptListCreateView, ReceiptDetailView, ReceiptValidateView, ReceiptPrintView,
     DeliveryListCreateView, DeliveryDetailView, DeliveryValidateView, DeliveryPrintView,
     TransferListCreateView, TransferDetailView, TransferValidateView,
+    BatchValidateView, ValidationJobDetailView, ImportView,
     AdjustmentListCreateView, AdjustmentDetailView,
     MoveHistoryListView, MoveHistoryDetailView
 )
@@ -27,6 +28,13 @@ urlpatterns = [
     path("transfers/<int:pk>/", TransferDetailView.as_view(), name="transfer-detail"),
     path("transfers/<int:pk>/validate/", TransferValidateView.as_view(), name="transfer-validate"),
 
+    # Batch validation
+    path("validate/", BatchValidateView.as_view(), name="batch-validate"),
+    path("jobs/<int:pk>/", ValidationJobDetailView.as_view(), name="validation-job-detail"),
+
+    # Bulk import
+    path("import/<str:kind>/", ImportView.as_view(), name="import"),
+
     # Stock Adjustments
     path("adjustments/", AdjustmentListCreateView.as_view(), name="adjustment-list-create"),
     path("adjustments/<int:pk>/", AdjustmentDetailView.as_view(), name="adjustment-detail"),
@@ -1,4 +1,6 @@
-from operations.models import Receipt, Delivery, InternalTransfer
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from operations.models import Receipt, Delivery, InternalTransfer, DocumentSequence
 from warehouse.models import Warehouse
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter, A4
@@ -8,29 +10,50 @@ from reportlab.lib.units import inch
 from io import BytesIO
 from django.utils import timezone
 
+SEQUENCE_MODELS = {
+    'IN': (Receipt, 'warehouse'),
+    'OUT': (Delivery, 'warehouse'),
+    'INT': (InternalTransfer, 'from_warehouse'),
+}
+
+def _highest_reference_number(warehouse: Warehouse, operation_type: str) -> int:
+    """
+    Largest numeric suffix among existing references, used to seed a new sequence.
+    """
+    model, warehouse_field = SEQUENCE_MODELS[operation_type]
+    prefix = f"{warehouse.code}/{operation_type}/"
+    references = model.objects.filter(
+        **{warehouse_field: warehouse, 'reference__startswith': prefix}
+    ).values_list('reference', flat=True)
+    numbers = [int(ref[len(prefix):]) for ref in references if ref[len(prefix):].isdigit()]
+    return max(numbers, default=0)
+
 def generate_reference(warehouse: Warehouse, operation_type: str) -> str:
     """
-    Generate a unique reference for an operation.
+    Generate a unique reference for an operation with one atomic increment of its sequence.
     Format: {WarehouseCode}/{Operation}/{CID}
     Operation: IN (Receipt), OUT (Delivery), INT (Internal Transfer)
     """
-    if operation_type == 'IN':
-        model = Receipt
-        filter_kwargs = {'warehouse': warehouse}
-    elif operation_type == 'OUT':
-        model = Delivery
-        filter_kwargs = {'warehouse': warehouse}
-    elif operation_type == 'INT':
-        model = InternalTransfer
-        filter_kwargs = {'from_warehouse': warehouse}
-    else:
+    if operation_type not in SEQUENCE_MODELS:
         raise ValueError('Invalid operation type')
 
-    # Count existing operations for this warehouse and type
-    count = model.objects.filter(**filter_kwargs).count() + 1
-    cid = str(count).zfill(4)
-    ref = f"{warehouse.code}/{operation_type}/{cid}"
-    return ref
+    sequences = DocumentSequence.objects.filter(warehouse=warehouse, operation_type=operation_type)
+    with transaction.atomic():
+        if not sequences.update(last_value=F('last_value') + 1):
+            # First reference of this kind: continue after any existing documents
+            try:
+                with transaction.atomic():
+                    DocumentSequence.objects.create(
+                        warehouse=warehouse, operation_type=operation_type,
+                        last_value=_highest_reference_number(warehouse, operation_type) + 1
+                    )
+            except IntegrityError:
+                # Another request created it first
+                sequences.update(last_value=F('last_value') + 1)
+        # The row stays write-locked until commit, so nobody else can move it meanwhile
+        number = sequences.values_list('last_value', flat=True).get()
+
+    return f"{warehouse.code}/{operation_type}/{str(number).zfill(4)}"
 
 def generate_receipt_pdf(receipt):
     """
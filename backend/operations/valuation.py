@@ -0,0 +1,234 @@
+"""
+Inventory valuation, maintained incrementally from the moves appended to MoveHistory.
+
+Each (product, warehouse) has a StockValuation row holding its quantity and value
+under the weighted-average method and under FIFO, plus the open CostLayer rows that
+the FIFO value is made of. Receipts open layers at their unit price; deliveries and
+negative adjustments consume the oldest layers; transfers between warehouses move
+layers across. Moves within one warehouse do not change its value.
+"""
+import bisect
+from collections import defaultdict
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, FloatField, Value, When
+from django.utils import timezone
+from operations.models import CostLayer, StockValuation
+
+ZERO = Decimal(0)
+CENT = Decimal('0.0001')
+TOLERANCE = 1e-9
+
+
+def _decimal(quantity):
+    return Decimal(str(quantity))
+
+def _flow(move, warehouses):
+    """
+    (source warehouse, target warehouse, quantity) of a move, with a negative
+    adjustment turned into an outflow. None when the move stays inside a warehouse.
+    """
+    source = warehouses.get(move.from_location_id)
+    target = warehouses.get(move.to_location_id)
+    quantity = move.quantity
+    if quantity < 0 and source is None:
+        source, target, quantity = target, None, -quantity
+    if source == target or quantity <= TOLERANCE:
+        return None
+    return source, target, quantity
+
+
+class ValuationState:
+    """
+    In-memory valuations and open layers for a set of (product, warehouse) keys,
+    updated move by move. Used by the mutation path on locked rows and by the
+    rebuild command on the whole ledger.
+    """
+
+    def __init__(self, valuations, layers):
+        self.valuations = valuations
+        # Open layers per key, oldest first
+        self.layers = layers
+        self.new_layers = []
+        self.consumed = {}
+
+    def valuation(self, key):
+        if key not in self.valuations:
+            self.valuations[key] = StockValuation(product_id=key[0], warehouse_id=key[1])
+        return self.valuations[key]
+
+    def add_layer(self, layer):
+        self.new_layers.append(layer)
+        bisect.insort(self.layers[(layer.product_id, layer.warehouse_id)], layer, key=lambda l: l.received_at)
+
+    def take(self, key, quantity, date):
+        """
+        Remove `quantity` from a warehouse. Returns the average cost, the FIFO cost and
+        the (received_at, unit_cost, quantity) slices that were consumed.
+        """
+        valuation = self.valuation(key)
+        unit_cost = valuation.average_unit_cost
+        average_cost = (unit_cost * _decimal(quantity)).quantize(CENT)
+
+        slices = []
+        remaining = quantity
+        open_layers = self.layers[key]
+        while remaining > TOLERANCE and open_layers:
+            layer = open_layers[0]
+            used = min(layer.remaining_quantity, remaining)
+            layer.remaining_quantity -= used
+            remaining -= used
+            slices.append((layer.received_at, layer.unit_cost, used))
+            if layer.pk:
+                self.consumed[layer.pk] = layer
+            if layer.remaining_quantity <= TOLERANCE:
+                layer.remaining_quantity = 0
+                open_layers.pop(0)
+        if remaining > TOLERANCE:
+            # Units with no layer (stock that predates valuation) go at the average cost
+            slices.append((date, unit_cost.quantize(CENT), remaining))
+        fifo_cost = sum((unit * _decimal(used) for _, unit, used in slices), ZERO).quantize(CENT)
+
+        valuation.quantity -= quantity
+        valuation.average_value -= average_cost
+        valuation.fifo_value -= fifo_cost
+        if abs(valuation.quantity) <= TOLERANCE:
+            # Nothing left to value: drop rounding residue
+            valuation.quantity, valuation.average_value = 0, ZERO
+            if not self.layers[key]:
+                valuation.fifo_value = ZERO
+        return average_cost, fifo_cost, slices
+
+    def put(self, key, slices, average_cost, reference):
+        valuation = self.valuation(key)
+        for received_at, unit_cost, quantity in slices:
+            self.add_layer(CostLayer(
+                product_id=key[0], warehouse_id=key[1], received_at=received_at, unit_cost=unit_cost,
+                quantity=quantity, remaining_quantity=quantity, operation_reference=reference,
+            ))
+            valuation.quantity += quantity
+            valuation.fifo_value += (unit_cost * _decimal(quantity)).quantize(CENT)
+        valuation.average_value += average_cost
+
+    def apply(self, moves, warehouses):
+        """
+        Value moves in order. Returns {index in moves: (average cost, FIFO cost)} of the
+        units each move took out of a warehouse.
+        """
+        costs = {}
+        for index, move in enumerate(moves):
+            flow = _flow(move, warehouses)
+            if flow is None:
+                continue
+            source, target, quantity = flow
+            if source:
+                average_cost, fifo_cost, slices = self.take((move.product_id, source), quantity, move.date)
+                costs[index] = (average_cost, fifo_cost)
+            else:
+                # Purchase price, or the current average for stock found by a count
+                unit_cost = move.unit_price
+                if unit_cost is None:
+                    unit_cost = self.valuation((move.product_id, target)).average_unit_cost.quantize(CENT)
+                average_cost = (unit_cost * _decimal(quantity)).quantize(CENT)
+                slices = [(move.date, unit_cost, quantity)]
+            if target:
+                self.put((move.product_id, target), slices, average_cost, move.operation_reference)
+        return costs
+
+
+def _lock_valuations(keys):
+    return {
+        (valuation.product_id, valuation.warehouse_id): valuation
+        for valuation in StockValuation.objects.select_for_update().filter(
+            product_id__in={product_id for product_id, _ in keys},
+            warehouse_id__in={warehouse_id for _, warehouse_id in keys},
+        ).order_by('pk')
+        if (valuation.product_id, valuation.warehouse_id) in keys
+    }
+
+def _open_layers(keys):
+    layers = defaultdict(list)
+    if not keys:
+        return layers
+    for layer in CostLayer.objects.select_for_update().filter(
+        product_id__in={product_id for product_id, _ in keys},
+        warehouse_id__in={warehouse_id for _, warehouse_id in keys},
+        remaining_quantity__gt=0,
+    ).order_by('received_at', 'id'):
+        if (layer.product_id, layer.warehouse_id) in keys:
+            layers[(layer.product_id, layer.warehouse_id)].append(layer)
+    return layers
+
+def lock_valuations():
+    """
+    Hold off every valuation and cost layer write until the end of the current
+    transaction, for rebuilds that replace all rows. Taken before lock_rollups(), in the
+    order validations write, and before reading the ledger.
+    """
+    if connection.vendor == 'postgresql':
+        # Row locks would miss the rows a validation inserts for a new (product, warehouse)
+        with connection.cursor() as cursor:
+            cursor.execute('LOCK TABLE {}, {} IN EXCLUSIVE MODE'.format(
+                connection.ops.quote_name(StockValuation._meta.db_table),
+                connection.ops.quote_name(CostLayer._meta.db_table),
+            ))
+    else:
+        list(StockValuation.objects.select_for_update().order_by('pk').values_list('pk', flat=True))
+        list(CostLayer.objects.select_for_update().order_by('pk').values_list('pk', flat=True))
+
+def apply_valuation(moves, warehouses):
+    """
+    Fold new moves into StockValuation and CostLayer with a constant number of queries.
+    `warehouses` maps sublocation_id -> warehouse_id. Must run in the transaction that
+    appends the moves. Returns {index in moves: (average cost, FIFO cost)} of outflows.
+    """
+    keys, outflows = set(), set()
+    for move in moves:
+        flow = _flow(move, warehouses)
+        if flow is None:
+            continue
+        source, target, _ = flow
+        if source:
+            keys.add((move.product_id, source))
+            outflows.add((move.product_id, source))
+        if target:
+            keys.add((move.product_id, target))
+    if not keys:
+        return {}
+
+    with transaction.atomic():
+        valuations = _lock_valuations(keys)
+        if len(valuations) < len(keys):
+            StockValuation.objects.bulk_create([
+                StockValuation(product_id=product_id, warehouse_id=warehouse_id)
+                for product_id, warehouse_id in keys - set(valuations)
+            ], ignore_conflicts=True)
+            valuations = _lock_valuations(keys)
+
+        state = ValuationState(valuations, _open_layers(outflows))
+        costs = state.apply(moves, warehouses)
+
+        now = timezone.now()
+        StockValuation.objects.filter(pk__in=[valuation.pk for valuation in valuations.values()]).update(
+            quantity=Case(
+                *[When(pk=valuation.pk, then=Value(valuation.quantity)) for valuation in valuations.values()],
+                output_field=FloatField(),
+            ),
+            average_value=Case(
+                *[When(pk=valuation.pk, then=Value(valuation.average_value)) for valuation in valuations.values()],
+                output_field=DecimalField(max_digits=20, decimal_places=4),
+            ),
+            fifo_value=Case(
+                *[When(pk=valuation.pk, then=Value(valuation.fifo_value)) for valuation in valuations.values()],
+                output_field=DecimalField(max_digits=20, decimal_places=4),
+            ),
+            updated_at=now,
+        )
+        if state.consumed:
+            CostLayer.objects.filter(pk__in=state.consumed).update(remaining_quantity=Case(
+                *[When(pk=pk, then=Value(layer.remaining_quantity)) for pk, layer in state.consumed.items()],
+                output_field=FloatField(),
+            ))
+        # Layers opened and used up within the batch are not worth a row
+        CostLayer.objects.bulk_create([layer for layer in state.new_layers if layer.remaining_quantity > 0])
+    return costs
@@ -1,22 +1,42 @@
 # operations/views.py
 from rest_framework import generics, status
 from rest_framework.views import APIView
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
+from django.db import transaction
 from django.http import HttpResponse
-from .models import Receipt, Delivery, InternalTransfer, StockAdjustment, MoveHistory
+from .models import Receipt, Delivery, InternalTransfer, StockAdjustment, MoveHistory, ValidationJob
 from .serializers import (
     ReceiptSerializer, DeliverySerializer, InternalTransferSerializer,
-    StockAdjustmentSerializer, MoveHistorySerializer
+    StockAdjustmentSerializer, MoveHistorySerializer, ValidationJobSerializer
+)
+from .services import (
+    increase_stock_on_receipt, decrease_stock_on_delivery, transfer_stock_on_internal_transfer,
+    adjust_stock_on_adjustment, validate_documents, release_delivery_items
 )
-from .services import increase_stock_on_receipt, decrease_stock_on_delivery, transfer_stock_on_internal_transfer, adjust_stock_on_adjustment
 from .utils import generate_reference, generate_receipt_pdf, generate_delivery_pdf
+from .jobs import enqueue_validation
+from .importers import FORMATS, IMPORTERS, run_import
 import logging
 
 logger = logging.getLogger(__name__)
 
+def wants_async(request):
+    """Validation runs in the background when the client sends ?async=true (or "async": true)."""
+    value = request.query_params.get('async')
+    if value is None and hasattr(request.data, 'get'):
+        value = request.data.get('async')
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def queued_response(job):
+    return Response({
+        'message': 'Validation queued',
+        'job': ValidationJobSerializer(job).data
+    }, status=status.HTTP_202_ACCEPTED)
+
 # Receipts
 class ReceiptListCreateView(generics.ListCreateAPIView):
     queryset = Receipt.objects.all()
@@ -29,10 +49,7 @@ class ReceiptListCreateView(generics.ListCreateAPIView):
     ordering = ['-created_at']
 
     def perform_create(self, serializer):
-        receipt = serializer.save()
-        # Generate reference after creation
-        receipt.reference = generate_reference(receipt.warehouse, 'IN')
-        receipt.save()
+        serializer.save(reference=generate_reference(serializer.validated_data['warehouse'], 'IN'))
 
 class ReceiptDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Receipt.objects.all()
@@ -44,14 +61,20 @@ class ReceiptValidateView(APIView):
 
     def post(self, request, pk):
         try:
-            receipt = Receipt.objects.get(pk=pk)
-            if receipt.validated:
-                return Response({'error': 'Receipt already validated'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Validate receipt
-            increase_stock_on_receipt(receipt, request.user)
-            receipt.validated = True
-            receipt.save()
+            if wants_async(request):
+                if not Receipt.objects.filter(pk=pk).exists():
+                    raise Receipt.DoesNotExist
+                return queued_response(enqueue_validation('receipt', pk, request.user))
+
+            with transaction.atomic():
+                receipt = Receipt.objects.select_for_update().get(pk=pk)
+                if receipt.validated:
+                    return Response({'error': 'Receipt already validated'}, status=status.HTTP_400_BAD_REQUEST)
+
+                # Validate receipt
+                increase_stock_on_receipt(receipt, request.user)
+                receipt.validated = True
+                receipt.save()
             
             logger.info(f"Receipt {receipt.reference} validated by {request.user.username}")
             return Response({'message': 'Receipt validated successfully'})
@@ -91,27 +114,36 @@ class DeliveryListCreateView(generics.ListCreateAPIView):
     ordering = ['-created_at']
 
     def perform_create(self, serializer):
-        delivery = serializer.save()
-        delivery.reference = generate_reference(delivery.warehouse, 'OUT')
-        delivery.save()
+        serializer.save(reference=generate_reference(serializer.validated_data['warehouse'], 'OUT'))
 
 class DeliveryDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Delivery.objects.all()
     serializer_class = DeliverySerializer
     permission_classes = [IsAuthenticated]
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            release_delivery_items(instance.items.all())
+            instance.delete()
+
 class DeliveryValidateView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, pk):
         try:
-            delivery = Delivery.objects.get(pk=pk)
-            if delivery.validated:
-                return Response({'error': 'Delivery already validated'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            decrease_stock_on_delivery(delivery, request.user)
-            delivery.validated = True
-            delivery.save()
+            if wants_async(request):
+                if not Delivery.objects.filter(pk=pk).exists():
+                    raise Delivery.DoesNotExist
+                return queued_response(enqueue_validation('delivery', pk, request.user))
+
+            with transaction.atomic():
+                delivery = Delivery.objects.select_for_update().get(pk=pk)
+                if delivery.validated:
+                    return Response({'error': 'Delivery already validated'}, status=status.HTTP_400_BAD_REQUEST)
+
+                decrease_stock_on_delivery(delivery, request.user)
+                delivery.validated = True
+                delivery.save()
             
             logger.info(f"Delivery {delivery.reference} validated by {request.user.username}")
             return Response({'message': 'Delivery validated successfully'})
@@ -151,9 +183,7 @@ class TransferListCreateView(generics.ListCreateAPIView):
     ordering = ['-created_at']
 
     def perform_create(self, serializer):
-        transfer = serializer.save()
-        transfer.reference = generate_reference(transfer.from_warehouse, 'INT')
-        transfer.save()
+        serializer.save(reference=generate_reference(serializer.validated_data['from_warehouse'], 'INT'))
 
 class TransferDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = InternalTransfer.objects.all()
@@ -165,13 +195,19 @@ class TransferValidateView(APIView):
 
     def post(self, request, pk):
         try:
-            transfer = InternalTransfer.objects.get(pk=pk)
-            if transfer.validated:
-                return Response({'error': 'Transfer already validated'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            transfer_stock_on_internal_transfer(transfer, request.user)
-            transfer.validated = True
-            transfer.save()
+            if wants_async(request):
+                if not InternalTransfer.objects.filter(pk=pk).exists():
+                    raise InternalTransfer.DoesNotExist
+                return queued_response(enqueue_validation('transfer', pk, request.user))
+
+            with transaction.atomic():
+                transfer = InternalTransfer.objects.select_for_update().get(pk=pk)
+                if transfer.validated:
+                    return Response({'error': 'Transfer already validated'}, status=status.HTTP_400_BAD_REQUEST)
+
+                transfer_stock_on_internal_transfer(transfer, request.user)
+                transfer.validated = True
+                transfer.save()
             
             logger.info(f"Transfer {transfer.reference} validated by {request.user.username}")
             return Response({'message': 'Transfer validated successfully'})
@@ -181,6 +217,82 @@ class TransferValidateView(APIView):
             logger.error(f"Error validating transfer {pk}: {str(e)}")
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+# Batch validation
+class BatchValidateView(APIView):
+    """
+    Validate many documents in one request.
+    POST {"receipts": [1, 2], "deliveries": [3], "transfers": [4]}
+    """
+    permission_classes = [IsAuthenticated]
+    document_fields = {'receipts': 'receipt', 'deliveries': 'delivery', 'transfers': 'transfer'}
+
+    def post(self, request):
+        documents = {}
+        for field, kind in self.document_fields.items():
+            ids = request.data.get(field) or []
+            if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+                return Response({'error': f'{field} must be a list of IDs'}, status=status.HTTP_400_BAD_REQUEST)
+            documents[kind] = ids
+        if not any(documents.values()):
+            return Response({'error': 'No documents to validate'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if wants_async(request):
+            jobs = [
+                enqueue_validation(kind, document_id, request.user)
+                for kind, ids in documents.items()
+                for document_id in dict.fromkeys(ids)
+            ]
+            logger.info(f"Batch of {len(jobs)} documents queued for validation by {request.user.username}")
+            return Response({
+                'message': f'{len(jobs)} documents queued for validation',
+                'jobs': ValidationJobSerializer(jobs, many=True).data
+            }, status=status.HTTP_202_ACCEPTED)
+
+        try:
+            results = validate_documents(documents, request.user)
+        except Exception as e:
+            logger.error(f"Error validating document batch: {str(e)}")
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        validated = sum(1 for result in results if result['success'])
+        logger.info(f"Batch of {len(results)} documents validated by {request.user.username}: {validated} succeeded")
+        return Response({
+            'message': f'{validated} of {len(results)} documents validated',
+            'validated': validated,
+            'failed': len(results) - validated,
+            'results': results,
+        })
+
+class ValidationJobDetailView(generics.RetrieveAPIView):
+    """Poll the status of a queued validation"""
+    queryset = ValidationJob.objects.all()
+    serializer_class = ValidationJobSerializer
+    permission_classes = [IsAuthenticated]
+
+class ImportView(APIView):
+    """
+    Bulk import from an uploaded CSV or JSONL file.
+    POST multipart "file" to /import/<products|sublocations|opening-stock>/ (?dry_run=true to only validate)
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, kind):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'file is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if kind not in IMPORTERS:
+            return Response({'error': f"Unknown import '{kind}'"}, status=status.HTTP_404_NOT_FOUND)
+        fmt = (request.data.get('format') or upload.name.rsplit('.', 1)[-1]).lower()
+        if fmt not in FORMATS:
+            return Response({'error': f"format must be one of {', '.join(FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        dry_run = str(request.query_params.get('dry_run', request.data.get('dry_run'))).lower() in ('1', 'true', 'yes')
+
+        # Large uploads are spooled to disk by Django and read back line by line
+        summary = run_import(kind, upload.file, fmt, dry_run=dry_run, user=request.user)
+        logger.info(f"Import {kind} from {upload.name} by {request.user.username}: {summary['imported']} rows imported")
+        return Response(summary, status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)
+
 # Stock Adjustments
 class AdjustmentListCreateView(generics.ListCreateAPIView):
     queryset = StockAdjustment.objects.all()
@@ -188,11 +300,12 @@ class AdjustmentListCreateView(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
-        adjustment = serializer.save()
-        adjustment.reference = f"ADJ-{adjustment.id:04d}"
-        adjustment.save()
-        # Adjust stock immediately
-        adjust_stock_on_adjustment(adjustment, self.request.user)
+        with transaction.atomic():
+            adjustment = serializer.save()
+            adjustment.reference = f"ADJ-{adjustment.id:04d}"
+            adjustment.save()
+            # Adjust stock immediately
+            adjust_stock_on_adjustment(adjustment, self.request.user)
 
 class AdjustmentDetailView(generics.RetrieveAPIView):
     queryset = StockAdjustment.objects.all()
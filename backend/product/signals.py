@@ -0,0 +1,9 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from backend.cache import PRODUCT_CACHE, invalidate
+from product.models import Product
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_saved_handler(sender, **kwargs):
+    invalidate(PRODUCT_CACHE)
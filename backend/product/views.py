@@ -1,5 +1,8 @@
 
 import logging
+from datetime import datetime
+from django.db.models import ProtectedError
+from django.utils import timezone
 from rest_framework import generics, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -9,6 +12,8 @@ from .models import Product
 from .serializers import ProductListSerializer, ProductDetailSerializer
 from warehouse.models import Stock, SubLocation
 from warehouse.serializers import StockListSerializer
+from operations.services import stock_as_of
+from backend.cache import PRODUCT_CACHE, CachedResponseMixin
 from rest_framework.views import APIView
 # GET /api/product/<id>/stock/ - Get stock per location
 class ProductStockPerLocationView(APIView):
@@ -18,6 +23,9 @@ class ProductStockPerLocationView(APIView):
         product = Product.objects.filter(pk=pk).first()
         if not product:
             return Response({'success': False, 'error': 'Product not found'}, status=404)
+        if request.query_params.get('as_of'):
+            return self.get_as_of(request, product)
+
         stock_qs = Stock.objects.filter(product=product)
         data = []
         for stock in stock_qs.select_related('sublocation__warehouse'):
@@ -29,6 +37,29 @@ class ProductStockPerLocationView(APIView):
             })
         return Response({'success': True, 'product': product.name, 'stock_per_location': data})
 
+    def get_as_of(self, request, product):
+        try:
+            as_of = datetime.fromisoformat(request.query_params['as_of'].replace('Z', '+00:00'))
+        except ValueError:
+            return Response({'success': False, 'error': 'Invalid as_of format. Use ISO format.'}, status=400)
+        if timezone.is_naive(as_of):
+            as_of = timezone.make_aware(as_of)
+
+        positions = stock_as_of(as_of, warehouse_id=request.query_params.get('warehouse'), product_id=product.id)
+        sublocations = SubLocation.objects.select_related('warehouse').in_bulk(
+            {sublocation_id for _, sublocation_id in positions}
+        )
+        data = []
+        for (_, sublocation_id), quantity in sorted(positions.items()):
+            sublocation = sublocations[sublocation_id]
+            data.append({
+                'location_id': sublocation.id,
+                'location_code': sublocation.code,
+                'warehouse': sublocation.warehouse.name,
+                'quantity': quantity
+            })
+        return Response({'success': True, 'product': product.name, 'as_of': as_of.isoformat(), 'stock_per_location': data})
+
 # GET /api/categories/ - List categories
 class CategoryListView(APIView):
     permission_classes = [IsAuthenticated]
@@ -43,22 +74,18 @@ class LowStockProductListView(APIView):
 
     def get(self, request):
         threshold = float(request.query_params.get('threshold', 10))
-        low_stock = (
-            Stock.objects.values('product')
-            .annotate(total_qty=models.Sum('quantity'))
-            .filter(total_qty__lte=threshold)
-        )
-        product_ids = [item['product'] for item in low_stock]
-        products = Product.objects.filter(id__in=product_ids)
+        # Range scan on the maintained per-product totals
+        products = Product.objects.filter(stock_total__quantity__lte=threshold)
         serializer = ProductListSerializer(products, many=True)
         return Response({'success': True, 'low_stock_products': serializer.data})
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
 
-class ProductListCreateView(generics.ListCreateAPIView):
+class ProductListCreateView(CachedResponseMixin, generics.ListCreateAPIView):
     queryset = Product.objects.all()
     permission_classes = [IsAuthenticated]
+    cache_namespaces = (PRODUCT_CACHE,)
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['category', 'unit']
     search_fields = ['name']
@@ -74,14 +101,16 @@ class ProductListCreateView(generics.ListCreateAPIView):
         ip_address = request.META.get('REMOTE_ADDR', 'Unknown')
         user = request.user
         logger.info(f"[PRODUCT] GET request - List products by user: {getattr(user, 'username', 'Anonymous')} (ID: {getattr(user, 'id', 'N/A')}), IP: {ip_address}")
-        products = self.get_queryset()
-        serializer = self.get_serializer(products, many=True)
-        logger.info(f"[PRODUCT] SUCCESS - Retrieved {products.count()} products")
-        return Response({
-            'success': True,
-            'count': products.count(),
-            'products': serializer.data
-        })
+        def compute():
+            products = self.get_serializer(self.get_queryset(), many=True).data
+            return {
+                'success': True,
+                'count': len(products),
+                'products': products
+            }
+        payload = self.cached_payload(request, compute)
+        logger.info(f"[PRODUCT] SUCCESS - Retrieved {payload['count']} products")
+        return Response(payload)
 
     def post(self, request, *args, **kwargs):
         ip_address = request.META.get('REMOTE_ADDR', 'Unknown')
@@ -164,7 +193,14 @@ class ProductRetrieveUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
         user = request.user
         product = self.get_object()
         logger.info(f"[PRODUCT] DELETE request - Delete product: {product.name} (ID: {product.id}) by user: {getattr(user, 'username', 'Anonymous')} (ID: {getattr(user, 'id', 'N/A')}), IP: {ip_address}")
-        product.delete()
+        try:
+            product.delete()
+        except ProtectedError:
+            logger.warning(f"[PRODUCT] FAILED - Product has stock movements: {product.name} (ID: {product.id})")
+            return Response({
+                'success': False,
+                'error': 'Product has stock movements in the ledger and cannot be deleted'
+            }, status=status.HTTP_409_CONFLICT)
         logger.info(f"[PRODUCT] SUCCESS - Product deleted: {product.name} (ID: {product.id})")
         return Response({
             'success': True,
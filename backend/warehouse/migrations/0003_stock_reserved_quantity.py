@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0002_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='reserved_quantity',
+            field=models.FloatField(default=0),
+        ),
+    ]
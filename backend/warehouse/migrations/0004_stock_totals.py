@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def populate_totals(apps, schema_editor):
+    Stock = apps.get_model('warehouse', 'Stock')
+    ProductStockTotal = apps.get_model('warehouse', 'ProductStockTotal')
+    ProductWarehouseStockTotal = apps.get_model('warehouse', 'ProductWarehouseStockTotal')
+    ProductStockTotal.objects.bulk_create([
+        ProductStockTotal(product_id=row['product_id'], quantity=row['total'])
+        for row in Stock.objects.values('product_id').annotate(total=Sum('quantity')).order_by()
+    ])
+    ProductWarehouseStockTotal.objects.bulk_create([
+        ProductWarehouseStockTotal(product_id=row['product_id'], warehouse_id=row['warehouse_id'], quantity=row['total'])
+        for row in Stock.objects.values('product_id', warehouse_id=F('sublocation__warehouse_id'))
+        .annotate(total=Sum('quantity')).order_by()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0001_initial'),
+        ('warehouse', '0003_stock_reserved_quantity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStockTotal',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_total', serialize=False, to='product.product')),
+                ('quantity', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['quantity'], name='warehouse_p_quantit_4bbbf8_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductWarehouseStockTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='warehouse_stock_totals', to='product.product')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_stock_totals', to='warehouse.warehouse')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'quantity'], name='warehouse_p_product_9d753f_idx'), models.Index(fields=['warehouse', 'quantity'], name='warehouse_p_warehou_211eec_idx')],
+                'unique_together': {('product', 'warehouse')},
+            },
+        ),
+        migrations.RunPython(populate_totals, migrations.RunPython.noop),
+    ]
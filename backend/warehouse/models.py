@@ -99,6 +99,9 @@ class Stock(models.Model):
 
     quantity = models.FloatField(default=0)
 
+    # Allocated to unvalidated deliveries (see operations.services.reserve_delivery_items)
+    reserved_quantity = models.FloatField(default=0)
+
     # Optional but VERY useful for tracking warehouse ops
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -108,4 +111,57 @@ class Stock(models.Model):
         verbose_name_plural = "Stock Records"
 
     def __str__(self):
-        return f"{self.product.sku} @ {self.sublocation.code} = {self.quantity}"
\ No newline at end of file
+        return f"{self.product.sku} @ {self.sublocation.code} = {self.quantity}"
+
+    @property
+    def available_quantity(self):
+        """On hand minus reserved (available to promise)"""
+        return self.quantity - self.reserved_quantity
+
+class ProductStockTotal(models.Model):
+    """
+    On-hand quantity of a product across all warehouses, kept in step with Stock
+    (see warehouse.totals) so threshold queries are index range scans.
+    """
+    product = models.OneToOneField(
+        'product.Product',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="stock_total"
+    )
+    quantity = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['quantity'])]
+
+    def __str__(self):
+        return f"{self.product_id} = {self.quantity}"
+
+
+class ProductWarehouseStockTotal(models.Model):
+    """
+    On-hand quantity of a product in one warehouse, kept in step with Stock.
+    """
+    product = models.ForeignKey(
+        'product.Product',
+        on_delete=models.CASCADE,
+        related_name="warehouse_stock_totals"
+    )
+    warehouse = models.ForeignKey(
+        Warehouse,
+        on_delete=models.CASCADE,
+        related_name="product_stock_totals"
+    )
+    quantity = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('product', 'warehouse')
+        indexes = [
+            models.Index(fields=['product', 'quantity']),
+            models.Index(fields=['warehouse', 'quantity']),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} @ {self.warehouse_id} = {self.quantity}"
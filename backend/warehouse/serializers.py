@@ -88,6 +88,7 @@ class StockListSerializer(serializers.ModelSerializer):
             'product_name',
             'product_sku',
             'quantity',
+            'reserved_quantity',
             'sublocation_code',
         ]
 
@@ -108,6 +109,7 @@ class StockDetailSerializer(serializers.ModelSerializer):
             'warehouse',
             'sublocation',
             'quantity',
+            'reserved_quantity',
             'updated_at'
         ]
 
@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from backend.cache import STOCK_CACHE, WAREHOUSE_CACHE, invalidate
+from warehouse.models import Stock, SubLocation, Warehouse
+from warehouse.totals import refresh_stock_totals
+from operations.signals import stock_changed
+
+
+@receiver([post_save, post_delete], sender=Stock)
+def stock_saved_handler(sender, instance, **kwargs):
+    # The mutation engine maintains totals itself; this covers admin edits and fixtures
+    refresh_stock_totals([instance.product_id])
+    invalidate(STOCK_CACHE)
+
+@receiver(stock_changed)
+def stock_changed_handler(sender, **kwargs):
+    invalidate(STOCK_CACHE)
+
+@receiver([post_save, post_delete], sender=Warehouse)
+@receiver([post_save, post_delete], sender=SubLocation)
+def warehouse_saved_handler(sender, **kwargs):
+    invalidate(WAREHOUSE_CACHE)
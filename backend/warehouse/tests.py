@@ -1,3 +1,92 @@
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from product.models import Product
+from .models import ProductStockTotal, ProductWarehouseStockTotal, Stock, SubLocation, Warehouse
+from .totals import _lock_totals, apply_total_deltas, refresh_stock_totals
+
+
+def make_products(count, prefix='P'):
+    return Product.objects.bulk_create([
+        Product(sku=f"{prefix}-{i:05d}", name=f"Product {i}", category='FIN', type='Unit', weight=1)
+        for i in range(count)
+    ])
+
+
+class StockTotalsTests(TestCase):
+    """
+    Totals follow Stock, whether it changes through deltas or through a direct write.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.north = Warehouse.objects.create(name="North", code="N")
+        cls.south = Warehouse.objects.create(name="South", code="S")
+        cls.bin_n = SubLocation.objects.create(warehouse=cls.north, aisle="A1")
+        cls.bin_s = SubLocation.objects.create(warehouse=cls.south, aisle="B1")
+        cls.apple, cls.pear = make_products(2)
+        cls.warehouses = {cls.bin_n.pk: cls.north.pk, cls.bin_s.pk: cls.south.pk}
+
+    def totals(self):
+        return (
+            dict(ProductStockTotal.objects.values_list('product_id', 'quantity')),
+            {
+                (product_id, warehouse_id): quantity for product_id, warehouse_id, quantity in
+                ProductWarehouseStockTotal.objects.values_list('product_id', 'warehouse_id', 'quantity')
+            },
+        )
+
+    def test_deltas_create_and_add_to_totals(self):
+        apply_total_deltas({(self.apple.pk, self.bin_n.pk): 5, (self.apple.pk, self.bin_s.pk): 2}, self.warehouses)
+        apply_total_deltas({(self.apple.pk, self.bin_n.pk): -1, (self.pear.pk, self.bin_s.pk): 3}, self.warehouses)
+
+        self.assertEqual(self.totals(), (
+            {self.apple.pk: 6, self.pear.pk: 3},
+            {(self.apple.pk, self.north.pk): 4, (self.apple.pk, self.south.pk): 2, (self.pear.pk, self.south.pk): 3},
+        ))
+
+    def test_only_requested_pairs_are_locked(self):
+        apply_total_deltas({
+            (product.pk, location.pk): 1 for product in (self.apple, self.pear) for location in (self.bin_n, self.bin_s)
+        }, self.warehouses)
+        keys = {(self.apple.pk, self.north.pk), (self.pear.pk, self.south.pk)}
+
+        with transaction.atomic(), CaptureQueriesContext(connection) as ctx:
+            locked = _lock_totals(ProductWarehouseStockTotal, ('product_id', 'warehouse_id'), keys)
+            self.assertEqual(len(ctx.captured_queries), 1)
+            sql = ctx.captured_queries[0]['sql']
+            # The statement as sent must select the two pairs, not both warehouses of each product
+            with connection.cursor() as cursor:
+                cursor.execute(sql)
+                selected = {(row[1], row[2]) for row in cursor.fetchall()}
+        self.assertEqual(selected, keys)
+        self.assertEqual(set(locked), keys)
+
+    def test_direct_stock_writes_refresh_totals(self):
+        stock = Stock.objects.create(product=self.apple, sublocation=self.bin_n, quantity=7)
+        Stock.objects.create(product=self.pear, sublocation=self.bin_s, quantity=2)
+        self.assertEqual(self.totals(), (
+            {self.apple.pk: 7, self.pear.pk: 2},
+            {(self.apple.pk, self.north.pk): 7, (self.pear.pk, self.south.pk): 2},
+        ))
+
+        stock.quantity = 4
+        stock.save()
+        self.assertEqual(self.totals()[0][self.apple.pk], 4)
+
+        stock.delete()
+        self.assertEqual(self.totals(), ({self.pear.pk: 2}, {(self.pear.pk, self.south.pk): 2}))
+
+    def test_refresh_repairs_drift_for_the_given_products_only(self):
+        Stock.objects.bulk_create([
+            Stock(product=self.apple, sublocation=self.bin_n, quantity=3),
+            Stock(product=self.pear, sublocation=self.bin_s, quantity=5),
+        ])
+        ProductWarehouseStockTotal.objects.create(product=self.apple, warehouse=self.south, quantity=9)
+
+        refresh_stock_totals([self.apple.pk])
+        self.assertEqual(self.totals(), ({self.apple.pk: 3}, {(self.apple.pk, self.north.pk): 3}))
+
+        refresh_stock_totals()
+        self.assertEqual(self.totals()[0], {self.apple.pk: 3, self.pear.pk: 5})
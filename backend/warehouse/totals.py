@@ -0,0 +1,151 @@
+from collections import defaultdict
+from functools import reduce
+import operator
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Q, Sum, Value, When
+from django.utils import timezone
+from warehouse.models import ProductStockTotal, ProductWarehouseStockTotal, Stock
+
+LOCK_BRANCHES = 500
+
+
+def _key_filters(key_fields, keys):
+    """
+    Filters selecting exactly the given keys: one OR branch per value of whichever key
+    field has fewer distinct values, listing only its requested partners. Very wide key
+    sets are split into several filters.
+    """
+    first, *rest = key_fields
+    if not rest:
+        return [Q(**{f'{first}__in': sorted(key[0] for key in keys)})]
+    (second,) = rest
+    by_first = defaultdict(list)
+    by_second = defaultdict(list)
+    for lead, partner in keys:
+        by_first[lead].append(partner)
+        by_second[partner].append(lead)
+
+    if len(by_second) < len(by_first):
+        branches = [Q(**{second: value, f'{first}__in': others}) for value, others in sorted(by_second.items())]
+    else:
+        branches = [Q(**{first: value, f'{second}__in': others}) for value, others in sorted(by_first.items())]
+    return [reduce(operator.or_, branches[i:i + LOCK_BRANCHES]) for i in range(0, len(branches), LOCK_BRANCHES)]
+
+def _lock_totals(model, key_fields, keys):
+    """
+    Lock exactly the total rows of `model` for `keys`, in key order. Returns {key: pk}.
+    """
+    rows = {}
+    for condition in _key_filters(key_fields, keys):
+        rows.update(
+            (tuple(row[1:]), row[0])
+            for row in model.objects.select_for_update().filter(condition)
+            .order_by(*key_fields).values_list('pk', *key_fields)
+        )
+    return rows
+
+def _create_missing(model, key_fields, keys):
+    # Sorted so concurrent inserts of overlapping keys queue up instead of deadlocking
+    model.objects.bulk_create([
+        model(**dict(zip(key_fields, key)), quantity=0) for key in sorted(keys)
+    ], ignore_conflicts=True)
+
+def _add_to_totals(model, key_fields, deltas):
+    """
+    Add {key: delta} to the total rows of `model`, creating missing rows first.
+    Rows are locked in key order, after the Stock rows they summarise.
+    """
+    if not deltas:
+        return
+    _create_missing(model, key_fields, deltas)
+    rows = _lock_totals(model, key_fields, deltas)
+    model.objects.filter(pk__in=rows.values()).update(
+        quantity=F('quantity') + Case(
+            *[When(pk=pk, then=Value(deltas[key])) for key, pk in rows.items()],
+            default=Value(0.0),
+            output_field=FloatField(),
+        ),
+        updated_at=timezone.now(),
+    )
+
+def _set_totals(model, rows, quantities):
+    """
+    Overwrite the locked total `rows` {key: pk} with `quantities`, deleting rows of keys
+    that no longer have any Stock.
+    """
+    model.objects.filter(pk__in=[pk for key, pk in rows.items() if key not in quantities]).delete()
+    kept = {key: pk for key, pk in rows.items() if key in quantities}
+    if kept:
+        model.objects.filter(pk__in=kept.values()).update(
+            quantity=Case(
+                *[When(pk=pk, then=Value(quantities[key])) for key, pk in kept.items()],
+                output_field=FloatField(),
+            ),
+            updated_at=timezone.now(),
+        )
+
+def apply_total_deltas(deltas, warehouses):
+    """
+    Fold Stock quantity deltas {(product_id, sublocation_id): delta} into the per-product
+    and per-(product, warehouse) totals. `warehouses` maps sublocation_id -> warehouse_id.
+    Must run in the transaction that changed Stock.
+    """
+    by_product = defaultdict(float)
+    by_warehouse = defaultdict(float)
+    for (product_id, sublocation_id), delta in deltas.items():
+        if delta:
+            by_product[(product_id,)] += delta
+            by_warehouse[(product_id, warehouses[sublocation_id])] += delta
+
+    with transaction.atomic():
+        _add_to_totals(ProductStockTotal, ('product_id',), by_product)
+        _add_to_totals(ProductWarehouseStockTotal, ('product_id', 'warehouse_id'), by_warehouse)
+
+def refresh_stock_totals(product_ids=None):
+    """
+    Recompute totals from Stock, for the given products or for all of them.
+    Used after Stock is written outside the mutation engine.
+
+    Takes the products' Stock rows and then their totals, in the order apply_total_deltas
+    does, and only sums Stock once both are held: a concurrent validation either commits
+    first and is counted, or waits and adds its delta to the refreshed total.
+    """
+    stocks = Stock.objects.all()
+    product_totals = ProductStockTotal.objects.all()
+    warehouse_totals = ProductWarehouseStockTotal.objects.all()
+    if product_ids is not None:
+        stocks = stocks.filter(product_id__in=product_ids)
+        product_totals = product_totals.filter(product_id__in=product_ids)
+        warehouse_totals = warehouse_totals.filter(product_id__in=product_ids)
+
+    def sums():
+        by_product = {
+            (row['product_id'],): row['total']
+            for row in stocks.values('product_id').annotate(total=Sum('quantity')).order_by()
+        }
+        by_warehouse = {
+            (row['product_id'], row['warehouse_id']): row['total']
+            for row in stocks.values('product_id', warehouse_id=F('sublocation__warehouse_id'))
+            .annotate(total=Sum('quantity')).order_by()
+        }
+        return by_product, by_warehouse
+
+    with transaction.atomic():
+        list(stocks.select_for_update().order_by('product_id', 'sublocation_id').values_list('pk', flat=True))
+        by_product, by_warehouse = sums()
+        _create_missing(ProductStockTotal, ('product_id',), by_product)
+        _create_missing(ProductWarehouseStockTotal, ('product_id', 'warehouse_id'), by_warehouse)
+
+        product_rows = {
+            (product_id,): pk for pk, product_id in
+            product_totals.select_for_update().order_by('product_id').values_list('pk', 'product_id')
+        }
+        warehouse_rows = {
+            (product_id, warehouse_id): pk for pk, product_id, warehouse_id in
+            warehouse_totals.select_for_update().order_by('product_id', 'warehouse_id')
+            .values_list('pk', 'product_id', 'warehouse_id')
+        }
+        # Stock committed while we waited for the totals is visible to these sums
+        by_product, by_warehouse = sums()
+        _set_totals(ProductStockTotal, product_rows, by_product)
+        _set_totals(ProductWarehouseStockTotal, warehouse_rows, by_warehouse)
@@ -1,6 +1,6 @@
 from django.urls import path
 from .views import (
-    StockDetailView, StockListView, WarehouseListView, WarehouseDetailView,
+    StockAvailabilityView, StockDetailView, StockListView, WarehouseListView, WarehouseDetailView,
     SubLocationListView, SubLocationDetailView, SubLocationByWarehouseView
 )
 
@@ -17,5 +17,6 @@ urlpatterns = [
     path('sublocations/warehouse/<int:warehouse_id>/', SubLocationByWarehouseView.as_view(), name='sublocation-by-warehouse'),
      #stock apis
     path('stock/', StockListView.as_view(), name='stock-list'),
+    path('stock/available/', StockAvailabilityView.as_view(), name='stock-available'),
     path('stock/<int:pk>/', StockDetailView.as_view(), name='stock-detail'),
 ]
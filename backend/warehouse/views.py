@@ -1,12 +1,18 @@
 import logging
+from datetime import datetime
+from django.db.models import ProtectedError
 from django.forms import ValidationError
+from django.utils import timezone
 from rest_framework import generics, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from .models import Stock, Warehouse, SubLocation
+from product.models import Product
 from .serializers import StockDetailSerializer, StockListSerializer, WarehouseSerializer, SubLocationSerializer
+from operations.services import available_to_promise, stock_as_of
+from backend.cache import PRODUCT_CACHE, STOCK_CACHE, WAREHOUSE_CACHE, CachedResponseMixin
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
@@ -16,7 +22,7 @@ logger = logging.getLogger(__name__)
 # WAREHOUSE VIEWS
 # ---------------------------------------------------
 
-class WarehouseListView(generics.ListCreateAPIView):
+class WarehouseListView(CachedResponseMixin, generics.ListCreateAPIView):
     """
     List all warehouses or create a new warehouse
     GET: List all warehouses
@@ -30,6 +36,7 @@ class WarehouseListView(generics.ListCreateAPIView):
     search_fields = ['name']
     ordering_fields = ['name', 'created_at']
     ordering = ['name']
+    cache_namespaces = (WAREHOUSE_CACHE,)
 
     def get(self, request):
         """List all warehouses"""
@@ -39,17 +46,19 @@ class WarehouseListView(generics.ListCreateAPIView):
         logger.info(f"[WAREHOUSE] GET request - List warehouses by user: {user.username} (ID: {user.id}), IP: {ip_address}")
         print(f"[WAREHOUSE] GET request - List warehouses by user: {user.username} (ID: {user.id}), IP: {ip_address}")
         
-        warehouses = self.get_queryset()
-        serializer = self.get_serializer(warehouses, many=True)
+        def compute():
+            warehouses = self.get_serializer(self.get_queryset(), many=True).data
+            return {
+                'success': True,
+                'count': len(warehouses),
+                'warehouses': warehouses
+            }
+        payload = self.cached_payload(request, compute)
         
-        logger.info(f"[WAREHOUSE] SUCCESS - Retrieved {warehouses.count()} warehouses")
-        print(f"[WAREHOUSE] SUCCESS - Retrieved {warehouses.count()} warehouses")
+        logger.info(f"[WAREHOUSE] SUCCESS - Retrieved {payload['count']} warehouses")
+        print(f"[WAREHOUSE] SUCCESS - Retrieved {payload['count']} warehouses")
         
-        return Response({
-            'success': True,
-            'count': warehouses.count(),
-            'warehouses': serializer.data
-        })
+        return Response(payload)
 
     def post(self, request):
         """Create a new warehouse"""
@@ -184,7 +193,15 @@ class WarehouseDetailView(generics.RetrieveUpdateDestroyAPIView):
         logger.info(f"[WAREHOUSE] DELETE request - Delete warehouse: {warehouse_name} (ID: {warehouse_id}) by user: {user.username} (ID: {user.id}), IP: {ip_address}")
         print(f"[WAREHOUSE] DELETE request - Delete warehouse: {warehouse_name} (ID: {warehouse_id}) by user: {user.username} (ID: {user.id}), IP: {ip_address}")
         
-        warehouse.delete()
+        try:
+            warehouse.delete()
+        except ProtectedError:
+            logger.warning(f"[WAREHOUSE] FAILED - Warehouse has stock movements: {warehouse_name} (ID: {warehouse_id})")
+            print(f"[WAREHOUSE] FAILED - Warehouse has stock movements: {warehouse_name} (ID: {warehouse_id})")
+            return Response({
+                'success': False,
+                'error': 'Warehouse has stock movements in the ledger and cannot be deleted'
+            }, status=status.HTTP_409_CONFLICT)
         
         logger.info(f"[WAREHOUSE] SUCCESS - Warehouse deleted: {warehouse_name} (ID: {warehouse_id})")
         print(f"[WAREHOUSE] SUCCESS - Warehouse deleted: {warehouse_name} (ID: {warehouse_id})")
@@ -222,16 +239,15 @@ class SubLocationListView(generics.ListCreateAPIView):
         logger.info(f"[SUBLOCATION] GET request - List sub-locations by user: {user.username} (ID: {user.id}), IP: {ip_address}")
         print(f"[SUBLOCATION] GET request - List sub-locations by user: {user.username} (ID: {user.id}), IP: {ip_address}")
         
-        sublocations = self.get_queryset()
-        serializer = self.get_serializer(sublocations, many=True)
+        sublocations = self.get_serializer(self.get_queryset(), many=True).data
         
-        logger.info(f"[SUBLOCATION] SUCCESS - Retrieved {sublocations.count()} sub-locations")
-        print(f"[SUBLOCATION] SUCCESS - Retrieved {sublocations.count()} sub-locations")
+        logger.info(f"[SUBLOCATION] SUCCESS - Retrieved {len(sublocations)} sub-locations")
+        print(f"[SUBLOCATION] SUCCESS - Retrieved {len(sublocations)} sub-locations")
         
         return Response({
             'success': True,
-            'count': sublocations.count(),
-            'sublocations': serializer.data
+            'count': len(sublocations),
+            'sublocations': sublocations
         })
 
     def post(self, request):
@@ -366,7 +382,15 @@ class SubLocationDetailView(generics.RetrieveUpdateDestroyAPIView):
         logger.info(f"[SUBLOCATION] DELETE request - Delete sub-location: {sublocation_code} (ID: {sublocation_id}) by user: {user.username} (ID: {user.id}), IP: {ip_address}")
         print(f"[SUBLOCATION] DELETE request - Delete sub-location: {sublocation_code} (ID: {sublocation_id}) by user: {user.username} (ID: {user.id}), IP: {ip_address}")
         
-        sublocation.delete()
+        try:
+            sublocation.delete()
+        except ProtectedError:
+            logger.warning(f"[SUBLOCATION] FAILED - Sub-location has stock movements: {sublocation_code} (ID: {sublocation_id})")
+            print(f"[SUBLOCATION] FAILED - Sub-location has stock movements: {sublocation_code} (ID: {sublocation_id})")
+            return Response({
+                'success': False,
+                'error': 'Sub-location has stock movements in the ledger and cannot be deleted'
+            }, status=status.HTTP_409_CONFLICT)
         
         logger.info(f"[SUBLOCATION] SUCCESS - Sub-location deleted: {sublocation_code} (ID: {sublocation_id})")
         print(f"[SUBLOCATION] SUCCESS - Sub-location deleted: {sublocation_code} (ID: {sublocation_id})")
@@ -377,13 +401,14 @@ class SubLocationDetailView(generics.RetrieveUpdateDestroyAPIView):
         }, status=status.HTTP_200_OK)
 
 
-class SubLocationByWarehouseView(generics.ListAPIView):
+class SubLocationByWarehouseView(CachedResponseMixin, generics.ListAPIView):
     """
     List all sub-locations for a specific warehouse
     GET: Get all sub-locations for a warehouse
     """
     serializer_class = SubLocationSerializer
     permission_classes = [IsAuthenticated]
+    cache_namespaces = (WAREHOUSE_CACHE,)
 
     def get_queryset(self):
         warehouse_id = self.kwargs['warehouse_id']
@@ -398,18 +423,20 @@ class SubLocationByWarehouseView(generics.ListAPIView):
         logger.info(f"[SUBLOCATION] GET request - List sub-locations for warehouse: {warehouse_id} by user: {user.username} (ID: {user.id}), IP: {ip_address}")
         print(f"[SUBLOCATION] GET request - List sub-locations for warehouse: {warehouse_id} by user: {user.username} (ID: {user.id}), IP: {ip_address}")
         
-        sublocations = self.get_queryset()
-        serializer = self.get_serializer(sublocations, many=True)
+        def compute():
+            sublocations = self.get_serializer(self.get_queryset(), many=True).data
+            return {
+                'success': True,
+                'warehouse_id': warehouse_id,
+                'count': len(sublocations),
+                'sublocations': sublocations
+            }
+        payload = self.cached_payload(request, compute)
         
-        logger.info(f"[SUBLOCATION] SUCCESS - Retrieved {sublocations.count()} sub-locations for warehouse: {warehouse_id}")
-        print(f"[SUBLOCATION] SUCCESS - Retrieved {sublocations.count()} sub-locations for warehouse: {warehouse_id}")
+        logger.info(f"[SUBLOCATION] SUCCESS - Retrieved {payload['count']} sub-locations for warehouse: {warehouse_id}")
+        print(f"[SUBLOCATION] SUCCESS - Retrieved {payload['count']} sub-locations for warehouse: {warehouse_id}")
         
-        return Response({
-            'success': True,
-            'warehouse_id': warehouse_id,
-            'count': sublocations.count(),
-            'sublocations': serializer.data
-        })
+        return Response(payload)
 
 
 
@@ -419,9 +446,11 @@ class SubLocationByWarehouseView(generics.ListAPIView):
 # ---------------------------------------------------
 
 
-class StockListView(generics.ListAPIView):
+class StockListView(CachedResponseMixin, generics.ListAPIView):
     serializer_class = StockListSerializer
     permission_classes = [IsAuthenticated]
+    # Rows carry product names and sublocation codes
+    cache_namespaces = (STOCK_CACHE, PRODUCT_CACHE, WAREHOUSE_CACHE)
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['product', 'sublocation']
     search_fields = ['product__name']
@@ -448,18 +477,23 @@ class StockListView(generics.ListAPIView):
         print(f"[STOCK] GET request - List stock for warehouse: {warehouse_id} by user: {user.username} (ID: {user.id}), IP: {ip_address}")
         
         try:
-            stocks = self.get_queryset()
-            serializer = self.get_serializer(stocks, many=True)
+            if request.query_params.get('as_of'):
+                return self.get_as_of(request, warehouse_id)
+
+            def compute():
+                stocks = self.get_serializer(self.get_queryset(), many=True).data
+                return {
+                    'success': True,
+                    'warehouse_id': warehouse_id,
+                    'count': len(stocks),
+                    'stocks': stocks
+                }
+            payload = self.cached_payload(request, compute)
             
-            logger.info(f"[STOCK] SUCCESS - Retrieved {stocks.count()} stock records for warehouse: {warehouse_id}")
-            print(f"[STOCK] SUCCESS - Retrieved {stocks.count()} stock records for warehouse: {warehouse_id}")
+            logger.info(f"[STOCK] SUCCESS - Retrieved {payload['count']} stock records for warehouse: {warehouse_id}")
+            print(f"[STOCK] SUCCESS - Retrieved {payload['count']} stock records for warehouse: {warehouse_id}")
             
-            return Response({
-                'success': True,
-                'warehouse_id': warehouse_id,
-                'count': stocks.count(),
-                'stocks': serializer.data
-            })
+            return Response(payload)
         except ValidationError as e:
             logger.warning(f"[STOCK] FAILED - Validation error for warehouse: {warehouse_id}, Error: {e}")
             print(f"[STOCK] FAILED - Validation error for warehouse: {warehouse_id}, Error: {e}")
@@ -468,6 +502,46 @@ class StockListView(generics.ListAPIView):
                 'error': str(e)
             }, status=status.HTTP_400_BAD_REQUEST)
 
+    def get_as_of(self, request, warehouse_id):
+        """List stock for a warehouse as it stood at ?as_of=<ISO datetime>"""
+        if not request.query_params.get('warehouse'):
+            raise ValidationError("warehouse parameter is required, e.g. ?warehouse=1")
+        try:
+            as_of = datetime.fromisoformat(request.query_params['as_of'].replace('Z', '+00:00'))
+        except ValueError:
+            raise ValidationError("Invalid as_of format. Use ISO format.")
+        if timezone.is_naive(as_of):
+            as_of = timezone.make_aware(as_of)
+        try:
+            warehouse_id = int(warehouse_id)
+            product_id = int(request.query_params['product']) if request.query_params.get('product') else None
+        except ValueError:
+            raise ValidationError("warehouse and product must be integer ids.")
+
+        positions = stock_as_of(as_of, warehouse_id=warehouse_id, product_id=product_id)
+        products = Product.objects.in_bulk({product_id for product_id, _ in positions})
+        sublocations = SubLocation.objects.in_bulk({sublocation_id for _, sublocation_id in positions})
+        stocks = [
+            {
+                'product_name': products[product_id].name,
+                'product_sku': products[product_id].sku,
+                'quantity': quantity,
+                'sublocation_code': sublocations[sublocation_id].code,
+            }
+            for (product_id, sublocation_id), quantity in sorted(positions.items())
+        ]
+
+        logger.info(f"[STOCK] SUCCESS - Retrieved {len(stocks)} stock records for warehouse: {warehouse_id} as of {as_of.isoformat()}")
+        print(f"[STOCK] SUCCESS - Retrieved {len(stocks)} stock records for warehouse: {warehouse_id} as of {as_of.isoformat()}")
+
+        return Response({
+            'success': True,
+            'warehouse_id': warehouse_id,
+            'as_of': as_of.isoformat(),
+            'count': len(stocks),
+            'stocks': stocks
+        })
+
 
 class StockDetailView(generics.RetrieveAPIView):
     queryset = Stock.objects.select_related(
@@ -494,4 +568,35 @@ class StockDetailView(generics.RetrieveAPIView):
         return Response({
             'success': True,
             'stock': serializer.data
-        })
\ No newline at end of file
+        })
+
+class StockAvailabilityView(generics.GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """Available-to-promise quantity of a product: on hand minus open delivery reservations"""
+        ip_address = request.META.get('REMOTE_ADDR', 'Unknown')
+        user = request.user
+        product_id = request.query_params.get('product')
+        warehouse_id = request.query_params.get('warehouse')
+
+        logger.info(f"[STOCK] GET request - Availability of product: {product_id} in warehouse: {warehouse_id or 'all'} by user: {user.username} (ID: {user.id}), IP: {ip_address}")
+        print(f"[STOCK] GET request - Availability of product: {product_id} in warehouse: {warehouse_id or 'all'} by user: {user.username} (ID: {user.id}), IP: {ip_address}")
+
+        if not product_id:
+            return Response({
+                'success': False,
+                'error': "product parameter is required, e.g. ?product=1"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        totals = available_to_promise(product_id, warehouse_id=warehouse_id)
+
+        logger.info(f"[STOCK] SUCCESS - Product {product_id}: {totals['available']} available of {totals['on_hand']} on hand")
+        print(f"[STOCK] SUCCESS - Product {product_id}: {totals['available']} available of {totals['on_hand']} on hand")
+
+        return Response({
+            'success': True,
+            'product_id': product_id,
+            'warehouse_id': warehouse_id,
+            **totals
+        })